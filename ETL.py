@@ -1,7 +1,14 @@
+import argparse
+import os
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import seaborn as sns
-import os
+from matplotlib.figure import Figure
+
+from card_bitmasks import COLORS, contains_any, sum_by_bit
+from card_data import iter_merged_prices, iter_price_chunks, load_cards, merge_price_chunks
+from etl_pipeline import Pipeline, format_report
 
 # Erhalte den aktuellen Ordner
 current_directory = os.getcwd()
@@ -10,144 +17,235 @@ current_directory = os.getcwd()
 cards_file = os.path.join(current_directory, 'cards.csv')
 card_prices_file = os.path.join(current_directory, 'cardPrices.csv')
 
-# Lade die CSV-Dateien
-data = pd.read_csv(cards_file)
-datacost = pd.read_csv(card_prices_file)
-
-# Überprüfe die ersten paar Zeilen der geladenen Daten
-print(data.head())
-print(datacost.head())
-
-
-
-print("Fehlende Werte in 'data':")
-print(data.isna().sum())
-
-print("\nFehlende Werte in 'datacost':")
-print(datacost.isna().sum())
-
-
-# Entferne Zeilen mit fehlenden Werten aus den beiden Datensätzen
-data_clean = data.dropna()
-datacost_clean = datacost.dropna()
-
-# Überprüfe, ob die fehlenden Werte entfernt wurden
-print("\nFehlende Werte nach dem Entfernen in 'data':")
-print(data_clean.isna().sum())
-
-print("\nFehlende Werte nach dem Entfernen in 'datacost':")
-print(datacost_clean.isna().sum())
-
-
-
-# Überprüfe auf Duplikate in beiden Datensätzen
-print("\nDuplikate in 'data':")
-print(data.duplicated().sum())
-
-print("\nDuplikate in 'datacost':")
-print(datacost.duplicated().sum())
-
-
-# Entferne Duplikate aus den beiden Datensätzen
-data_clean_no_duplicates = data_clean.drop_duplicates()
-datacost_clean_no_duplicates = datacost_clean.drop_duplicates()
-
-# Überprüfe, ob die Duplikate entfernt wurden
-print("\nDuplikate nach dem Entfernen in 'data':")
-print(data_clean_no_duplicates.duplicated().sum())
-
-print("\nDuplikate nach dem Entfernen in 'datacost':")
-print(datacost_clean_no_duplicates.duplicated().sum())
+# Zwischenergebnisse der Stufen (nur Stufen mit geänderten Eingaben oder geändertem Code laufen neu) und Diagramme
+cache_directory = os.path.join(current_directory, 'cache', 'etl')
+plot_directory = os.path.join(current_directory, 'plots')
 
+# Stufen, die ohne --stages aktualisiert werden (alle anderen hängen an ihnen); nur ihre kleinen Ergebnisse werden geladen
+default_stages = ['profile_cards', 'profile_prices', 'merge_clean', 'plot_rarity', 'plot_colors', 'plot_mana_cost', 'plot_power', 'plot_color_prices']
 
+# Anzahl der Preiszeilen, die gleichzeitig im Speicher sind (cardPrices.csv wird nie komplett geladen)
+chunk_size = 1_000_000
 
-# Zusammenführen der bereinigten Datensätze
-merged_data_clean = pd.merge(data_clean_no_duplicates, datacost_clean_no_duplicates, on='uuid', how='inner')
 
-# Überprüfe die ersten Zeilen der zusammengeführten Daten
-print(merged_data_clean[['name', 'colors', 'price']].head())
+# --- load: Karten (typisiert, aus dem Parquet-Cache in ./cache) und ein Profil der Preise ---
 
+def load_card_table(path):
+    return load_cards(path=path)
 
 
+def profile_cards(data):
+    # Fehlende Werte und Duplikate der Karten, einmal berechnet
+    return {'head': data.head(), 'rows': len(data), 'missing': data.isna().sum(), 'duplicates': int(data.duplicated().sum())}
 
 
+def profile_prices(path, chunk_size):
+    # Fehlende Werte und Duplikate der Preise werden Block für Block gezählt;
+    # für Duplikate über Blockgrenzen hinweg wird ein 64-bit-Hash jeder Zeile gemerkt und am Ende einmal sortiert
+    head = None
+    missing_prices = None
+    rows = 0
+    price_hashes = []
+    for chunk in iter_price_chunks(path, chunksize=chunk_size):
+        head = chunk.head() if head is None else head
+        rows += len(chunk)
+        missing = chunk.isna().sum()
+        missing_prices = missing if missing_prices is None else missing_prices + missing
+        price_hashes.append(pd.util.hash_pandas_object(chunk, index=False).to_numpy())
+    # Jede Zeile, deren Hash schon vorher vorkam, ist ein Duplikat
+    price_duplicates = rows - len(np.unique(np.concatenate(price_hashes))) if price_hashes else 0
+    return {'head': head, 'rows': rows, 'missing': missing_prices, 'duplicates': price_duplicates}
+
+
+# --- clean / dedupe: Karten ohne fehlende Werte und ohne Duplikate ---
 
-# Verteilung der Seltenheit (rarity) anzeigen
-plt.figure(figsize=(10, 6))
-sns.countplot(x='rarity', data=data, palette='Set2')
-plt.title('Verteilung der Seltenheit (Rarity) von Karten')
-plt.xlabel('Seltenheit')
-plt.ylabel('Anzahl der Karten')
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.show()
-
-
-
-# Farben extrahieren und zählen
-colors = data['colors'].dropna().apply(lambda x: x.split(',')).explode().value_counts()
-
-# Verteilung der Farben (colors) anzeigen
-plt.figure(figsize=(10, 6))
-sns.barplot(x=colors.index, y=colors.values, palette='Set3')
-plt.title('Verteilung der Farben von Karten')
-plt.xlabel('Farbe')
-plt.ylabel('Anzahl der Karten')
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.show()
-
-
-
-# Verteilung der Mana-Kosten (manaCost)
-plt.figure(figsize=(10, 6))
-sns.histplot(data['manaCost'].dropna(), kde=True, color='purple', bins=30)
-plt.title('Verteilung der Mana-Kosten der Karten')
-plt.xlabel('Mana-Kosten')
-plt.ylabel('Anzahl der Karten')
-plt.tight_layout()
-plt.show()
-
-# Verteilung der Macht (Power) der Karten
-plt.figure(figsize=(10, 6))
-sns.histplot(data['power'].dropna(), kde=True, color='green', bins=30)
-plt.title('Verteilung der Macht (Power) der Karten')
-plt.xlabel('Macht (Power)')
-plt.ylabel('Anzahl der Karten')
-plt.tight_layout()
-plt.show()
-
-
-
-merged_data = pd.merge(data, datacost, on='uuid', how='inner')
-
-# Überprüfe, ob die Daten korrekt zusammengeführt wurden
-print(merged_data[['name', 'colors', 'price']].head())
-
-
-# Erstelle eine neue Spalte, die für jede Karte alle Farben als separate Zeilen enthält
-color_prices = merged_data.explode('colors')
-
-# Überprüfe die neuen Daten
-print(color_prices[['name', 'colors', 'price']].head())
-
-
-import matplotlib.pyplot as plt
-import seaborn as sns
-
-# Erstelle das Boxplot für Preis vs. Farben
-plt.figure(figsize=(12, 8))
-sns.boxplot(x='colors', y='price', data=color_prices, palette='Set3')
-
-# Titel und Achsenbeschriftungen
-plt.title('Preise der Karten im Vergleich zu ihren Farben')
-plt.xlabel('Farben')
-plt.ylabel('Preis (Dollar)')
-
-# Rotieren der Farben, wenn zu viele vorhanden sind
-plt.xticks(rotation=90)
-plt.tight_layout()
+def clean_card_table(data):
+    return data.dropna()
 
-# Anzeige des Diagramms
-plt.show()
 
+def dedupe_card_table(data_clean):
+    return data_clean.drop_duplicates()
+
+
+def clean_price_chunks(path, chunk_size):
+    # Preise ohne fehlende Werte und ohne Duplikate, Block für Block (die Hashes der bisherigen Zeilen stehen in einem Set)
+    seen = set()
+    for chunk in iter_price_chunks(path, chunksize=chunk_size):
+        chunk = chunk.dropna()
+        hashes = pd.util.hash_pandas_object(chunk, index=False).tolist()
+        new = np.zeros(len(hashes), dtype=bool)
+        for position, row_hash in enumerate(hashes):
+            if row_hash not in seen:
+                seen.add(row_hash)
+                new[position] = True
+        yield chunk[new]
+
+
+# --- merge ---
+
+def merge_clean_preview(data_clean_no_duplicates, path, chunk_size):
+    # Zusammenführen der bereinigten Datensätze (Preise werden blockweise über einen uuid-Index den Karten zugeordnet);
+    # für die Vorschau reicht der erste Block mit Treffern
+    merged_data_clean = next(
+        (chunk for chunk in merge_price_chunks(data_clean_no_duplicates, clean_price_chunks(path, chunk_size), how='inner') if len(chunk)),
+        pd.DataFrame(columns=['name', 'colors', 'price']),
+    )
+    return merged_data_clean[['name', 'colors', 'price']].head()
+
+
+def merge_prices(data, path, chunk_size):
+    # Nur die Spalten behalten, die für den Boxplot gebraucht werden
+    return pd.concat(
+        chunk[['name', 'colors', 'colorsMask', 'price']]
+        for chunk in iter_merged_prices(data[['uuid', 'name', 'colors', 'colorsMask']], how='inner', path=path, columns=['uuid', 'price'], chunksize=chunk_size)
+    )
+
+
+# --- aggregate ---
+
+def count_colors(data):
+    # Farben zählen: jede Karte zählt für jede ihrer Farben (Bits der Spalte colorsMask, kein explode nötig)
+    return sum_by_bit(data['colorsMask'], np.ones(len(data)), COLORS).astype(int).sort_values(ascending=False)
+
+
+def collect_color_prices(merged_data):
+    # Für jede Farbe die Preise der Karten mit dieser Farbe (mehrfarbige Karten zählen für jede ihrer Farben)
+    return pd.concat(
+        merged_data.loc[contains_any(merged_data['colorsMask'], 1 << bit), ['name', 'price']].assign(colors=color)
+        for bit, color in enumerate(COLORS)
+    )
+
+
+# --- plot: jedes Diagramm ist eine eigene Figure (kein pyplot), wird als PNG gespeichert statt mit plt.show() zu blockieren ---
+
+def plot_rarity(data, path):
+    # Verteilung der Seltenheit (rarity) anzeigen
+    figure = Figure(figsize=(10, 6))
+    axes = figure.subplots()
+    sns.countplot(x='rarity', data=data, palette='Set2', ax=axes)
+    axes.set_title('Verteilung der Seltenheit (Rarity) von Karten')
+    axes.set_xlabel('Seltenheit')
+    axes.set_ylabel('Anzahl der Karten')
+    axes.tick_params(axis='x', labelrotation=45)
+    figure.tight_layout()
+    figure.savefig(path)
+    return path
+
+
+def plot_colors(colors, path):
+    # Verteilung der Farben (colors) anzeigen
+    figure = Figure(figsize=(10, 6))
+    axes = figure.subplots()
+    sns.barplot(x=colors.index, y=colors.values, palette='Set3', ax=axes)
+    axes.set_title('Verteilung der Farben von Karten')
+    axes.set_xlabel('Farbe')
+    axes.set_ylabel('Anzahl der Karten')
+    axes.tick_params(axis='x', labelrotation=45)
+    figure.tight_layout()
+    figure.savefig(path)
+    return path
+
+
+def plot_histogram(data, path, column, color, title, label):
+    # Verteilung einer Zahlenspalte (manaCost, power)
+    figure = Figure(figsize=(10, 6))
+    axes = figure.subplots()
+    sns.histplot(data[column].dropna(), kde=True, color=color, bins=30, ax=axes)
+    axes.set_title(title)
+    axes.set_xlabel(label)
+    axes.set_ylabel('Anzahl der Karten')
+    figure.tight_layout()
+    figure.savefig(path)
+    return path
+
+
+def plot_color_prices(color_prices, path):
+    # Boxplot für Preis vs. Farben
+    figure = Figure(figsize=(12, 8))
+    axes = figure.subplots()
+    sns.boxplot(x='colors', y='price', data=color_prices, palette='Set3', ax=axes)
+    axes.set_title('Preise der Karten im Vergleich zu ihren Farben')
+    axes.set_xlabel('Farben')
+    axes.set_ylabel('Preis (Dollar)')
+    # Rotieren der Farben, wenn zu viele vorhanden sind
+    axes.tick_params(axis='x', labelrotation=90)
+    figure.tight_layout()
+    figure.savefig(path)
+    return path
+
+
+def build_pipeline(workers=4, trace_memory=False):
+    # load -> clean -> dedupe -> merge -> aggregate -> plot; Stufen ohne gegenseitige Abhängigkeit laufen parallel
+    pipeline = Pipeline(cache_directory, workers=workers, trace_memory=trace_memory)
+    pipeline.add('load_cards', load_card_table, sources=[cards_file], path=cards_file)
+    pipeline.add('profile_cards', profile_cards, inputs=['load_cards'])
+    pipeline.add('profile_prices', profile_prices, sources=[card_prices_file], path=card_prices_file, chunk_size=chunk_size)
+    pipeline.add('clean_cards', clean_card_table, inputs=['load_cards'])
+    pipeline.add('dedupe_cards', dedupe_card_table, inputs=['clean_cards'])
+    pipeline.add('merge_clean', merge_clean_preview, inputs=['dedupe_cards'], sources=[card_prices_file], path=card_prices_file, chunk_size=chunk_size)
+    pipeline.add('merge_prices', merge_prices, inputs=['load_cards'], sources=[card_prices_file], path=card_prices_file, chunk_size=chunk_size)
+    pipeline.add('count_colors', count_colors, inputs=['load_cards'])
+    pipeline.add('color_prices', collect_color_prices, inputs=['merge_prices'])
+
+    plots = {
+        'plot_rarity': (plot_rarity, 'load_cards', {}),
+        'plot_colors': (plot_colors, 'count_colors', {}),
+        'plot_mana_cost': (plot_histogram, 'load_cards', {
+            'column': 'manaCost', 'color': 'purple', 'title': 'Verteilung der Mana-Kosten der Karten', 'label': 'Mana-Kosten',
+        }),
+        'plot_power': (plot_histogram, 'load_cards', {
+            'column': 'power', 'color': 'green', 'title': 'Verteilung der Macht (Power) der Karten', 'label': 'Macht (Power)',
+        }),
+        'plot_color_prices': (plot_color_prices, 'color_prices', {}),
+    }
+    for name, (function, source, params) in plots.items():
+        path = os.path.join(plot_directory, name[len('plot_'):] + '.png')
+        pipeline.add(name, function, inputs=[source], outputs=[path], path=path, **params)
+    return pipeline
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load, clean, merge and plot cards.csv and cardPrices.csv in cached stages.")
+    parser.add_argument("--stages", nargs="*", default=None, help="Stages to bring up to date (default: the profiles, the merge preview and all plots)")
+    parser.add_argument("--force", nargs="*", default=[], help="Stages that run even if they are cached")
+    parser.add_argument("--workers", type=int, default=4, help="Stages that run at the same time")
+    parser.add_argument("--memory", action="store_true", help="Measure the peak memory of every stage (slower)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    pipeline = build_pipeline(args.workers, args.memory)
+    results, report = pipeline.run(args.stages or default_stages, force=args.force)
+
+    # Überprüfe die ersten paar Zeilen, fehlende Werte und Duplikate der geladenen Daten
+    if 'profile_cards' in results:
+        cards_profile = results['profile_cards']
+        print(cards_profile['head'])
+        print("Fehlende Werte in 'data':")
+        print(cards_profile['missing'])
+        print("\nDuplikate in 'data':")
+        print(cards_profile['duplicates'])
+    if 'profile_prices' in results:
+        prices_profile = results['profile_prices']
+        print(prices_profile['head'])
+        print("\nFehlende Werte in 'datacost':")
+        print(prices_profile['missing'])
+        print("\nDuplikate in 'datacost':")
+        print(prices_profile['duplicates'])
+
+    # Überprüfe die ersten Zeilen der zusammengeführten, bereinigten Daten
+    if 'merge_clean' in results:
+        print(results['merge_clean'])
+    if 'count_colors' in results:
+        print(results['count_colors'])
+
+    plots = [results[name] for name in results if name.startswith('plot_')]
+    if plots:
+        print(f"\nDiagramme gespeichert: {', '.join(plots)}")
+    print()
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question):
+    """
+    Folds case, punctuation and whitespace so that equivalent phrasings share one cache key.
+
+    Parameters:
+    question (str): The question as typed by the user.
+
+    Returns:
+    str: The normalized question, e.g. "What is the manaCost of Ancestor's Chosen?" -> "what is the manacost of ancestors chosen".
+    """
+    text = unicodedata.normalize("NFKC", question).casefold()
+    text = _PUNCTUATION.sub("", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def file_signature(path):
+    """
+    Returns a cheap signature of a file (modification time and size), or None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class AnswerCache:
+    """
+    Bounded LRU cache with a time-to-live for answers (the app stores answer, distance, score and nearest distance).
+
+    get and put take the signature of the model the caller works with: a request that is still
+    running on a model that has been replaced in the meantime neither reads the new model's
+    entries nor writes its own answers for the new model.
+
+    Parameters:
+    max_size (int): The maximum number of entries kept in memory.
+    ttl (float): Seconds after which an entry expires (0 or None disables expiry).
+    """
+
+    def __init__(self, max_size=10000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._signature = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def validate(self, signature):
+        """
+        Clears the cache when the signature of the model it was filled from has changed.
+        """
+        with self._lock:
+            if signature != self._signature:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._signature = signature
+
+    def get(self, key, signature=None):
+        with self._lock:
+            if signature is not None and signature != self._signature:
+                self.misses += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, stored_at = entry
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, signature=None):
+        with self._lock:
+            if signature is not None and signature != self._signature:
+                self.stale_puts += 1
+                return
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of question embeddings stored in SQLite.
+
+    Embeddings only depend on the sentence model, not on the trained classifier,
+    so the cache survives retraining and restarts as long as the encoder stays the same.
+
+    Parameters:
+    path (str): Path of the SQLite file.
+    model_name (str): Name of the sentence model the embeddings were created with.
+    """
+
+    def __init__(self, path, model_name):
+        self.path = path
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        # Every (forked) process opens its own connection
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, question TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, question))"
+            )
+            self._pid = os.getpid()
+        return self._connection
+
+    def get_many(self, questions):
+        """
+        Returns a dict mapping each cached question to its float32 embedding.
+        """
+        found = {}
+        with self._lock:
+            connection = self._connect()
+            unique = list(dict.fromkeys(questions))
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT question, vector FROM embeddings WHERE model = ? AND question IN ({','.join('?' * len(chunk))})",
+                    [self.model_name, *chunk],
+                )
+                for question, vector in rows:
+                    found[question] = np.frombuffer(vector, dtype=np.float32)
+            self.hits += sum(1 for question in questions if question in found)
+            self.misses += sum(1 for question in questions if question not in found)
+        return found
+
+    def put_many(self, questions, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, question, vector) VALUES (?, ?, ?)",
+                [(self.model_name, question, embedding.tobytes()) for question, embedding in zip(questions, embeddings)],
+            )
+            connection.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._connect().execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model_name,)
+            ).fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "model": self.model_name,
+                "size": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,123 @@
+import numpy as np
+
+from answer_cache import normalize_question
+from generate_questions import split_question
+
+# Distance above which a match counts as unknown ("I don't know this yet.")
+THRESHOLD = 0.5
+# How fast the confidence falls from 1 to 0 around the threshold (in units of distance)
+TEMPERATURE = 0.05
+
+
+def confidence(distances, threshold=THRESHOLD, temperature=TEMPERATURE):
+    """
+    Turns cosine distances into scores between 0 and 1: 0.5 exactly at the threshold, close to 1
+    for near-identical questions and close to 0 for far away ones.
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    return 1.0 / (1.0 + np.exp(np.clip((distances - threshold) / temperature, -50, 50)))
+
+
+def _tokens(text):
+    return set(normalize_question(text).split())
+
+
+class LexicalReranker:
+    """
+    Cheap second opinion on the nearest neighbours: how many words of the candidate's card name
+    appear in the question. Similar names ("Angel of Mercy" vs. "Angel of Serenity") are close
+    in embedding space, but only one of them is actually written in the question.
+
+    Parameters:
+    questions (sequence): The indexed questions (list or StringTable), row i belongs to answer i.
+    weight (float): Share of the lexical overlap in the combined score (0 = similarity only).
+    """
+
+    def __init__(self, questions, weight=0.2):
+        self.questions = questions
+        self.weight = weight
+
+    def name_overlap(self, query_tokens, row):
+        question = self.questions[row]
+        parts = split_question(question)
+        # Questions in other phrasings are compared as a whole
+        name_tokens = _tokens(parts[0] if parts else question)
+        if not name_tokens:
+            return 0.0
+        return len(name_tokens & query_tokens) / len(name_tokens)
+
+    def scores(self, query, rows, distances):
+        """
+        Returns the combined scores of the candidates (higher is better) and their name overlaps.
+        """
+        query_tokens = _tokens(query)
+        overlaps = np.array([self.name_overlap(query_tokens, row) for row in rows])
+        similarities = 1.0 - np.asarray(distances, dtype=np.float64)
+        return (1.0 - self.weight) * similarities + self.weight * overlaps, overlaps
+
+
+def rank_candidates(embeddings, queries, index, answers, questions=None, k=1, depth=0, weight=0.2, return_nearest=False):
+    """
+    Finds the k best distinct answers for every query with a single index query.
+
+    Parameters:
+    embeddings (np.ndarray): Query embeddings, one row per query.
+    queries (list): The query texts (used by the re-ranker).
+    index: Nearest-neighbour index with a kneighbors method (see vector_index).
+    answers (sequence): Answer of every indexed question.
+    questions (sequence): The indexed questions, needed for re-ranking (None = no re-ranking).
+    k (int or list): Number of candidates per query (one value for all or one per query).
+    depth (int): Number of neighbours fetched for re-ranking (0 = no re-ranking).
+    weight (float): Weight of the lexical name overlap in the re-ranking.
+    return_nearest (bool): Also return the distance of every query's nearest neighbour.
+
+    The score of a candidate is the confidence of the value it was ordered by (one minus the
+    combined score when re-ranking, the distance otherwise), so scores always fall from the
+    first candidate to the last. Whether a query is known at all should be decided on the
+    nearest distance, a re-ranked first candidate may be further away.
+
+    Returns:
+    list: Per query a list of candidates (dicts with answer, question, row, distance, score and
+    lexical), best first. With return_nearest a tuple (that list, np.ndarray of the nearest
+    distances, infinite for queries without any neighbour).
+    """
+    ks = list(k) if isinstance(k, (list, tuple)) else [k] * len(queries)
+    reranker = LexicalReranker(questions, weight) if questions is not None and depth and weight else None
+    # A few more neighbours than k, duplicate questions in the corpus give the same answer twice
+    n_neighbors = max(2 * max(ks), depth if reranker else 0)
+    n_neighbors = max(1, min(n_neighbors, len(answers)))
+    distances, indices = index.kneighbors(embeddings, n_neighbors=n_neighbors)
+
+    results = []
+    nearest = np.full(len(queries), np.inf)
+    for position, (query, query_k, row_distances, rows) in enumerate(zip(queries, ks, distances, indices)):
+        # Tombstoned or missing neighbours come back with an infinite distance
+        valid = np.isfinite(row_distances)
+        row_distances, rows = row_distances[valid], rows[valid]
+        if len(rows):
+            nearest[position] = row_distances.min()
+        if reranker is not None and len(rows):
+            combined, overlaps = reranker.scores(query, rows, row_distances)
+            # Stable, so equal scores keep the index order
+            order = np.argsort(-combined, kind="stable")
+            ordered_by = 1.0 - combined
+        else:
+            overlaps = np.full(len(rows), np.nan)
+            order = np.arange(len(rows))
+            ordered_by = row_distances
+        # Every answer once, at the position of its best candidate
+        seen = set()
+        order = [i for i in order if not (answers[rows[i]] in seen or seen.add(answers[rows[i]]))][:query_k]
+        scores = confidence(ordered_by[order])
+        results.append([
+            {
+                "answer": answers[rows[i]],
+                "question": questions[rows[i]] if questions is not None else None,
+                "row": int(rows[i]),
+                "distance": float(row_distances[i]),
+                "score": float(score),
+                "lexical": None if np.isnan(overlaps[i]) else float(overlaps[i]),
+            }
+            for i, score in zip(order, scores)
+        ])
+    return (results, nearest) if return_nearest else results
@@ -1,44 +1,353 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template
 import pickle
 import os
 import json
+import queue
+import threading
+import time
 import numpy as np
+from micro_batcher import MicroBatcher
+from metrics import CONTENT_TYPE, REGISTRY, SIZE_BUCKETS, SlowCallProfiler
+from answer_cache import AnswerCache, EmbeddingCache, file_signature, normalize_question
+from answer_ranking import THRESHOLD, rank_candidates
+from model_bundle import DEFAULT_BUNDLE_PATH, MANIFEST_FILE, AnswerStore
+from model_reloader import ActiveModel, ModelHolder, load_active_model, warm_up
+from card_lookup import CardLookup
+from name_resolver import NameResolver
+from sharded_index import StaleBundleError
+from price_aggregates import DEFAULT_AGGREGATES_PATH, DIMENSIONS, AggregatesReloader
 
 app = Flask(__name__)
 
-# Model-Pfad setzen
+# Model-Pfade setzen: bevorzugt das Bundle-Verzeichnis, sonst die alte Pickle-Datei
+bundle_path = os.environ.get("MODEL_BUNDLE_PATH", os.path.join(os.getcwd(), DEFAULT_BUNDLE_PATH))
 model_path = os.path.join(os.getcwd(), "question_model.pkl")
+sentence_model_name = os.environ.get("SENTENCE_MODEL_NAME", "all-MiniLM-L6-v2")
 
-# Modell laden, wenn die Datei existiert
-if os.path.exists(model_path):
+# Encoder: "torch" (SentenceTransformer) oder "onnx" (ONNX Runtime, Export von "python train_model.py --backend onnx")
+encoder_backend = os.environ.get("ENCODER_BACKEND", "torch")
+if encoder_backend == "onnx":
+    from onnx_encoder import DEFAULT_ONNX_DIR, onnx_loader
+
+    onnx_quantized = os.environ.get("ONNX_QUANTIZED")  # leer: int8-Modell, wenn es den Paritätstest bestanden hat
+    encoder_loader = onnx_loader(
+        os.environ.get("ONNX_DIR", DEFAULT_ONNX_DIR),
+        quantized=None if not onnx_quantized else onnx_quantized == "1",
+        threads=int(os.environ.get("ONNX_THREADS", 0)) or None,
+    )
+else:
+    encoder_loader = None
+
+# Ein in Shards aufgeteilter Index (train_model.py --shards N) sucht pro Shard in einem eigenen Prozess;
+# INDEX_SHARD_PROCESSES=0 durchsucht die Shards nacheinander im App-Prozess
+shard_processes = os.environ.get("INDEX_SHARD_PROCESSES", "1") != "0"
+
+# Modell laden, wenn die Dateien existieren
+if os.path.exists(os.path.join(bundle_path, MANIFEST_FILE)):
+    active_model = load_active_model(bundle_path, probes=0, encoder_loader=encoder_loader, shard_processes=shard_processes)
+elif os.path.exists(model_path):
     with open(model_path, "rb") as f:
-        model = pickle.load(f)
-        sentence_model, clf = model  # Entpacke das Modell
+        sentence_model, clf = pickle.load(f)  # clf ist ein Index aus vector_index oder ein alter KNeighborsClassifier
+
+    # Antworten aus der JSON-Datei laden (jede Antwort nur einmal, pro Frage eine Nummer)
+    with open("questions.json", "r", encoding="utf-8") as file:
+        data = json.load(file)
+        answers = AnswerStore.from_strings(data["answers"])
+        questions = data["questions"]
+    active_model = ActiveModel(sentence_model, clf, answers, questions, str(file_signature(model_path)), sentence_model_name, model_path)
 else:
     print("Model not found")
-    model = None
+    active_model = None
+
+# Batchgrößen, mit denen der Encoder vor der ersten Anfrage aufgewärmt wird (leer schaltet das ab)
+WARM_UP_SIZES = tuple(int(size) for size in os.environ.get("WARM_UP_BATCHES", "1,8,32").split(",") if size.strip())
+
+# Hält das aktive Modell; ein neues Bundle (z.B. nach train_model.py) wird im Hintergrund geladen,
+# mit ein paar Probefragen aufgewärmt und dann ausgetauscht (MODEL_RELOAD_INTERVAL=0 schaltet das ab)
+model_holder = ModelHolder(
+    bundle_path,
+    active_model,
+    interval=float(os.environ.get("MODEL_RELOAD_INTERVAL", 10)),
+    probes=int(os.environ.get("MODEL_RELOAD_PROBES", 3)),
+    warm_up_sizes=WARM_UP_SIZES,
+    encoder_loader=encoder_loader,
+    shard_processes=shard_processes,
+)
+
+# Startet die Überwachung des Bundles; wird pro Prozess aufgerufen (python app.py, serve.py nach dem Fork)
+def start_model_watcher():
+    model_holder.start_watcher()
+
+# Schickt ein paar Batches durch Encoder und Index, damit die erste Anfrage nicht die Initialisierung von torch bezahlt;
+# läuft pro Prozess (bei serve.py erst nach dem Fork, die Threadpools von torch überleben ihn nicht)
+def warm_up_model():
+    seconds = warm_up(model_holder.current, WARM_UP_SIZES)
+    if seconds:
+        print(f"Model warmed up in {seconds:.2f}s.")
+
+# Direkte Suche "Attribut X von Karte Y" in der Kartentabelle, ohne Embeddings (CARD_LOOKUP=0 schaltet sie ab)
+cards_path = os.environ.get("CARDS_PATH", os.path.join(os.getcwd(), "data", "cards.csv"))
+if os.environ.get("CARD_LOOKUP", "1") != "0" and os.path.exists(cards_path):
+    card_lookup = CardLookup.from_csv(cards_path)
+else:
+    card_lookup = None
+
+# Korrigiert falsch geschriebene Kartennamen ("angle of mercy" -> "Angel of Mercy") vor Suche und Embedding (NAME_RESOLVER=0 schaltet das ab)
+if os.environ.get("NAME_RESOLVER", "1") == "0":
+    name_resolver = None
+elif card_lookup is not None:
+    name_resolver = NameResolver(card_lookup.names)
+elif os.path.exists(cards_path):
+    name_resolver = NameResolver.from_csv(cards_path)
+else:
+    name_resolver = None
+
+# Antwort aus der Kartentabelle, None wenn die Frage nicht erkannt wurde
+def lookup_answer(question):
+    if card_lookup is None:
+        return None
+    parsed = card_lookup.parse(question)
+    if parsed is None:
+        return None
+    value = card_lookup.lookup(*parsed)
+    # Erkannte Frage, aber die Karte hat dieses Attribut nicht
+    return value if value is not None else "I don't know this yet."
+
+# Vorberechnete Durchschnittspreise nach Farbe, Seltenheit und Jahr ("python price_aggregates.py" erstellt und aktualisiert sie),
+# nach einer Aktualisierung werden sie beim nächsten Aufruf neu geladen, ohne Neustart der App
+price_aggregates = AggregatesReloader(os.environ.get("PRICE_AGGREGATES_PATH", DEFAULT_AGGREGATES_PATH))
+
+# Cache für Antworten (normalisierte Frage -> Antwort und Distanz)
+answer_cache = AnswerCache(
+    max_size=int(os.environ.get("ANSWER_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("ANSWER_CACHE_TTL", 3600)),
+)
+
+# Persistenter Cache für Embeddings, hängt nur vom Sentence-Modell ab (leerer Pfad schaltet ihn ab)
+embedding_cache_path = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(os.getcwd(), "embedding_cache.sqlite"))
+embedding_caches = {}
+
+def get_embedding_cache(model_name):
+    if not embedding_cache_path:
+        return None
+    if model_name not in embedding_caches:
+        embedding_caches[model_name] = EmbeddingCache(embedding_cache_path, model_name)
+    return embedding_caches[model_name]
+
+# Messwerte für /metrics: Dauer der einzelnen Schritte, Herkunft der Antworten, Batchgrößen
+STAGE_SECONDS = REGISTRY.histogram("ask_stage_seconds", "Time spent in each step of answering questions", labels=("stage",))
+REQUEST_SECONDS = REGISTRY.histogram("http_request_seconds", "Time from receiving a request to the finished response", labels=("endpoint",))
+BATCH_SIZE = REGISTRY.histogram("ask_batch_size", "Number of questions answered together", buckets=SIZE_BUCKETS)
+QUESTIONS = REGISTRY.counter("ask_questions_total", "Answered questions by where the answer came from", labels=("source",))
+THRESHOLD_MISSES = REGISTRY.counter("ask_threshold_misses_total", "Questions answered with \"I don't know this yet.\" because the closest match was too far away")
+EMBEDDING_LOOKUPS = REGISTRY.counter("embedding_cache_lookups_total", "Embedding cache lookups", labels=("result",))
+REJECTED = REGISTRY.counter("http_rejected_total", "Requests rejected with 429 because the server was saturated", labels=("endpoint",))
+
+# Optional: ein Teil der Batches läuft unter cProfile, langsame werden als .prof-Datei gespeichert (PROFILE_SLOW_MS setzt die Grenze)
+profile_slow_ms = os.environ.get("PROFILE_SLOW_MS")
+slow_profiler = (
+    SlowCallProfiler(
+        float(profile_slow_ms) / 1000,
+        sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0.01)),
+        directory=os.environ.get("PROFILE_DIR", os.path.join(os.getcwd(), "profiles")),
+    )
+    if profile_slow_ms else None
+)
+
+# Kandidaten pro Frage: Standard und Obergrenze für k, Tiefe und Gewicht des Re-Rankings nach Kartenname
+# (standardmäßig aus, z.B. RERANK_DEPTH=10 schaltet es ein)
+DEFAULT_K = 1
+MAX_K = int(os.environ.get("ASK_MAX_K", 20))
+RERANK_DEPTH = int(os.environ.get("RERANK_DEPTH", 0))
+RERANK_WEIGHT = float(os.environ.get("RERANK_WEIGHT", 0.2))
+
+# Fragen in genau der Form aus generate_questions.py nehmen das gespeicherte Embedding aus dem Bundle (CANONICAL_TABLE=0 schaltet das ab)
+use_canonical = os.environ.get("CANONICAL_TABLE", "1") != "0"
 
-# Antworten aus der JSON-Datei laden
-with open("questions.json", "r", encoding="utf-8") as file:
-    data = json.load(file)
-    answers = data["answers"]
+# Embeddings erstellen, bereits bekannte Fragen kommen aus dem Bundle oder dem Cache
+def embed_questions(questions, model=None):
+    model = model or model_holder.current
+    canonical = model.bundle.canonical if use_canonical and model.bundle is not None else None
+    cached = {}
+    if canonical is not None:
+        for question in questions:
+            row = canonical.row(question)
+            if row is not None:
+                cached[question] = model.bundle.embeddings[row]
+        EMBEDDING_LOOKUPS.inc(len(cached), result="canonical")
+    rest = list(dict.fromkeys(question for question in questions if question not in cached))
+    embedding_cache = get_embedding_cache(model.model_name)
+    if embedding_cache is None:
+        if rest:
+            with STAGE_SECONDS.time(stage="encode"):
+                cached.update(zip(rest, np.asarray(model.encoder.encode(rest), dtype=np.float32)))
+        return np.vstack([cached[question] for question in questions])
+    hits = embedding_cache.get_many(rest)
+    cached.update(hits)
+    missing = [question for question in rest if question not in hits]
+    EMBEDDING_LOOKUPS.inc(len(hits), result="hit")
+    EMBEDDING_LOOKUPS.inc(len(missing), result="miss")
+    if missing:
+        with STAGE_SECONDS.time(stage="encode"):
+            new_embeddings = model.encoder.encode(missing)
+        embedding_cache.put_many(missing, new_embeddings)
+        cached.update(zip(missing, np.asarray(new_embeddings, dtype=np.float32)))
+    return np.vstack([cached[question] for question in questions])
+
+# Funktion zum Verarbeiten mehrerer Fragen auf einmal (ein encode- und ein kneighbors-Aufruf)
+# k und threshold gelten für alle Fragen oder sind Listen mit einem Wert pro Frage
+def rank_questions(questions, k=DEFAULT_K, threshold=THRESHOLD):
+    try:
+        return rank_questions_once(questions, k, threshold)
+    except StaleBundleError:
+        # Das Bundle wurde ersetzt, bevor die Shard-Prozesse seine Dateien geöffnet haben:
+        # das neue Bundle laden und die Fragen einmal damit beantworten
+        if not model_holder.reload():
+            raise
+        return rank_questions_once(questions, k, threshold)
+
+def rank_questions_once(questions, k=DEFAULT_K, threshold=THRESHOLD):
+    if not questions:
+        return []
+    BATCH_SIZE.observe(len(questions))
+    ks = k if isinstance(k, list) else [k] * len(questions)
+    thresholds = threshold if isinstance(threshold, list) else [threshold] * len(questions)
+
+    # Tippfehler im Kartennamen korrigieren, alles Weitere arbeitet mit der korrigierten Frage
+    if name_resolver is not None:
+        with STAGE_SECONDS.time(stage="resolve"):
+            questions = [name_resolver.correct(question) for question in questions]
+
+    # Schneller Weg: Kartenname und Attribut direkt aus der Frage lesen
+    with STAGE_SECONDS.time(stage="lookup"):
+        direct = [lookup_answer(question) for question in questions]
+    QUESTIONS.inc(sum(answer is not None for answer in direct), source="lookup")
+    results = [
+        None if answer is None else
+        # Karte bekannt, Attribut nicht: wie eine Frage über der Schwelle, ohne Kandidaten und mit Score 0
+        {"answer": answer, "score": 0.0, "candidates": []} if answer == "I don't know this yet." else {
+            "answer": answer,
+            "score": 1.0,
+            "candidates": [{"answer": answer, "question": None, "distance": 0.0, "score": 1.0, "source": "lookup"}],
+        }
+        for answer in direct
+    ]
+    # Die ganze Anfrage läuft mit dem Modell, das jetzt aktiv ist, auch wenn währenddessen ausgetauscht wird
+    model = model_holder.current
+    if not model:
+        return [
+            result if result is not None else {"answer": "Model not loaded", "score": 0.0, "candidates": []}
+            for result in results
+        ]
+
+    # Distanz des nächsten gespeicherten Nachbarn jeder Frage, daran entscheidet die Schwelle
+    nearest = [None] * len(questions)
+
+    # Cache leeren, falls ein anderes Modell aktiv geworden ist; er enthält nur den besten Kandidaten,
+    # Fragen mit k > 1 gehen deshalb immer zum Modell
+    with STAGE_SECONDS.time(stage="cache"):
+        answer_cache.validate(model.version)
+        keys = [normalize_question(question) for question in questions]
+        for i, key in enumerate(keys):
+            if results[i] is None and ks[i] == 1:
+                cached = answer_cache.get(key, model.version)
+                if cached is not None:
+                    answer, distance, score, nearest[i] = cached
+                    results[i] = [{"answer": answer, "question": None, "distance": distance, "score": score, "source": "cache"}]
+    missing = [i for i, result in enumerate(results) if result is None]
+    QUESTIONS.inc(len(questions) - len(missing) - sum(answer is not None for answer in direct), source="cache")
+
+    if missing:
+        QUESTIONS.inc(len(missing), source="model")
+        # Erstelle die Embeddings für alle Eingaben in einem Durchlauf
+        missing_questions = [questions[i] for i in missing]
+        question_embeddings = embed_questions(missing_questions, model)
+
+        # Die k nächsten Matches für jede Frage mit einer Suche, danach nach Kartenname neu sortiert
+        with STAGE_SECONDS.time(stage="search"):
+            ranked, nearest_distances = rank_candidates(
+                question_embeddings, missing_questions, model.index, model.answers, model.questions,
+                k=[ks[i] for i in missing], depth=RERANK_DEPTH, weight=RERANK_WEIGHT, return_nearest=True,
+            )
+
+        for i, candidates, nearest_distance in zip(missing, ranked, nearest_distances):
+            for candidate in candidates:
+                candidate["source"] = "model"
+            results[i] = candidates
+            nearest[i] = float(nearest_distance)
+            if candidates:
+                # Wurde das Modell inzwischen ausgetauscht, wird die Antwort des alten Modells nicht gespeichert
+                best = candidates[0]
+                answer_cache.put(keys[i], (best["answer"], best["distance"], best["score"], nearest[i]), model.version)
+
+    # Falls schon der nächste Nachbar zu weit entfernt ist, Rückgabe: "I don't know this yet."
+    # (nach dem Re-Ranking kann der beste Kandidat weiter weg sein als der nächste Nachbar)
+    for i, candidates in enumerate(results):
+        if isinstance(candidates, dict):
+            continue
+        best = candidates[0] if candidates else None
+        if best is None or nearest[i] > thresholds[i]:
+            THRESHOLD_MISSES.inc()
+            results[i] = {"answer": "I don't know this yet.", "score": best["score"] if best else 0.0, "candidates": candidates}
+        else:
+            results[i] = {"answer": best["answer"], "score": best["score"], "candidates": candidates}
+    return results
+
+# Nur die Antworten, wie bisher
+def process_questions(questions):
+    return [result["answer"] for result in rank_questions(questions)]
+
+# Führt einen Batch aus, bei eingeschaltetem Profiler eventuell unter cProfile
+def profiled(function, *args):
+    if slow_profiler is None:
+        return function(*args)
+    return slow_profiler.call(function, *args)
+
+# Verarbeitet einen Batch
+def answer_batch(questions):
+    return profiled(process_questions, questions)
+
+# Verarbeitet gesammelte /ask-Anfragen, jede als (Frage, k, Schwelle)
+def answer_requests(items):
+    questions, ks, thresholds = (list(values) for values in zip(*items))
+    return profiled(rank_questions, questions, ks, thresholds)
 
 # Funktion zum Verarbeiten der Frage
 def process_question(question):
-    if not model:
-        return ["Model not loaded"]
+    return [process_questions([question])[0]]  # Antwort zurückgeben
 
-    # Erstelle ein Embedding für die Eingabe
-    question_embedding = sentence_model.encode([question])
+# Liest k und threshold einer Anfrage; Rückgabe (k, threshold, Fehlermeldung)
+# Nur fehlende Werte nehmen den Standard, 0 ist ein Wert (k=0 wird abgelehnt, threshold=0 erlaubt)
+def parse_ranking_options(values):
+    k, threshold = values.get("k"), values.get("threshold")
+    if isinstance(k, bool) or isinstance(threshold, bool):
+        return None, None, "k must be an integer and threshold a number"
+    try:
+        k = DEFAULT_K if k is None else int(k)
+        threshold = THRESHOLD if threshold is None else float(threshold)
+    except (TypeError, ValueError):
+        return None, None, "k must be an integer and threshold a number"
+    if not 1 <= k <= MAX_K:
+        return None, None, f"k must be between 1 and {MAX_K}"
+    if not 0 <= threshold <= 2:
+        return None, None, "threshold must be between 0 and 2"
+    return k, threshold, None
 
-    # Finde das nächste Match
-    distances, indices = clf.kneighbors(question_embedding, n_neighbors=1)
+# Gleichzeitige /ask-Anfragen werden für ein kurzes Zeitfenster gesammelt und gemeinsam verarbeitet
+ask_batcher = MicroBatcher(
+    answer_requests,
+    max_batch_size=int(os.environ.get("ASK_MAX_BATCH_SIZE", 32)),
+    max_wait=float(os.environ.get("ASK_BATCH_WINDOW_MS", 5)) / 1000,
+    # Wartende Fragen, darüber wird mit 429 abgelehnt statt die Antwortzeiten endlos wachsen zu lassen
+    max_queue_size=int(os.environ.get("ASK_QUEUE_SIZE", 1000)),
+    workers=int(os.environ.get("ASK_WORKERS", 1)),
+)
 
-    # Falls die Distanz zu hoch ist, Rückgabe: "I don't know this yet."
-    if distances[0][0] > 0.5:
-        return ["I don't know this yet."]
+# Gleichzeitig verarbeitete /ask/batch-Anfragen, weitere werden mit 429 abgelehnt
+batch_slots = threading.BoundedSemaphore(int(os.environ.get("ASK_BATCH_CONCURRENCY", 4)))
 
-    return [answers[indices[0][0]]]  # Antwort zurückgeben
+# Maximale Anzahl an Fragen pro /ask/batch-Anfrage
+MAX_BATCH_QUESTIONS = int(os.environ.get("ASK_BATCH_LIMIT", 1000))
 
 @app.route("/")
 def index():
@@ -46,12 +355,115 @@ def index():
 
 @app.route("/ask", methods=["POST"])
 def ask():
-    user_question = request.form.get("question")
+    start = time.perf_counter()
+    with STAGE_SECONDS.time(stage="parse"):
+        user_question = request.form.get("question")
+        k, threshold, error = parse_ranking_options(request.form)
+    if error:
+        return jsonify({"error": error}), 400
     if user_question:
-        answer = process_question(user_question)
-        return jsonify({"answer": answer[0]})
+        try:
+            result = ask_batcher.submit((user_question, k, threshold))
+        except queue.Full:
+            REJECTED.inc(endpoint="/ask")
+            return jsonify({"error": "Too many questions at the moment, please try again"}), 429
+        with STAGE_SECONDS.time(stage="serialize"):
+            # Kandidaten nur, wenn k oder threshold angegeben wurden
+            if "k" in request.form or "threshold" in request.form:
+                response = jsonify(result)
+            else:
+                response = jsonify({"answer": result["answer"]})
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="/ask")
+        return response
     else:
         return jsonify({"error": "No question provided"})
 
+@app.route("/ask/batch", methods=["POST"])
+def ask_batch():
+    start = time.perf_counter()
+    with STAGE_SECONDS.time(stage="parse"):
+        payload = request.get_json(silent=True)
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    questions = payload.get("questions")
+    if not isinstance(questions, list) or not questions:
+        return jsonify({"error": "No questions provided"})
+    if not all(isinstance(question, str) and question for question in questions):
+        return jsonify({"error": "Questions must be non-empty strings"})
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_QUESTIONS} questions per request"})
+    k, threshold, error = parse_ranking_options(payload)
+    if error:
+        return jsonify({"error": error}), 400
+    detailed = "k" in payload or "threshold" in payload
+    if not batch_slots.acquire(blocking=False):
+        REJECTED.inc(endpoint="/ask/batch")
+        return jsonify({"error": "Too many questions at the moment, please try again"}), 429
+    try:
+        if detailed:
+            results = profiled(rank_questions, questions, k, threshold)
+        else:
+            answers = answer_batch(questions)
+    finally:
+        batch_slots.release()
+    with STAGE_SECONDS.time(stage="serialize"):
+        if detailed:
+            response = jsonify({"answers": [result["answer"] for result in results], "results": results})
+        else:
+            response = jsonify({"answers": answers})
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="/ask/batch")
+    return response
+
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify({
+        "answers": answer_cache.stats(),
+        "embeddings": {name: cache.stats() for name, cache in embedding_caches.items()},
+    })
+
+# Werte, die erst beim Abruf von /metrics gelesen werden
+REGISTRY.gauge("ask_queue_size", "Questions waiting for the micro-batcher", ask_batcher.queue_size)
+REGISTRY.gauge("answer_cache_hit_ratio", "Share of answer cache lookups that were hits", lambda: answer_cache.stats()["hit_rate"])
+REGISTRY.gauge("answer_cache_entries", "Entries in the answer cache", lambda: answer_cache.stats()["size"])
+REGISTRY.gauge("model_reloads", "Number of times a new model was swapped in", lambda: model_holder.reloads)
+
+# Messwerte im Prometheus-Textformat (pro Prozess, bei mehreren Workern jeden einzeln abfragen)
+@app.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
+
+# Aktive Modellversion anzeigen (GET) oder sofort nach einem neuen Bundle suchen (POST, ?force=1 lädt immer neu)
+@app.route("/admin/model", methods=["GET", "POST"])
+def admin_model():
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if admin_token and request.headers.get("X-Admin-Token") != admin_token:
+        return jsonify({"error": "Not allowed"}), 403
+    if request.method == "POST":
+        swapped = model_holder.reload(force=request.args.get("force") == "1")
+        return jsonify({"reloaded": swapped, **model_holder.status()})
+    return jsonify(model_holder.status())
+
+# Durchschnittspreis, z.B. /prices/average?color=red&rarity=mythic oder /prices/average?by=year&color=R
+@app.route("/prices/average")
+def prices_average():
+    aggregates = price_aggregates.get()
+    if aggregates is None:
+        return jsonify({"error": "No price aggregates found, run python price_aggregates.py"})
+    filters = {name: request.args.get(name) for name in ("color", "rarity", "year")}
+    by = request.args.get("by")
+    try:
+        if by:
+            if by not in DIMENSIONS:
+                return jsonify({"error": f"by must be one of {', '.join(DIMENSIONS)}"})
+            averages = aggregates.breakdown(by, **filters)
+            return jsonify({"by": by, "averages": {str(key): value for key, value in averages.items()}})
+        return jsonify(aggregates.query(**filters))
+    except ValueError:
+        return jsonify({"error": "year must be a number"})
+
 if __name__ == "__main__":
+    warm_up_model()
+    start_model_watcher()
     app.run(debug=True)
@@ -0,0 +1,240 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import time
+
+import numpy as np
+
+from answer_ranking import THRESHOLD
+from generate_questions import DEFAULT_TEMPLATE, iter_question_chunks, paraphrase
+from model_bundle import load_bundle, load_encoder, save_bundle
+from question_io import load_questions, write_questions
+from vector_index import normalize_rows
+
+# Extra phrasings used when the cards give fewer questions than a corpus size asks for; they are
+# different from PARAPHRASE_TEMPLATES, so the paraphrase queries are never part of the corpus
+EXTRA_TEMPLATES = [
+    "Tell me the {column} of {name}.",
+    "What {column} does {name} have?",
+    "Which {column} has {name}?",
+    "{name}: {column}?",
+]
+
+
+def build_corpus(cards_path, size, path, chunksize=5000):
+    """
+    Writes a question corpus of (up to) `size` entries with the generate_questions logic.
+
+    Returns:
+    int: Number of questions written (less than size if the cards cannot give that many).
+    """
+    for templates in ([DEFAULT_TEMPLATE], [DEFAULT_TEMPLATE, *EXTRA_TEMPLATES]):
+        count = write_questions(iter_question_chunks(cards_path, None, templates, chunksize, limit=size), path)
+        if count >= size:
+            break
+    return count
+
+
+def peak_memory_mb():
+    # Peak resident memory of this process (not available on Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2**20 if platform.system() == "Darwin" else peak / 2**10
+
+
+def percentiles(seconds):
+    values = np.asarray(seconds) * 1000
+    return {"p50_ms": float(np.percentile(values, 50)), "p99_ms": float(np.percentile(values, 99)), "mean_ms": float(values.mean())}
+
+
+def corpus_embeddings(encoder, questions, max_encode, batch_size, seed=0):
+    """
+    Encodes the corpus, or for corpora above max_encode encodes the first max_encode questions and
+    fills the rest with noisy copies of them (the index sizes and query costs stay realistic
+    without encoding for hours).
+
+    Returns:
+    tuple: (normalized embeddings, row each embedding was encoded from, encode seconds, encoded count)
+    """
+    encoded_count = min(len(questions), max_encode)
+    start = time.perf_counter()
+    encoded = np.asarray(encoder.encode(questions[:encoded_count], batch_size=batch_size), dtype=np.float32)
+    seconds = time.perf_counter() - start
+    encoded = normalize_rows(encoded)
+    if encoded_count == len(questions):
+        return encoded, np.arange(len(questions)), seconds, encoded_count
+    rng = np.random.default_rng(seed)
+    source = np.concatenate([np.arange(encoded_count), rng.integers(0, encoded_count, len(questions) - encoded_count)])
+    embeddings = np.empty((len(questions), encoded.shape[1]), dtype=np.float32)
+    embeddings[:encoded_count] = encoded
+    for start_row in range(encoded_count, len(questions), 100_000):
+        rows = source[start_row:start_row + 100_000]
+        noise = rng.normal(0, 0.05, (len(rows), encoded.shape[1])).astype(np.float32)
+        embeddings[start_row:start_row + len(rows)] = normalize_rows(encoded[rows] + noise)
+    return embeddings, source, seconds, encoded_count
+
+
+def measure_queries(encoder, index, queries, repeats=1):
+    """
+    Latency of single questions: the encode + search path of the app and the search alone.
+    """
+    query_seconds, search_seconds = [], []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            embedding = encoder.encode([query])
+            middle = time.perf_counter()
+            index.kneighbors(embedding, n_neighbors=1)
+            end = time.perf_counter()
+            query_seconds.append(end - start)
+            search_seconds.append(end - middle)
+    return percentiles(query_seconds), percentiles(search_seconds)
+
+
+def paraphrase_accuracy(encoder, index, questions, answers, rows, batch_size):
+    """
+    Share of paraphrased questions whose closest match has the answer of the original question,
+    and the share that would get "I don't know this yet.".
+    """
+    texts, expected = [], []
+    for row in rows:
+        for text in paraphrase(questions[row]):
+            texts.append(text)
+            expected.append(answers[row])
+    if not texts:
+        return None, None, 0
+    embeddings = encoder.encode(texts, batch_size=batch_size)
+    distances, indices = index.kneighbors(embeddings, n_neighbors=1)
+    found = [answers[i] for i in indices[:, 0]]
+    top1 = float(np.mean([a == b for a, b in zip(found, expected)]))
+    unknown = float(np.mean(distances[:, 0] > THRESHOLD))
+    return top1, unknown, len(texts)
+
+
+def index_options(kind, args):
+    if kind == "ivf":
+        return {"n_probe": args.n_probe}
+    if kind in ("float16", "int8", "pq"):
+        return {"rerank": args.rerank}
+    return {}
+
+
+def run_size(args, encoder, size):
+    corpus_path = os.path.join(args.workdir, f"corpus_{size}.jsonl")
+    if not os.path.exists(corpus_path) or args.regenerate:
+        start = time.perf_counter()
+        build_corpus(args.cards, size, corpus_path)
+        print(f"Generated corpus of {size} questions in {time.perf_counter() - start:.1f}s")
+    questions, answers = load_questions(corpus_path)
+
+    embeddings, source, encode_seconds, encoded_count = corpus_embeddings(
+        encoder, questions, args.max_encode, args.batch_size, args.seed
+    )
+    # Noisy copies answer like the question they were copied from
+    answers = [answers[row] for row in source]
+    rng = np.random.default_rng(args.seed)
+    query_rows = rng.choice(encoded_count, min(args.queries, encoded_count), replace=False)
+    paraphrase_rows = rng.choice(encoded_count, min(args.paraphrases, encoded_count), replace=False)
+    queries = [questions[row] for row in query_rows]
+
+    base = {
+        "size": size,
+        "questions": len(questions),
+        "encoded": encoded_count,
+        "encode_questions_per_s": encoded_count / encode_seconds if encode_seconds else None,
+    }
+    results = []
+    for kind in args.indexes.split(","):
+        # The same path as train_model.py and app.py: write the bundle, load it memory-mapped
+        bundle_path = os.path.join(args.workdir, f"bundle_{size}_{kind}")
+        options = index_options(kind, args)
+        start = time.perf_counter()
+        save_bundle(bundle_path, args.model, embeddings, questions, answers, kind, options)
+        build_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        bundle = load_bundle(bundle_path)
+        load_seconds = time.perf_counter() - start
+        index = bundle.index
+
+        query, search = measure_queries(encoder, index, queries)
+        top1, unknown, paraphrase_count = paraphrase_accuracy(
+            encoder, index, questions, answers, paraphrase_rows, args.batch_size
+        )
+        memory = index.code_bytes() if hasattr(index, "code_bytes") else embeddings.nbytes
+        results.append({
+            **base,
+            "index": kind,
+            "options": options,
+            "build_s": build_seconds,
+            "load_s": load_seconds,
+            "index_bytes": int(memory),
+            "query": query,
+            "search": search,
+            "paraphrases": paraphrase_count,
+            "paraphrase_top1": top1,
+            "paraphrase_unknown": unknown,
+            "peak_rss_mb": peak_memory_mb(),
+        })
+        result = results[-1]
+        print(
+            f"{size:>8} {kind:<8} build {build_seconds:7.2f}s  query p50 {query['p50_ms']:6.2f}ms p99 {query['p99_ms']:6.2f}ms  "
+            f"search p50 {search['p50_ms']:6.2f}ms p99 {search['p99_ms']:6.2f}ms  "
+            f"{memory / 2**20:7.1f}MB  paraphrase top-1 {top1 if top1 is not None else float('nan'):.3f}"
+        )
+        del bundle, index
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark encoding, index building and query serving on synthetic question corpora.")
+    parser.add_argument("--cards", default="data/cards.csv", help="Path of cards.csv")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="Comma separated corpus sizes")
+    parser.add_argument("--indexes", default="exact,ivf,float16,int8,pq", help="Comma separated index types to compare")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="Name or path of the sentence model")
+    parser.add_argument("--max-encode", type=int, default=100000, help="Encode at most this many questions per corpus, larger corpora are filled with noisy copies")
+    parser.add_argument("--batch-size", type=int, default=64, help="Encoder batch size")
+    parser.add_argument("--queries", type=int, default=200, help="Single questions timed per index")
+    parser.add_argument("--paraphrases", type=int, default=300, help="Corpus questions whose paraphrases are used for the accuracy")
+    parser.add_argument("--rerank", type=int, default=50, help="Re-ranking depth for the float16/int8/pq indexes")
+    parser.add_argument("--n-probe", type=int, default=8, help="Clusters scanned per query for the ivf index")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for all random choices")
+    parser.add_argument("--workdir", default="benchmark_data", help="Where corpora and bundles are written")
+    parser.add_argument("--regenerate", action="store_true", help="Generate the corpora again even if they exist")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    start = time.perf_counter()
+    encoder = load_encoder(args.model)
+    load_model_seconds = time.perf_counter() - start
+
+    results = []
+    for size in (int(value) for value in args.sizes.split(",")):
+        results.extend(run_size(args, encoder, size))
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+        },
+        "settings": {key: value for key, value in vars(args).items() if key not in ("workdir", "output", "regenerate")},
+        "model_load_s": load_model_seconds,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=4)
+    print(f"Results have been saved to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
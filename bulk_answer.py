@@ -0,0 +1,204 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+# app module of the current process (loads model, card lookup and caches once per worker)
+_app = None
+
+# Field added to every output line with the record's position in the input file (resume reads it back)
+OFFSET_FIELD = "_offset"
+
+
+def _init_worker(workers):
+    global _app
+    # A batch run does not need to watch for new bundles
+    os.environ["MODEL_RELOAD_INTERVAL"] = "0"
+    from serve import limit_torch_threads
+
+    limit_torch_threads(workers)
+    import app
+
+    _app = app
+
+
+def _answer_batch(batch_id, records, k, threshold, column):
+    threshold = _app.THRESHOLD if threshold is None else threshold
+    results = _app.rank_questions([str(record.get(column) or "") for record in records], k, threshold)
+    lines = []
+    for record, result in zip(records, results):
+        output = dict(record)
+        # An answer in the input (e.g. a question file) is kept for comparison
+        if "answer" in output:
+            output["expected_answer"] = output.pop("answer")
+        output.update(answer=result["answer"], score=result["score"])
+        if k > 1:
+            output["candidates"] = result["candidates"]
+        lines.append(json.dumps(output, ensure_ascii=False))
+    return batch_id, lines
+
+
+def iter_records(path, column="question", start=0):
+    """
+    Streams question records from a JSONL file (objects or plain strings per line) or a CSV
+    file with a header, numbered by their position in the file (field OFFSET_FIELD, which the
+    input must not have itself).
+
+    Parameters:
+    path (str): Input file (.csv or JSONL).
+    column (str): Field holding the question.
+    start (int): Number of records to skip.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        if os.path.splitext(path)[1].lower() == ".csv":
+            records = csv.DictReader(file)
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+        for offset, record in enumerate(islice(records, start, None), start):
+            if not isinstance(record, dict):
+                record = {column: record}
+            elif OFFSET_FIELD in record:
+                raise ValueError(f"Record {offset} of {path} already has a field '{OFFSET_FIELD}'")
+            yield {**record, OFFSET_FIELD: offset}
+
+
+def _last_newline(file, end, block_size=1 << 16):
+    # Position of the last newline before `end`, read backwards block by block (-1 if there is none)
+    position = end
+    while position > 0:
+        block_start = max(0, position - block_size)
+        file.seek(block_start)
+        index = file.read(position - block_start).rfind(b"\n")
+        if index >= 0:
+            return block_start + index
+        position = block_start
+    return -1
+
+
+def resume_offset(path):
+    """
+    Returns the offset to continue at after an interrupted run and cuts off a half-written last line.
+    Only the end of the output file is read.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as file:
+        size = file.seek(0, os.SEEK_END)
+        complete = _last_newline(file, size) + 1
+        if complete < size:
+            file.truncate(complete)
+        if complete == 0:
+            return 0
+        line_start = _last_newline(file, complete - 1) + 1
+        file.seek(line_start)
+        line = file.read(complete - line_start)
+    return json.loads(line)[OFFSET_FIELD] + 1
+
+
+def iter_batches(records, batch_size):
+    batch_id = 0
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch_id, batch
+        batch_id += 1
+
+
+def answer_file(input_path, output_path, workers=1, batch_size=256, k=1, threshold=None, column="question",
+                start=0, resume=False, report_every=10.0):
+    """
+    Answers every question of a file and writes one JSON line per question (the input record
+    plus answer and score) in input order.
+
+    Only batch_size * workers * 2 questions are in memory at a time: batches are handed to the
+    worker processes as they free up, and finished batches wait for their predecessors before
+    they are written.
+
+    Parameters:
+    input_path (str): Question file (.csv or JSONL).
+    output_path (str): JSONL file the answers are written to.
+    workers (int): Worker processes, each loads the model once (1 = answer in this process).
+    batch_size (int): Questions per batch (one encode and one index query per batch).
+    k (int): Candidates per question; above 1 the candidates are written too.
+    threshold (float): Distance above which "I don't know this yet." is answered (default: the app's).
+    column (str): Field holding the question.
+    start (int): Offset of the first question to answer.
+    resume (bool): Continue after the last question already in the output file.
+    report_every (float): Seconds between two progress lines.
+
+    Returns:
+    int: Number of questions answered in this run.
+    """
+    if resume:
+        start = max(start, resume_offset(output_path))
+    batches = iter_batches(iter_records(input_path, column, start), batch_size)
+    answered = 0
+    start_time = last_report = time.perf_counter()
+
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as output:
+        def write(lines):
+            nonlocal answered, last_report
+            output.write("".join(line + "\n" for line in lines))
+            output.flush()
+            answered += len(lines)
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                last_report = now
+                print(f"Answered {answered} questions (up to offset {start + answered - 1}), {answered / (now - start_time):.0f} questions/s")
+
+        if workers <= 1:
+            _init_worker(1)
+            for batch_id, batch in batches:
+                write(_answer_batch(batch_id, batch, k, threshold, column)[1])
+        else:
+            # "spawn" keeps torch's threads out of the workers; at most two batches per worker are in flight
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(workers,)) as pool:
+                pending, finished_batches, next_batch = set(), {}, 0
+                for batch_id, batch in batches:
+                    pending.add(pool.submit(_answer_batch, batch_id, batch, k, threshold, column))
+                    if len(pending) < workers * 2:
+                        continue
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    finished_batches.update(future.result() for future in finished)
+                    while next_batch in finished_batches:
+                        write(finished_batches.pop(next_batch))
+                        next_batch += 1
+                for future in pending:
+                    finished_batches.update([future.result()])
+                while next_batch in finished_batches:
+                    write(finished_batches.pop(next_batch))
+                    next_batch += 1
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Answered {answered} questions in {elapsed:.1f}s ({answered / max(elapsed, 1e-9):.0f} questions/s), written to '{output_path}'.")
+    return answered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions offline with the app's model.")
+    parser.add_argument("input", help="Question file: JSONL (one object with a question field, or one string, per line) or CSV with a header")
+    parser.add_argument("output", help="JSONL file for the answers")
+    parser.add_argument("--column", default="question", help="Field or CSV column holding the question")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes, each with its own copy of the model")
+    parser.add_argument("--batch-size", type=int, default=256, help="Questions answered together")
+    parser.add_argument("--k", type=int, default=1, help="Candidates per question (above 1 they are written too)")
+    parser.add_argument("--threshold", type=float, default=None, help="Distance above which \"I don't know this yet.\" is answered")
+    parser.add_argument("--start", type=int, default=0, help="Offset of the first question to answer")
+    parser.add_argument("--resume", action="store_true", help="Append to the output and continue after its last answer")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    answer_file(
+        args.input, args.output, args.workers, args.batch_size, args.k, args.threshold, args.column,
+        args.start, args.resume, args.report_every,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+# Values of the multi-valued card columns, in bit order (bit i = 1 << i). Values that are not
+# listed set the last bit, OTHER, so nothing is lost silently.
+COLORS = ("W", "U", "B", "R", "G")
+TYPES = (
+    "Artifact", "Battle", "Conspiracy", "Creature", "Dungeon", "Enchantment", "Instant", "Kindred", "Land",
+    "Phenomenon", "Plane", "Planeswalker", "Scheme", "Sorcery", "Tribal", "Vanguard", "other",
+)
+FINISHES = ("nonfoil", "foil", "etched", "signed", "other")
+
+# Card column -> (mask column, vocabulary, dtype)
+BITMASK_FIELDS = {
+    "colors": ("colorsMask", COLORS, np.uint8),
+    "colorIdentity": ("colorIdentityMask", COLORS, np.uint8),
+    "types": ("typesMask", TYPES, np.uint32),
+    "finishes": ("finishesMask", FINISHES, np.uint8),
+}
+BITMASK_COLUMNS = [mask_column for mask_column, _, _ in BITMASK_FIELDS.values()]
+
+# Other ways of writing a color
+COLOR_NAMES = {"white": "W", "blue": "U", "black": "B", "red": "R", "green": "G"}
+
+
+def _bit(value, vocabulary):
+    if value in vocabulary:
+        return 1 << vocabulary.index(value)
+    if vocabulary[-1] == "other":
+        return 1 << (len(vocabulary) - 1)
+    raise ValueError(f"Unknown value {value!r}, expected one of {', '.join(vocabulary)}")
+
+
+def parse_mask(text, vocabulary):
+    """
+    Bitmask of one comma-separated value ("W, U" -> 0b11 for COLORS); missing or empty is 0.
+    """
+    if text is None or (isinstance(text, float) and np.isnan(text)):
+        return 0
+    mask = 0
+    for value in str(text).split(","):
+        value = value.strip()
+        if value:
+            mask |= _bit(value, vocabulary)
+    return mask
+
+
+def encode(values, vocabulary, dtype=np.uint32):
+    """
+    Turns a column of comma-separated values into bitmasks.
+
+    Only the distinct strings are parsed (a card table has a few hundred distinct color or type
+    combinations), every row then gets its mask through its categorical code.
+
+    Parameters:
+    values (pd.Series): The column (strings or categorical).
+    vocabulary (tuple): The possible values in bit order, e.g. COLORS.
+    dtype: Integer dtype of the masks.
+
+    Returns:
+    np.ndarray: One mask per row, 0 for missing values.
+    """
+    categorical = values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype("category")
+    table = np.array([parse_mask(text, vocabulary) for text in categorical.cat.categories], dtype=dtype)
+    codes = categorical.cat.codes.to_numpy()
+    # Code -1 (missing) takes the appended 0
+    return np.append(table, dtype(0))[codes]
+
+
+def decode(masks, vocabulary, separator=", "):
+    """
+    Turns bitmasks back into comma-separated values (in vocabulary order, 0 becomes None).
+
+    Returns:
+    np.ndarray: Object array of strings.
+    """
+    masks = np.asarray(masks)
+    distinct, inverse = np.unique(masks, return_inverse=True)
+    texts = np.array([
+        separator.join(value for bit, value in enumerate(vocabulary) if int(mask) >> bit & 1) or None
+        for mask in distinct
+    ], dtype=object)
+    return texts[inverse.reshape(-1)]
+
+
+def add_bitmask_columns(cards):
+    """
+    Adds a mask column (colorsMask, typesMask, ...) for every multi-valued column in the frame.
+    """
+    for column, (mask_column, vocabulary, dtype) in BITMASK_FIELDS.items():
+        if column in cards.columns:
+            cards[mask_column] = encode(cards[column], vocabulary, dtype)
+    return cards
+
+
+def color_bits(colors):
+    """
+    Mask for a color filter: "R", "red", "WU", "W,U" or ["white", "blue"]; "C"/"colorless" is 0.
+    """
+    if isinstance(colors, str):
+        text = colors.strip()
+        lower = text.lower()
+        if lower in COLOR_NAMES:
+            colors = [COLOR_NAMES[lower]]
+        elif lower in ("c", "colorless", ""):
+            colors = []
+        elif "," in text:
+            colors = text.split(",")
+        else:
+            colors = list(text.upper())
+    mask = 0
+    for color in colors:
+        color = color.strip()
+        mask |= _bit(COLOR_NAMES.get(color.lower(), color.upper()), COLORS)
+    return mask
+
+
+def bit_count(masks):
+    """
+    Number of set bits per mask (number of colors, types, ...).
+    """
+    masks = np.asarray(masks).astype(np.uint32)
+    counts = np.zeros(masks.shape, dtype=np.uint8)
+    for shift in range(0, 32, 8):
+        counts += _BYTE_BITS[(masks >> shift) & 0xFF]
+    return counts
+
+
+_BYTE_BITS = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def contains_any(masks, bits):
+    """
+    Rows having at least one of the bits ("is red or green").
+    """
+    return (np.asarray(masks) & bits) != 0
+
+
+def contains_all(masks, bits):
+    """
+    Rows having all of the bits ("is red and green", maybe more).
+    """
+    return (np.asarray(masks) & bits) == bits
+
+
+def exactly(masks, bits):
+    """
+    Rows having exactly these bits ("mono-blue": exactly(masks, color_bits("U"))).
+    """
+    return np.asarray(masks) == bits
+
+
+def sum_by_bit(masks, weights, vocabulary):
+    """
+    Sums weights per value, a row counts for every value it has (like exploding the column,
+    without copying the rows).
+
+    Returns:
+    pd.Series: Sum per vocabulary value.
+    """
+    # Also accepts masks that went through a float index (e.g. value_counts of a merged column)
+    masks = np.asarray(masks).astype(np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    return pd.Series(
+        [weights[(masks >> bit & 1).astype(bool)].sum() for bit in range(len(vocabulary))],
+        index=pd.Index(vocabulary),
+    )
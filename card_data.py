@@ -0,0 +1,379 @@
+import hashlib
+import json
+import os
+import operator
+
+import numpy as np
+import pandas as pd
+
+from card_bitmasks import BITMASK_COLUMNS, add_bitmask_columns
+
+# Paths of the raw MTGJSON exports
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+CARDS_CSV = os.path.join(BASE_PATH, "data", "cards.csv")
+PRICES_CSV = os.path.join(BASE_PATH, "data", "cardPrices.csv")
+
+# Bump when the typed schema changes, so old caches get rebuilt
+SCHEMA_VERSION = 2
+
+# Low-cardinality string columns that are stored as categoricals
+CARD_CATEGORICALS = [
+    "rarity", "colors", "colorIdentity", "frameVersion", "borderColor", "layout", "availability", "finishes",
+    "types", "supertypes", "language", "setCode", "watermark", "securityStamp", "boosterTypes",
+]
+PRICE_CATEGORICALS = ["cardFinish", "currency", "gameAvailability", "priceProvider", "providerListing"]
+
+# cardPrices.csv has a fixed layout, so it can be converted in chunks with explicit dtypes
+PRICE_DTYPES = {
+    "cardFinish": str,
+    "currency": str,
+    "date": str,
+    "gameAvailability": str,
+    "price": "float64",
+    "priceProvider": str,
+    "providerListing": str,
+    "uuid": str,
+}
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_info(path):
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _cache_paths(source, cache_dir):
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(source)), "cache")
+    name = os.path.splitext(os.path.basename(source))[0]
+    extension = ".parquet" if _has_pyarrow() else ".pkl"
+    return os.path.join(cache_dir, name + extension), os.path.join(cache_dir, name + ".meta.json")
+
+
+def _cache_is_fresh(source, meta_path):
+    """
+    The cache is fresh if the source's size and mtime match; if only the mtime changed
+    (e.g. the file was copied again) the content hash decides.
+    """
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r", encoding="utf-8") as file:
+        meta = json.load(file)
+    if meta.get("schema_version") != SCHEMA_VERSION:
+        return False
+    info = _source_info(source)
+    if info["size"] != meta["source"]["size"]:
+        return False
+    if info["mtime_ns"] == meta["source"]["mtime_ns"]:
+        return True
+    if file_hash(source) != meta["sha256"]:
+        return False
+    meta["source"] = info
+    _write_meta(meta_path, meta)
+    return True
+
+
+def _write_meta(meta_path, meta):
+    temporary = meta_path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(meta, file, indent=4)
+    os.replace(temporary, meta_path)
+
+
+def clean_cards(cards):
+    """
+    Applies the typed schema to a frame of cards.csv rows; colors, colorIdentity, types and
+    finishes also get an integer bitmask column (see card_bitmasks).
+    """
+    cards = cards.copy()
+    if "uuid" in cards.columns:
+        cards["uuid"] = cards["uuid"].astype(str).str.strip()
+    for column in CARD_CATEGORICALS:
+        if column in cards.columns:
+            cards[column] = cards[column].astype("category")
+    return add_bitmask_columns(cards)
+
+
+def frame_years(frame_versions):
+    """
+    Turns frameVersion labels into years ("1993", "2015"); frames that are no year ("future") become missing.
+    """
+    if isinstance(frame_versions.dtype, pd.CategoricalDtype):
+        # Only the few distinct labels have to be parsed
+        years = pd.to_numeric(frame_versions.cat.categories.astype(str), errors="coerce")
+        return pd.Series(years[frame_versions.cat.codes], index=frame_versions.index).where(frame_versions.cat.codes >= 0).astype("Int16")
+    return pd.to_numeric(frame_versions, errors="coerce").astype("Int16")
+
+
+def clean_prices(prices):
+    """
+    Applies the typed schema to a frame of cardPrices.csv rows.
+    """
+    prices = prices.copy()
+    if "uuid" in prices.columns:
+        prices["uuid"] = prices["uuid"].astype(str).str.strip()
+    if "price" in prices.columns:
+        prices["price"] = pd.to_numeric(prices["price"], errors="coerce")
+    if "date" in prices.columns:
+        prices["date"] = pd.to_datetime(prices["date"], errors="coerce")
+    return prices
+
+
+def _build_cards_cache(source, cache_path):
+    # cards.csv is small enough to read in one go, which gives every column one consistent dtype
+    cards = clean_cards(pd.read_csv(source, low_memory=False, dtype={"uuid": str}))
+    if cache_path.endswith(".parquet"):
+        cards.to_parquet(cache_path, index=False)
+    else:
+        cards.to_pickle(cache_path)
+
+
+def _build_prices_cache(source, cache_path, chunksize=1_000_000):
+    # cardPrices.csv can be huge, it is converted chunk by chunk; strings are dictionary-encoded
+    # by Parquet and come back as categoricals when reading
+    chunks = pd.read_csv(source, dtype=PRICE_DTYPES, chunksize=chunksize)
+    if cache_path.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(clean_prices(chunk), preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(cache_path, table.schema)
+                writer.write_table(table.cast(writer.schema))
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        prices = pd.concat([clean_prices(chunk) for chunk in chunks], ignore_index=True)
+        for column in PRICE_CATEGORICALS:
+            prices[column] = prices[column].astype("category")
+        prices.to_pickle(cache_path)
+
+
+def ensure_cache(source, builder, cache_dir=None):
+    """
+    Converts a CSV into the columnar cache unless an up-to-date cache already exists.
+
+    Returns:
+    str: Path of the cache file.
+    """
+    cache_path, meta_path = _cache_paths(source, cache_dir)
+    if os.path.exists(cache_path) and _cache_is_fresh(source, meta_path):
+        return cache_path
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temporary = cache_path + ".tmp"
+    builder(source, temporary)
+    os.replace(temporary, cache_path)
+    _write_meta(meta_path, {
+        "schema_version": SCHEMA_VERSION,
+        "source": _source_info(source),
+        "sha256": file_hash(source),
+    })
+    return cache_path
+
+
+_OPERATORS = {
+    "==": operator.eq, "=": operator.eq, "!=": operator.ne,
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+}
+
+
+def _apply_filters(frame, filters):
+    mask = pd.Series(True, index=frame.index)
+    for column, op, value in filters:
+        if op == "in":
+            mask &= frame[column].isin(value)
+        elif op == "not in":
+            mask &= ~frame[column].isin(value)
+        else:
+            mask &= _OPERATORS[op](frame[column], value)
+    return frame[mask].reset_index(drop=True)
+
+
+def _read_cache(cache_path, columns, filters, categoricals):
+    if cache_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        # Only the requested columns are read and row groups not matching the filters are skipped
+        dictionary = [column for column in categoricals if columns is None or column in columns]
+        table = pq.read_table(cache_path, columns=columns, filters=filters or None, read_dictionary=dictionary)
+        return table.to_pandas()
+    frame = pd.read_pickle(cache_path)
+    if filters:
+        frame = _apply_filters(frame, filters)
+    return frame[columns] if columns is not None else frame
+
+
+def load_cards(columns=None, filters=None, path=CARDS_CSV, cache_dir=None, frame_year=True):
+    """
+    Loads cards.csv through the typed columnar cache.
+
+    Parameters:
+    columns (list): Only load these columns (default: all).
+    filters (list): Row filters as (column, operator, value) tuples, e.g. [("rarity", "==", "mythic")].
+    path (str): Path of cards.csv.
+    cache_dir (str): Where the cache lives (default: a "cache" folder next to the CSV).
+    frame_year (bool): Return frameVersion as a numeric year instead of the original label.
+
+    Returns:
+    pd.DataFrame: The cards with categoricals for low-cardinality columns, numeric frameVersion and stripped uuid.
+    """
+    cache_path = ensure_cache(path, _build_cards_cache, cache_dir)
+    cards = _read_cache(cache_path, columns, filters, CARD_CATEGORICALS)
+    if frame_year and "frameVersion" in cards.columns:
+        cards["frameVersion"] = frame_years(cards["frameVersion"])
+    return cards
+
+
+def load_card_prices(columns=None, filters=None, path=PRICES_CSV, cache_dir=None):
+    """
+    Loads cardPrices.csv through the typed columnar cache.
+
+    Parameters:
+    columns (list): Only load these columns (default: all).
+    filters (list): Row filters as (column, operator, value) tuples, e.g. [("price", ">", 10)].
+    path (str): Path of cardPrices.csv.
+    cache_dir (str): Where the cache lives (default: a "cache" folder next to the CSV).
+
+    Returns:
+    pd.DataFrame: The prices with numeric price, parsed date, categorical provider columns and stripped uuid.
+    """
+    cache_path = ensure_cache(path, _build_prices_cache, cache_dir)
+    return _read_cache(cache_path, columns, filters, PRICE_CATEGORICALS)
+
+
+def iter_cards(columns=None, chunksize=5000, path=CARDS_CSV, cache_dir=None):
+    """
+    Streams the cards in chunks of about `chunksize` rows, with the columns typed as in the cache
+    (frameVersion keeps its original labels). Without `columns` all columns of cards.csv are read,
+    the derived bitmask columns only when asked for.
+    """
+    cache_path = ensure_cache(path, _build_cards_cache, cache_dir)
+    if cache_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        dictionary = [column for column in CARD_CATEGORICALS if columns is None or column in columns]
+        parquet_file = pq.ParquetFile(cache_path, read_dictionary=dictionary)
+        if columns is None:
+            columns = [column for column in parquet_file.schema_arrow.names if column not in BITMASK_COLUMNS]
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        cards = _read_cache(cache_path, columns, None, CARD_CATEGORICALS)
+        if columns is None:
+            cards = cards.drop(columns=BITMASK_COLUMNS, errors="ignore")
+        for start in range(0, len(cards), chunksize):
+            yield cards.iloc[start:start + chunksize]
+
+
+def iter_price_chunks(path=PRICES_CSV, columns=None, chunksize=1_000_000, start=0, rows=None):
+    """
+    Streams cardPrices.csv in typed chunks straight from the CSV, memory stays flat however long
+    the price history gets.
+
+    Parameters:
+    path (str): Path of cardPrices.csv.
+    columns (list): Only read these columns (default: all).
+    chunksize (int): Number of price rows per chunk.
+    start (int): Byte offset of a line to start at (0 = the beginning, including the header).
+    rows (int): Stop after this many rows (default: read to the end).
+    """
+    header = list(pd.read_csv(path, nrows=0).columns)
+    dtypes = {column: dtype for column, dtype in PRICE_DTYPES.items() if column in header and column != "price"}
+    with open(path, "rb") as file:
+        file.seek(start)
+        chunks = pd.read_csv(
+            file, header=0 if start == 0 else None, names=None if start == 0 else header,
+            usecols=columns, dtype=dtypes, nrows=rows, chunksize=chunksize,
+        )
+        for chunk in chunks:
+            yield clean_prices(chunk)
+
+
+class CardIndex:
+    """
+    Compact uuid -> card row index for joining price rows to cards without a full merge.
+
+    Every uuid is turned into an integer code (the position of its card row) with one hash
+    lookup, the card columns are then taken by position.
+
+    Parameters:
+    cards (pd.DataFrame): Card rows with a "uuid" column, the uuids have to be unique.
+    """
+
+    def __init__(self, cards):
+        uuids = cards["uuid"].astype(str).str.strip()
+        if not uuids.is_unique:
+            duplicates = uuids[uuids.duplicated()].unique()[:5]
+            raise ValueError(f"Card uuids are not unique (e.g. {', '.join(duplicates)}), drop the duplicates before joining")
+        self.uuids = pd.Index(uuids.to_numpy())
+        self.cards = cards.drop(columns="uuid").reset_index(drop=True)
+        self._padded = None
+
+    def __len__(self):
+        return len(self.uuids)
+
+    def rows(self, uuids):
+        """
+        Returns the card row of every uuid, -1 for unknown uuids.
+        """
+        return self.uuids.get_indexer(uuids)
+
+    def take(self, rows):
+        """
+        Returns the card columns for the given rows, -1 gives a row of missing values.
+        """
+        if len(rows) == 0 or rows.min() >= 0:
+            return self.cards.iloc[rows].reset_index(drop=True)
+        if self._padded is None:
+            # One extra row of missing values at the end, used for unknown uuids
+            self._padded = pd.concat([self.cards, self.cards.iloc[:0].reindex([len(self.cards)])])
+        rows = np.where(rows < 0, len(self.cards), rows)
+        return self._padded.iloc[rows].reset_index(drop=True)
+
+
+def merge_price_chunks(cards, price_chunks, how="inner"):
+    """
+    Joins a stream of price chunks with the cards on "uuid", one chunk at a time.
+
+    Gives the same rows and columns as prices.merge(cards, on="uuid", how=how) over the whole
+    price table, in the order of the price rows; only the card table and one chunk are in memory.
+
+    Parameters:
+    cards (pd.DataFrame or CardIndex): The cards, their uuids have to be unique.
+    price_chunks (iterable): Price frames with a "uuid" column, e.g. from iter_price_chunks.
+    how (str): "inner" drops prices of unknown cards, "left" keeps them with missing card values.
+    """
+    if how not in ("inner", "left"):
+        raise ValueError(f"Unknown join type '{how}', use 'inner' or 'left'")
+    index = cards if isinstance(cards, CardIndex) else CardIndex(cards)
+    for chunk in price_chunks:
+        rows = index.rows(chunk["uuid"])
+        if how == "inner":
+            known = rows >= 0
+            chunk, rows = chunk[known], rows[known]
+        yield pd.concat([chunk.reset_index(drop=True), index.take(rows)], axis=1)
+
+
+def iter_merged_prices(cards, how="inner", path=PRICES_CSV, columns=None, chunksize=1_000_000):
+    """
+    Streams cardPrices.csv joined with the cards (see merge_price_chunks).
+    """
+    return merge_price_chunks(cards, iter_price_chunks(path, columns, chunksize), how)
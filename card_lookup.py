@@ -0,0 +1,211 @@
+import re
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from answer_cache import normalize_question
+from card_bitmasks import BITMASK_COLUMNS
+from card_data import load_cards
+
+# Extra ways of naming a column, on top of the column name itself ("manaCost" -> "manacost", "mana cost")
+ATTRIBUTE_SYNONYMS = {
+    "manaCost": ["cost", "mana", "casting cost", "mana costs"],
+    "manaValue": ["mana value", "cmc", "converted mana cost", "converted cost"],
+    "text": ["oracle text", "rules text", "card text", "ability", "abilities"],
+    "originalText": ["original text", "printed text"],
+    "flavorText": ["flavor", "flavour", "flavour text"],
+    "type": ["type line", "card type", "typeline"],
+    "types": ["card types"],
+    "subtypes": ["subtype", "creature type"],
+    "supertypes": ["supertype"],
+    "colors": ["color", "colour", "colours"],
+    "colorIdentity": ["color identity", "colour identity"],
+    "artist": ["illustrator", "artwork by", "painter"],
+    "power": ["attack", "strength"],
+    "toughness": ["defense", "defence"],
+    "loyalty": ["planeswalker loyalty"],
+    "rarity": ["how rare"],
+    "setCode": ["set", "edition", "expansion"],
+    "number": ["collector number", "card number"],
+    "edhrecRank": ["edhrec rank", "edhrec"],
+    "frameVersion": ["frame", "frame version", "frame year"],
+    "borderColor": ["border", "border color", "border colour"],
+    "keywords": ["keyword"],
+    "language": ["lang"],
+}
+
+_CAMEL_CASE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def split_camel_case(name):
+    """
+    "manaCost" -> "mana Cost"
+    """
+    return _CAMEL_CASE.sub(" ", name)
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over word tokens. Finds every known phrase in a token list
+    in a single pass, independent of how many phrases are stored.
+
+    Parameters:
+    phrases (dict): Maps a tuple of tokens to the value returned when the phrase is found.
+    """
+
+    def __init__(self, phrases):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]
+        for tokens, value in phrases.items():
+            node = 0
+            for token in tokens:
+                next_node = self.goto[node].get(token)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][token] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(None)
+                node = next_node
+            if self.output[node] is None:
+                self.output[node] = (len(tokens), value)
+
+        # Breadth-first pass for the failure links; dictionary links point to the next
+        # node on the failure chain that ends a phrase, so matches are collected without
+        # walking the whole chain
+        self.dictionary = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token, 0)
+                target = self.fail[child]
+                self.dictionary[child] = target if self.output[target] is not None else self.dictionary[target]
+
+    def __len__(self):
+        return len(self.goto)
+
+    def find_all(self, tokens):
+        """
+        Returns (start, end, value) for every phrase occurrence, where tokens[start:end] is the phrase.
+        """
+        matches = []
+        node = 0
+        for position, token in enumerate(tokens):
+            while node and token not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(token, 0)
+            match_node = node if self.output[node] is not None else self.dictionary[node]
+            while match_node:
+                length, value = self.output[match_node]
+                matches.append((position + 1 - length, position + 1, value))
+                match_node = self.dictionary[match_node]
+        return matches
+
+    def find_longest(self, tokens):
+        """
+        Returns the longest phrase occurrence (the first one on ties) or None.
+        """
+        matches = self.find_all(tokens)
+        if not matches:
+            return None
+        return min(matches, key=lambda match: (match[0] - match[1], match[0]))
+
+
+def _phrase_tokens(text):
+    return tuple(normalize_question(text).split())
+
+
+def build_attribute_phrases(columns, synonyms=ATTRIBUTE_SYNONYMS):
+    """
+    Builds the attribute synonym table for the given columns.
+
+    Returns:
+    dict: Maps a token tuple (e.g. ("mana", "cost")) to a column name (e.g. "manaCost").
+    """
+    phrases = {}
+    for column in columns:
+        for phrase in [column, split_camel_case(column), *synonyms.get(column, [])]:
+            tokens = _phrase_tokens(phrase)
+            if tokens:
+                phrases.setdefault(tokens, column)
+    return phrases
+
+
+class CardLookup:
+    """
+    Answers "attribute X of card Y" questions straight from the card table.
+
+    The card name and the attribute are found with word-level Aho-Corasick automatons;
+    the answer comes from per-column arrays indexed by the card's row.
+
+    Parameters:
+    cards (pd.DataFrame): The card table, needs a "name" column.
+    columns (list): Columns that can be asked about (default: all columns except the bitmasks).
+    """
+
+    def __init__(self, cards, columns=None):
+        columns = [column for column in (columns or cards.columns.difference(BITMASK_COLUMNS, sort=False)) if column in cards.columns]
+        names = cards["name"].astype(str).to_numpy()
+        # The first printing of a name wins, like the first generated question for it
+        first_rows = pd.Series(np.arange(len(names))).groupby(names, sort=False).first()
+        self.names = first_rows.index.to_numpy(dtype=object)
+        self.rows = {name: i for i, name in enumerate(self.names)}
+        self.columns = {}
+        for column in columns:
+            # Columns keep their own dtype, values are only turned into strings when asked for
+            self.columns[column] = cards[column].to_numpy()[first_rows.to_numpy()]
+        self.name_matcher = PhraseMatcher({
+            tokens: i for i, tokens in enumerate(_phrase_tokens(name) for name in self.names) if tokens
+        })
+        self.attribute_matcher = PhraseMatcher(build_attribute_phrases(columns))
+
+    @classmethod
+    def from_csv(cls, path, columns=None):
+        # Goes through the typed card cache, so restarts do not parse the CSV again
+        return cls(load_cards(path=path, frame_year=False), columns)
+
+    def __len__(self):
+        return len(self.names)
+
+    def parse(self, question):
+        """
+        Finds the card name and the attribute in a question.
+
+        Returns:
+        tuple: (card name, column) or None if either part is missing.
+        """
+        tokens = normalize_question(question).split()
+        name_match = self.name_matcher.find_longest(tokens)
+        if name_match is None:
+            return None
+        start, end, row = name_match
+        # The attribute has to be outside of the card name ("Angel of Mercy" must not be read as "mana")
+        rest = tokens[:start] + ["\0"] + tokens[end:]
+        attribute_match = self.attribute_matcher.find_longest(rest)
+        if attribute_match is None:
+            return None
+        return self.names[row], attribute_match[2]
+
+    def lookup(self, name, column):
+        row = self.rows.get(name)
+        if row is None or column not in self.columns:
+            return None
+        value = self.columns[column][row]
+        # Same formatting as the answers in the generated questions
+        return str(value) if pd.notna(value) else None
+
+    def answer(self, question):
+        """
+        Returns the answer to a question, or None if the question could not be parsed or the value is missing.
+        """
+        parsed = self.parse(question)
+        if parsed is None:
+            return None
+        return self.lookup(*parsed)
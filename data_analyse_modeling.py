@@ -1,11 +1,13 @@
-import os
-import numpy as np
 import pandas as pd
 import seaborn as sns
 import warnings
 import matplotlib
 import matplotlib.pyplot as plt
 
+from card_bitmasks import COLORS, sum_by_bit
+from card_data import iter_merged_prices, load_cards
+from price_aggregates import refresh_aggregates
+
 def set_pandas_display_options(max_rows=50, max_columns=50):
     """
     Sets the pandas display options for showing the number of rows and columns.
@@ -35,27 +37,31 @@ set_pandas_display_options()
 suppress_warnings()
 initialize_plotting()
 
-# Get the current working directory and build the file paths
-base_path = os.path.dirname(os.path.realpath(__file__))
-df1_path = os.path.join(base_path, "data", "cards.csv")
-df2_path = os.path.join(base_path, "data", "cardPrices.csv")
+# Load only the columns the analysis needs; the cards come from the typed Parquet cache
+# (numeric frameVersion, categorical colors/rarity, colors as WUBRG bitmask, stripped uuid)
+df1 = load_cards(columns=["uuid", "name", "colors", "colorsMask", "frameVersion", "rarity"])
 
-# Load CSV files
-df1 = pd.read_csv(df1_path, dtype={"uuid": str})
-df2 = pd.read_csv(df2_path, dtype={"uuid": str})
+def count_merged_values(cards, columns, chunksize=1_000_000):
+    """
+    Left joins cardPrices.csv with the cards chunk by chunk and counts the values of some columns,
+    so the merged table never has to fit into memory.
 
-# Ensure uuid has no leading/trailing spaces
-df1["uuid"] = df1["uuid"].str.strip()
-df2["uuid"] = df2["uuid"].str.strip()
+    Parameters:
+    cards (pd.DataFrame): The cards, joined on "uuid".
+    columns (list): The card columns whose values are counted.
+    chunksize (int): The number of price rows joined at a time.
 
-# Left join on "uuid"
-merged_df = df2.merge(df1, on="uuid", how="left")
+    Returns:
+    dict: Maps every column to the counts of its values (missing values are not counted).
+    """
+    counts = {column: pd.Series(dtype="int64") for column in columns}
+    for chunk in iter_merged_prices(cards[["uuid", *columns]], how="left", columns=["uuid", "price"], chunksize=chunksize):
+        for column in columns:
+            counts[column] = counts[column].add(chunk[column].value_counts(), fill_value=0)
+    return {column: value_counts[value_counts > 0].astype(int) for column, value_counts in counts.items()}
 
-# Check if 'price' column exists
-if "price" in merged_df.columns:
-    print("Column 'price' exists in merged_df.")
-else:
-    print("Column 'price' does not exist in merged_df.")
+# Left join on "uuid", streamed; only the value counts per column are kept
+merged_counts = count_merged_values(df1, ["colorsMask", "frameVersion", "rarity"])
 
 def get_dataframe_shape(df):
     """
@@ -76,8 +82,10 @@ print(f"Shape of DataFrame: {shape}")
 # Display first 5 rows of df1
 print(df1.head())
 
-# Plot count of cards by color
-color_counts = merged_df["colors"].value_counts()
+# Plot count of cards by color (a multi-colored card counts for each of its colors; the at most
+# 32 distinct masks are counted per color bit instead of splitting the color strings)
+mask_counts = merged_counts["colorsMask"]
+color_counts = sum_by_bit(mask_counts.index, mask_counts.to_numpy(), COLORS).astype(int).sort_values(ascending=False)
 
 # Plot the data
 plt.figure(figsize=(10, 6))
@@ -90,14 +98,12 @@ plt.title("Count of Cards by Color")
 plt.xticks(rotation=45)
 plt.show()
 
-# Ensure price column is numeric
-merged_df["price"] = pd.to_numeric(merged_df["price"], errors="coerce")
-
-# If colors are stored as lists, explode them
-merged_df_exploded = merged_df.explode("colors")
+# The averages come from the pre-aggregated price cubes, only price rows added since the last run are read
+price_aggregates, new_price_rows = refresh_aggregates()
+print(f"Price aggregates updated with {new_price_rows} new price rows.")
 
-# Calculate the average price per color
-avg_price_per_color = merged_df_exploded.groupby("colors")["price"].mean().dropna()
+# Calculate the average price per color (multi-colored cards count for each of their colors)
+avg_price_per_color = price_aggregates.breakdown("color")
 
 # Plot the data
 plt.figure(figsize=(10, 6))
@@ -110,17 +116,8 @@ plt.title("Average Price of Cards by Color")
 plt.xticks(rotation=45)
 plt.show()
 
-# Convert frameVersion to numeric
-merged_df["frameVersion"] = pd.to_numeric(merged_df["frameVersion"], errors="coerce")
-
-# Drop NaN values (if there are invalid years)
-merged_df_cleaned = merged_df.dropna(subset=["frameVersion"])
-
-# Convert to integer
-merged_df_cleaned["frameVersion"] = merged_df_cleaned["frameVersion"].astype(int)
-
-# Count occurrences of each frameVersion
-frame_counts = merged_df_cleaned["frameVersion"].value_counts().sort_index()
+# Count occurrences of each frameVersion (already numeric, invalid years are missing and not counted)
+frame_counts = merged_counts["frameVersion"].rename(index=int).sort_index()
 
 # Plot the data
 plt.figure(figsize=(12, 6))
@@ -133,14 +130,8 @@ plt.title("Number of Cards by Frame Version (Year)")
 plt.xticks(rotation=45)
 plt.show()
 
-# Ensure "price" is numeric
-merged_df["price"] = pd.to_numeric(merged_df["price"], errors="coerce")
-
-# Remove invalid rows (NaN values)
-merged_df_cleaned = merged_df.dropna(subset=["frameVersion", "price"])
-
 # Calculate average price per year
-avg_price_per_year = merged_df_cleaned.groupby("frameVersion")["price"].mean()
+avg_price_per_year = price_aggregates.breakdown("year")
 
 # Plot the data
 plt.figure(figsize=(12, 6))
@@ -156,7 +147,7 @@ plt.grid(True)
 plt.show()
 
 # Count the number of cards by rarity
-rarity_counts = merged_df["rarity"].value_counts()
+rarity_counts = merged_counts["rarity"].sort_values(ascending=False)
 
 # Plot the data
 plt.figure(figsize=(10, 6))
@@ -169,11 +160,8 @@ plt.title("Number of Cards by Rarity")
 plt.xticks(rotation=45)
 plt.show()
 
-# Remove invalid rows (NaN values)
-merged_df_cleaned = merged_df.dropna(subset=["rarity", "price"])
-
 # Calculate average price per rarity
-avg_price_per_rarity = merged_df_cleaned.groupby("rarity")["price"].mean()
+avg_price_per_rarity = price_aggregates.breakdown("rarity")
 
 # Plot the data
 plt.figure(figsize=(10, 6))
@@ -0,0 +1,171 @@
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+import multiprocessing
+
+import numpy as np
+
+from question_io import iter_question_records
+
+# Sentence model of the current worker process
+_worker_model = None
+
+
+def _init_worker(model_name, torch_threads):
+    global _worker_model
+    if torch_threads:
+        # Several workers with one torch thread pool each would otherwise fight for the same cores
+        import torch
+
+        torch.set_num_threads(torch_threads)
+    from model_bundle import load_encoder
+
+    _worker_model = load_encoder(model_name)
+
+
+def _encode_chunk(chunk_id, positions, texts, batch_size):
+    embeddings = _worker_model.encode(texts, batch_size=batch_size)
+    return chunk_id, positions, np.asarray(embeddings, dtype=np.float32)
+
+
+def iter_length_sorted_chunks(path, chunk_size, window_chunks):
+    """
+    Streams (chunk id, positions, texts) from a question file.
+
+    The questions are read window by window (window_chunks * chunk_size questions at a
+    time) and sorted by length inside a window, so every chunk holds questions of
+    similar length and little padding is wasted in the transformer batches.
+    """
+    records = iter_question_records(path)
+    window_size = chunk_size * window_chunks
+    chunk_id = 0
+    offset = 0
+    while True:
+        texts = [record["question"] for record in islice(records, window_size)]
+        if not texts:
+            break
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        for start in range(0, len(texts), chunk_size):
+            selected = order[start:start + chunk_size]
+            yield chunk_id, (selected + offset).astype(np.int64), [texts[i] for i in selected]
+            chunk_id += 1
+        offset += len(texts)
+
+
+def count_questions(path):
+    return sum(1 for _ in iter_question_records(path))
+
+
+class _Checkpoint:
+    """
+    Remembers which chunks have been written, so a crashed run can continue where it stopped.
+    """
+
+    def __init__(self, path, settings, resume):
+        self.path = path
+        self.settings = settings
+        self.done = set()
+        if resume and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                state = json.load(file)
+            if state.get("settings") != settings:
+                raise ValueError(f"Checkpoint {path} was written with different settings, start without resume")
+            self.done = set(state["done"])
+
+    def mark(self, chunk_id):
+        self.done.add(chunk_id)
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump({"settings": self.settings, "done": sorted(self.done)}, file)
+        os.replace(temporary, self.path)
+
+
+def encode_corpus(questions_path, output_path, model_name, chunk_size=10000, workers=1, torch_threads=None,
+                  batch_size=64, window_chunks=8, resume=True):
+    """
+    Encodes every question of a question file into a memory-mapped .npy array.
+
+    Parameters:
+    questions_path (str): Question file (.json, .jsonl or .parquet), read as a stream.
+    output_path (str): The .npy file the embeddings are written to (row i belongs to question i).
+    model_name (str): Name or path of the sentence model.
+    chunk_size (int): Number of questions per task.
+    workers (int): Number of worker processes, each holds its own copy of the model (1 = encode in this process).
+    torch_threads (int): Torch threads per worker (default: cores divided by workers).
+    batch_size (int): Transformer batch size inside a chunk.
+    window_chunks (int): Number of chunks that are read and sorted by length together.
+    resume (bool): Continue an interrupted run with the same settings instead of starting over.
+
+    Returns:
+    np.memmap: The embeddings.
+    """
+    count = count_questions(questions_path)
+    if torch_threads is None and workers > 1:
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    # A rewritten question file (even with the same number of questions) cannot be resumed
+    stat = os.stat(questions_path)
+    settings = {
+        "questions": os.path.abspath(questions_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "count": count,
+        "model": model_name,
+        "chunk_size": chunk_size,
+        "window_chunks": window_chunks,
+    }
+    checkpoint = _Checkpoint(output_path + ".progress.json", settings, resume and os.path.exists(output_path))
+    embeddings = np.load(output_path, mmap_mode="r+") if checkpoint.done else None
+    written = 0
+    start_time = time.perf_counter()
+
+    def store(chunk_id, positions, chunk_embeddings):
+        nonlocal embeddings, written
+        if embeddings is None:
+            # The array is allocated once the model told us the embedding size
+            embeddings = np.lib.format.open_memmap(
+                output_path, mode="w+", dtype=np.float32, shape=(count, chunk_embeddings.shape[1])
+            )
+        embeddings[positions] = chunk_embeddings
+        embeddings.flush()
+        checkpoint.mark(chunk_id)
+        written += len(positions)
+        rate = written / max(time.perf_counter() - start_time, 1e-9)
+        print(f"Encoded chunk {chunk_id} ({written} questions this run, {rate:.0f} questions/s)")
+
+    chunks = (
+        chunk for chunk in iter_length_sorted_chunks(questions_path, chunk_size, window_chunks)
+        if chunk[0] not in checkpoint.done
+    )
+    if workers <= 1:
+        _init_worker(model_name, torch_threads)
+        for chunk_id, positions, texts in chunks:
+            store(*_encode_chunk(chunk_id, positions, texts, batch_size))
+    else:
+        # "spawn" keeps torch's own threads out of the forked workers; at most two tasks per worker are in flight
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(model_name, torch_threads)) as pool:
+            pending = set()
+            for chunk_id, positions, texts in chunks:
+                pending.add(pool.submit(_encode_chunk, chunk_id, positions, texts, batch_size))
+                if len(pending) >= workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        store(*future.result())
+            for future in pending:
+                store(*future.result())
+
+    if embeddings is None:
+        embeddings = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.float32, shape=(count, 0))
+    return embeddings
+
+
+def remove_checkpoint(output_path):
+    """
+    Deletes the embedding file and its progress file after they were copied into a bundle.
+    """
+    for path in (output_path, output_path + ".progress.json"):
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,319 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from card_data import file_hash
+
+SOURCES_FILE = "sources.json"
+
+
+def _code_names(code):
+    # Global names used by a function, including those of nested functions, lambdas and comprehensions
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if inspect.iscode(constant):
+            names |= _code_names(constant)
+    return names
+
+
+def _constant_repr(value):
+    # Sets are written sorted, their repr depends on the hash seed
+    return sorted(map(repr, value)) if isinstance(value, (set, frozenset)) else repr(value)
+
+
+def _local_module(value, directory):
+    # The module a value belongs to, if that module is a file of the project (in `directory`)
+    module = value if inspect.ismodule(value) else sys.modules.get(getattr(value, "__module__", None) or "")
+    path = getattr(module, "__file__", None)
+    if path and os.path.dirname(os.path.abspath(path)) == directory:
+        return module
+    return None
+
+
+def code_key(function):
+    """
+    Hash of the code a stage runs: the source of the function and of the functions of its own
+    module that it calls (recursively), the whole file of every other project module it uses
+    (and of the project modules those import), and the values of the plain constants it reads.
+    Libraries outside the project directory are not part of the key.
+    """
+    directory = os.path.dirname(os.path.abspath(inspect.getfile(function)))
+    digest = hashlib.sha256()
+    functions, modules = [function], {}
+    seen_functions = {function}
+    while functions:
+        current = functions.pop()
+        digest.update(inspect.getsource(current).encode("utf-8"))
+        for name in sorted(_code_names(current.__code__)):
+            if name not in current.__globals__:
+                continue
+            value = current.__globals__[name]
+            if inspect.isfunction(value) and value.__module__ == function.__module__:
+                if value not in seen_functions:
+                    seen_functions.add(value)
+                    functions.append(value)
+            elif _local_module(value, directory) is not None:
+                module = _local_module(value, directory)
+                modules.setdefault(module.__name__, module)
+            elif not (inspect.ismodule(value) or callable(value)):
+                digest.update(name.encode("utf-8"))
+                digest.update(json.dumps(value, sort_keys=True, default=_constant_repr).encode("utf-8"))
+    # Project modules are hashed as a whole, together with the project modules they import
+    pending = list(modules.values())
+    while pending:
+        module = pending.pop()
+        for value in list(vars(module).values()):
+            dependency = _local_module(value, directory)
+            if dependency is not None and dependency.__name__ not in modules and dependency.__name__ != function.__module__:
+                modules[dependency.__name__] = dependency
+                pending.append(dependency)
+    for name in sorted(modules):
+        digest.update(name.encode("utf-8"))
+        digest.update(file_hash(modules[name].__file__).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Stage:
+    """
+    One named step of a Pipeline.
+
+    Parameters:
+    name (str): Name of the stage, also the name of its cache file.
+    function (callable): Called with the results of the input stages (in order) and the params.
+    inputs (tuple): Names of the stages whose results the function takes.
+    sources (tuple): Files the stage reads; their content is part of the cache key.
+    outputs (tuple): Files the stage writes (e.g. plots); the cached result only counts if they exist.
+    params (dict): Keyword arguments for the function (must be JSON-serialisable, they are part of the key).
+    """
+
+    def __init__(self, name, function, inputs=(), sources=(), outputs=(), params=None):
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.sources = tuple(sources)
+        self.outputs = tuple(outputs)
+        self.params = params or {}
+
+
+class Pipeline:
+    """
+    Runs named stages with a content-addressed cache.
+
+    The key of a stage is a hash of its code (see code_key: the function, the functions of its
+    module it calls and the project modules it uses), its params, the content of its source files
+    and the keys of its input stages; changing a library does not change the key, run those
+    stages with force. A stage whose key already has a result in the
+    cache is not run again; its result is only read from disk if a stage that does run needs it.
+    Stages that do not depend on each other run at the same time on a thread pool (pandas and
+    numpy release the GIL for most of their work).
+
+    Parameters:
+    cache_dir (str): Directory of the cached results (one pickle per stage, the last key only).
+    workers (int): Stages run at the same time.
+    trace_memory (bool): Measure the peak Python/numpy memory of every stage with tracemalloc
+    (slower; stages running at the same time share one measurement).
+    """
+
+    def __init__(self, cache_dir, workers=4, trace_memory=False):
+        self.cache_dir = cache_dir
+        self.workers = max(1, workers)
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self._source_keys = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, function, inputs=(), sources=(), outputs=(), **params):
+        """
+        Adds a stage (see Stage); inputs must have been added before.
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' already exists")
+        missing = [stage for stage in inputs if stage not in self.stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' needs unknown stages: {', '.join(missing)}")
+        self.stages[name] = Stage(name, function, inputs, sources, outputs, params)
+        return self.stages[name]
+
+    def source_key(self, path):
+        """
+        Content hash of a source file; remembered by size and mtime, so unchanged files are not read again.
+        """
+        path = os.path.abspath(path)
+        if path in self._source_keys:
+            return self._source_keys[path]
+        stamps_path = os.path.join(self.cache_dir, SOURCES_FILE)
+        stamps = {}
+        if os.path.exists(stamps_path):
+            with open(stamps_path, "r", encoding="utf-8") as file:
+                stamps = json.load(file)
+        stat = os.stat(path)
+        stamp = stamps.get(path)
+        if stamp is None or stamp["size"] != stat.st_size or stamp["mtime_ns"] != stat.st_mtime_ns:
+            stamp = stamps[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_hash(path)}
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(stamps_path + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(stamps, file, indent=4)
+            os.replace(stamps_path + ".tmp", stamps_path)
+        self._source_keys[path] = stamp["sha256"]
+        return stamp["sha256"]
+
+    def keys(self):
+        """
+        Returns the cache key of every stage (stages are added in dependency order).
+        """
+        keys, code_keys = {}, {}
+        for name, stage in self.stages.items():
+            if stage.function not in code_keys:
+                code_keys[stage.function] = code_key(stage.function)
+            digest = hashlib.sha256(name.encode("utf-8"))
+            digest.update(code_keys[stage.function].encode("utf-8"))
+            digest.update(json.dumps(stage.params, sort_keys=True, default=str).encode("utf-8"))
+            for path in stage.sources:
+                digest.update(self.source_key(path).encode("utf-8"))
+            for path in stage.outputs:
+                digest.update(os.path.abspath(path).encode("utf-8"))
+            for dependency in stage.inputs:
+                digest.update(keys[dependency].encode("utf-8"))
+            keys[name] = digest.hexdigest()[:16]
+        return keys
+
+    def cache_path(self, name, key):
+        return os.path.join(self.cache_dir, f"{name}-{key}.pkl")
+
+    def is_cached(self, name, key):
+        return os.path.exists(self.cache_path(name, key)) and all(os.path.exists(path) for path in self.stages[name].outputs)
+
+    def load(self, name, key):
+        with open(self.cache_path(name, key), "rb") as file:
+            return pickle.load(file)
+
+    def _store(self, name, key, result):
+        path = self.cache_path(name, key)
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        # Only the newest result of a stage is kept
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.startswith(name + "-") and file_name.endswith(".pkl") and file_name != os.path.basename(path):
+                if file_name[len(name) + 1:-4].isalnum():
+                    os.remove(os.path.join(self.cache_dir, file_name))
+        return os.path.getsize(path)
+
+    def _plan(self, targets, keys, force):
+        # Walks back from the targets: a stage runs if it is forced or not cached; the inputs of a
+        # running stage are needed, either computed or read from the cache
+        run, needed = set(), set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name in needed:
+                continue
+            needed.add(name)
+            if name in force or not self.is_cached(name, keys[name]):
+                run.add(name)
+                pending.extend(self.stages[name].inputs)
+        return run, needed
+
+    def run(self, targets=None, force=()):
+        """
+        Brings the targets (default: all stages) up to date.
+
+        Parameters:
+        targets (list): Names of the stages whose results are wanted (their inputs are brought up
+        to date too, but only the targets' results are returned).
+        force (iterable): Stages that run even if they are cached.
+
+        Returns:
+        tuple: (results of the targets as a dict, report as a list of dicts with stage, status,
+        seconds, output_mb and peak_mb).
+        """
+        targets = list(targets or self.stages)
+        unknown = [name for name in list(targets) + list(force) if name not in self.stages]
+        if unknown:
+            raise ValueError(f"Unknown stages: {', '.join(unknown)}, choose from: {', '.join(self.stages)}")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        keys = self.keys()
+        run, needed = self._plan(targets, keys, set(force))
+
+        # Number of running stages (and targets) that still need a result, it is dropped at 0
+        users = {name: sum(name in self.stages[other].inputs for other in run) + (name in targets) for name in needed}
+        results = {}
+        report = {name: {"stage": name, "status": "cached", "seconds": 0.0, "output_mb": None, "peak_mb": None} for name in needed}
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        def result_of(name):
+            with self._lock:
+                if name in results:
+                    return results[name]
+            value = self.load(name, keys[name])
+            with self._lock:
+                return results.setdefault(name, value)
+
+        def execute(name):
+            stage = self.stages[name]
+            arguments = [result_of(dependency) for dependency in stage.inputs]
+            for path in stage.outputs:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            if self.trace_memory:
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            value = stage.function(*arguments, **stage.params)
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20 if self.trace_memory else None
+            size = self._store(name, keys[name], value)
+            return name, value, {"status": "ran", "seconds": seconds, "output_mb": size / 2 ** 20, "peak_mb": peak}
+
+        def release(name):
+            # Called with the lock held, after a stage that used this result is done
+            users[name] -= 1
+            if users[name] <= 0:
+                results.pop(name, None)
+
+        waiting = set(run)
+        running = {}
+        try:
+            with ThreadPoolExecutor(self.workers) as pool:
+                while waiting or running:
+                    busy = waiting | set(running.values())
+                    ready = [name for name in self.stages if name in waiting and busy.isdisjoint(self.stages[name].inputs)]
+                    for name in ready:
+                        waiting.discard(name)
+                        running[pool.submit(execute, name)] = name
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        del running[future]
+                        name, value, info = future.result()
+                        report[name].update(info)
+                        with self._lock:
+                            results[name] = value
+                            for dependency in self.stages[name].inputs:
+                                release(dependency)
+                            if users[name] <= 0:
+                                results.pop(name, None)
+        finally:
+            if self.trace_memory:
+                tracemalloc.stop()
+
+        return {name: result_of(name) for name in targets}, [report[name] for name in self.stages if name in needed]
+
+
+def format_report(report):
+    """
+    Turns the report of Pipeline.run into a table.
+    """
+    lines = [f"{'stage':<20} {'status':<7} {'seconds':>8} {'output MB':>10} {'peak MB':>8}"]
+    for row in report:
+        output = "" if row["output_mb"] is None else f"{row['output_mb']:.1f}"
+        peak = "" if row["peak_mb"] is None else f"{row['peak_mb']:.1f}"
+        lines.append(f"{row['stage']:<20} {row['status']:<7} {row['seconds']:>8.2f} {output:>10} {peak:>8}")
+    total = sum(row["seconds"] for row in report)
+    lines.append(f"{len([row for row in report if row['status'] == 'ran'])} of {len(report)} stages ran, {total:.2f}s of stage time")
+    return "\n".join(lines)
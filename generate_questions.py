@@ -1,25 +1,165 @@
+import argparse
+import re
+import string
+import time
+
 import pandas as pd
-import json
-
-# Load the card data
-cards = pd.read_csv("data/cards.csv")
-
-# List to store questions and answers
-questions = []
-answers = []
-
-# Iterate through rows of the cards DataFrame to create questions
-for _, row in cards.iterrows():
-    for column in cards.columns:
-        value = row[column]
-        if pd.notna(value) and len(questions) < 1000:  # Limit to X questions
-            question = f"What is the {column} of {row['name']}?"
-            questions.append(question)
-            answers.append(str(value))
-
-# Save questions and answers to a file for training
-questions_data = {'questions': questions, 'answers': answers}
-with open("questions.json", "w", encoding='utf-8') as file:
-    json.dump(questions_data, file, ensure_ascii=False, indent=4)
-
-print(f"Generated {len(questions)} questions and saved to 'questions.json'.")
+
+from card_bitmasks import BITMASK_COLUMNS
+from card_data import iter_cards
+from question_io import write_questions
+
+# Default phrasing of a generated question
+DEFAULT_TEMPLATE = "What is the {column} of {name}?"
+
+# Other ways users ask the same thing (see the example questions in the README)
+PARAPHRASE_TEMPLATES = [
+    "whats the {column} of {name}",
+    "{column} of {name}",
+    "{name} {column}",
+    "{column} from {name}",
+]
+
+_DEFAULT_QUESTION = re.compile(r"^What is the (?P<column>.+?) of (?P<name>.+)\?$")
+
+
+def split_question(question):
+    """
+    Reads card name and column back out of a question in the default template.
+
+    Returns:
+    tuple: (name, column) or None if the question does not follow DEFAULT_TEMPLATE.
+    """
+    match = _DEFAULT_QUESTION.match(question)
+    if match is None:
+        return None
+    return match["name"], match["column"]
+
+
+def paraphrase(question, templates=PARAPHRASE_TEMPLATES):
+    """
+    Rephrases a question in the default template with other templates.
+
+    Returns:
+    list: The paraphrased questions (empty if the question does not follow DEFAULT_TEMPLATE).
+    """
+    parts = split_question(question)
+    if parts is None:
+        return []
+    name, column = parts
+    return [template.format(name=name, column=column.lower()) for template in templates]
+
+
+def apply_template(template, names, columns):
+    """
+    Fills a phrasing template for whole columns at once.
+
+    Parameters:
+    template (str): A format string using the fields {name} and {column}.
+    names (pd.Series): The card names.
+    columns (pd.Series): The attribute names.
+
+    Returns:
+    pd.Series: One question per row.
+    """
+    fields = {"name": names.astype(str), "column": columns.astype(str)}
+    result = pd.Series("", index=names.index, dtype=object)
+    for literal, field, _, _ in string.Formatter().parse(template):
+        if literal:
+            result = result + literal
+        if field is not None:
+            if field not in fields:
+                raise ValueError(f"Unknown template field '{{{field}}}', use {{name}} and {{column}}")
+            result = result + fields[field]
+    return result
+
+
+def generate_question_frame(cards, columns=None, templates=(DEFAULT_TEMPLATE,)):
+    """
+    Turns a frame of cards into question/answer pairs without a Python loop over the rows.
+
+    The cards are melted into (card, column, value) triples in row order and all missing
+    values are dropped in one go.
+
+    Parameters:
+    cards (pd.DataFrame): Card rows, needs a "name" column.
+    columns (list): Columns to ask about (default: all columns except the bitmasks).
+    templates (list): Phrasing templates, every template produces one question per triple.
+
+    Returns:
+    pd.DataFrame: Columns question, answer, name and column.
+    """
+    columns = [column for column in (columns or cards.columns.difference(BITMASK_COLUMNS, sort=False)) if column in cards.columns]
+    values = cards[columns].to_numpy(dtype=object)
+    present = pd.notna(values)
+    rows, positions = present.nonzero()
+    names = pd.Series(cards["name"].to_numpy(dtype=object)[rows], dtype=object)
+    attributes = pd.Series(pd.Index(columns, dtype=object)[positions], dtype=object)
+    values = pd.Series(values[present], dtype=object).map(str)
+
+    frames = []
+    for template in templates:
+        frames.append(pd.DataFrame({
+            "question": apply_template(template, names, attributes),
+            "answer": values,
+            "name": names,
+            "column": attributes,
+        }))
+    if len(frames) == 1:
+        return frames[0]
+    # Keep all phrasings of one triple next to each other
+    return pd.concat(frames, keys=range(len(frames))).sort_index(level=1, kind="stable").reset_index(drop=True)
+
+
+def iter_question_chunks(cards_path, columns=None, templates=(DEFAULT_TEMPLATE,), chunksize=5000, limit=None):
+    """
+    Streams question/answer chunks from the typed card cache, only `chunksize` cards are in memory at a time.
+
+    Parameters:
+    cards_path (str): Path of cards.csv.
+    columns (list): Columns to ask about (default: all columns except the bitmasks).
+    templates (list): Phrasing templates.
+    chunksize (int): Number of cards read per chunk.
+    limit (int): Stop after this many questions (default: no limit).
+    """
+    remaining = limit
+    # Only the asked columns (and the name) are read from the cache
+    needed = None
+    if columns is not None:
+        available = set(pd.read_csv(cards_path, nrows=0).columns)
+        needed = [column for column in dict.fromkeys(["name", *columns]) if column in available]
+    for cards in iter_cards(needed, chunksize, path=cards_path):
+        frame = generate_question_frame(cards, columns, templates)
+        if remaining is not None:
+            frame = frame.head(remaining)
+            remaining -= len(frame)
+        yield frame
+        if remaining is not None and remaining <= 0:
+            break
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate training questions from the card data.")
+    parser.add_argument("--cards", default="data/cards.csv", help="Path of cards.csv")
+    parser.add_argument("--output", default="questions.json", help="Output file (.json, .jsonl or .parquet)")
+    parser.add_argument("--columns", help="Comma separated list of columns to ask about (default: all)")
+    parser.add_argument("--exclude", help="Comma separated list of columns to skip")
+    parser.add_argument("--template", action="append", help=f"Phrasing template, can be given several times (default: '{DEFAULT_TEMPLATE}')")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of questions (default: no limit)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Number of cards processed per chunk")
+    args = parser.parse_args()
+
+    columns = args.columns.split(",") if args.columns else list(pd.read_csv(args.cards, nrows=0).columns)
+    if args.exclude:
+        excluded = set(args.exclude.split(","))
+        columns = [column for column in columns if column not in excluded]
+    templates = args.template or [DEFAULT_TEMPLATE]
+
+    start = time.perf_counter()
+    chunks = iter_question_chunks(args.cards, columns, templates, args.chunk_size, args.limit)
+    count = write_questions(chunks, args.output)
+    print(f"Generated {count} questions in {time.perf_counter() - start:.1f}s and saved to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
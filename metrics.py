@@ -0,0 +1,232 @@
+import cProfile
+import datetime
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the batch size histogram buckets
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A value that only goes up, one per combination of label values.
+
+    Parameters:
+    name (str): Metric name (Prometheus naming, e.g. "ask_questions_total").
+    help (str): One line describing the metric.
+    labels (tuple): Label names.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Histogram:
+    """
+    Counts observations into cumulative buckets, like a Prometheus histogram.
+
+    Parameters:
+    name (str): Metric name (e.g. "ask_stage_seconds").
+    help (str): One line describing the metric.
+    buckets (tuple): Upper bounds of the buckets, +Inf is added automatically.
+    labels (tuple): Label names.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = state[0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+                    break
+            else:
+                counts[-1] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration of a with block in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield self.name + "_bucket", _format_labels(self.labels, key, [("le", _format_value(float(bound)))]), cumulative
+            yield self.name + "_sum", _format_labels(self.labels, key), total
+            yield self.name + "_count", _format_labels(self.labels, key), count
+
+
+class Gauge:
+    """
+    A value that is read when the metrics are rendered.
+
+    Parameters:
+    name (str): Metric name.
+    help (str): One line describing the metric.
+    function (callable): Returns the current value, or a dict mapping a label value to a value.
+    label (str): Label name used when function returns a dict.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, function, label=None):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.label = label
+
+    def samples(self):
+        value = self.function()
+        if value is None:
+            return
+        if isinstance(value, dict):
+            for key, item in sorted(value.items()):
+                yield self.name, _format_labels((self.label,), (key,)), item
+        else:
+            yield self.name, "", value
+
+
+class Registry:
+    """
+    Collects metrics and renders them in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # Importing a module twice (e.g. the Flask reloader) must not register a metric twice
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+        return self.register(Histogram(name, help, buckets, labels))
+
+    def gauge(self, name, help, function, label=None):
+        with self._lock:
+            # A gauge always reads from the newest function
+            self.metrics[name] = Gauge(name, help, function, label)
+            return self.metrics[name]
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class SlowCallProfiler:
+    """
+    Opt-in profiler for the tail: a sample of calls runs under cProfile, and the profile is
+    written to a file if the call took longer than a threshold.
+
+    Parameters:
+    threshold (float): Calls slower than this many seconds are written out.
+    sample_rate (float): Share of calls that are profiled (profiling slows a call down).
+    directory (str): Where the .prof files go (open them with pstats or snakeviz).
+    keep (int): Number of newest profiles kept in the directory.
+    """
+
+    def __init__(self, threshold, sample_rate=0.01, directory="profiles", keep=50):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.keep = keep
+        self.written = 0
+
+    def call(self, function, *args, **kwargs):
+        if random.random() >= self.sample_rate:
+            return function(*args, **kwargs)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold:
+                self._write(profiler, elapsed)
+
+    def _write(self, profiler, elapsed):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        profiler.dump_stats(os.path.join(self.directory, f"slow-{stamp}-{elapsed * 1000:.0f}ms.prof"))
+        self.written += 1
+        profiles = sorted(name for name in os.listdir(self.directory) if name.startswith("slow-") and name.endswith(".prof"))
+        for name in profiles[:-self.keep]:
+            os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,100 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Collects single requests from many threads over a short time window and
+    hands them to a handler as one batch.
+
+    Parameters:
+    handler (callable): Function that takes a list of items and returns a list of results in the same order
+    (exactly one per item, otherwise every item of the batch gets a RuntimeError).
+    max_batch_size (int): The maximum number of items passed to the handler at once.
+    max_wait (float): How long (in seconds) to wait for more items after the first one arrived.
+    max_queue_size (int): The maximum number of waiting items, submit raises queue.Full beyond that (0 = unbounded).
+    workers (int): The number of threads calling the handler, so several batches can be processed at once.
+    """
+
+    def __init__(self, handler, max_batch_size=32, max_wait=0.005, max_queue_size=0, workers=1):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue_size = max_queue_size
+        self.workers = max(1, workers)
+        self._queue = queue.Queue(max_queue_size)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+
+    def _ensure_started(self):
+        # The worker threads are started lazily, so a forked server worker gets its own threads
+        if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self.max_queue_size)
+                self._threads = []
+                self._pid = os.getpid()
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"micro-batcher-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def queue_size(self):
+        """
+        Returns the number of items waiting for a worker.
+        """
+        return self._queue.qsize()
+
+    def submit(self, item, timeout=None):
+        """
+        Queues one item and blocks until its result is available.
+
+        Parameters:
+        item: The item to process.
+        timeout (float): Maximum number of seconds to wait for the result.
+
+        Returns:
+        The handler's result for this item.
+
+        Raises:
+        queue.Full: If max_queue_size items are already waiting (the caller should shed the load).
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put_nowait((item, future))
+        return future.result(timeout=timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = list(self.handler(items))
+                if len(results) != len(items):
+                    # Without this check the items without a result would wait forever
+                    raise RuntimeError(f"Handler returned {len(results)} results for {len(items)} items")
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
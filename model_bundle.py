@@ -0,0 +1,524 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from answer_cache import normalize_question
+from sharded_index import ShardedIndex, build_shards, shard_order
+from vector_index import build_index, load_index, normalize_rows
+
+FORMAT_VERSION = 1
+DEFAULT_BUNDLE_PATH = "question_model"
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+HASHES_FILE = "entry_hashes.npy"
+TOMBSTONES_FILE = "tombstones.npy"
+ANSWER_CODES_FILE = "answer_codes.npy"
+CANONICAL_KEYS_FILE = "canonical_keys.npy"
+CANONICAL_ROWS_FILE = "canonical_rows.npy"
+
+
+class StringTable:
+    """
+    Read-only list of strings stored as one UTF-8 blob plus an offsets array.
+
+    Both files are memory-mapped, so opening a table costs no time regardless of its size.
+
+    Parameters:
+    prefix (str): Path prefix of the table files (<prefix>.dat and <prefix>.idx.npy).
+    """
+
+    def __init__(self, prefix):
+        self.offsets = np.load(prefix + ".idx.npy", mmap_mode="r")
+        size = int(self.offsets[-1]) if len(self.offsets) else 0
+        self.blob = np.memmap(prefix + ".dat", dtype=np.uint8, mode="r") if size else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("string table index out of range")
+        return self.blob[int(self.offsets[index]):int(self.offsets[index + 1])].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def write_string_table(prefix, strings):
+    """
+    Writes strings as <prefix>.dat (concatenated UTF-8) and <prefix>.idx.npy (int64 offsets).
+
+    Returns:
+    str: SHA-256 hex digest of the written data.
+    """
+    digest = hashlib.sha256()
+    offsets = [0]
+    with open(prefix + ".dat", "wb") as blob:
+        for string in strings:
+            encoded = str(string).encode("utf-8")
+            blob.write(encoded)
+            digest.update(encoded)
+            digest.update(b"\0")
+            offsets.append(offsets[-1] + len(encoded))
+    np.save(prefix + ".idx.npy", np.asarray(offsets, dtype=np.int64))
+    return digest.hexdigest()
+
+
+def intern_strings(strings):
+    """
+    Replaces repeated strings by integer ids.
+
+    Returns:
+    tuple: (distinct strings in order of first appearance, int32 array with the id of every string)
+    """
+    ids = {}
+    codes = np.fromiter((ids.setdefault(string, len(ids)) for string in strings), dtype=np.int32)
+    return list(ids), codes
+
+
+class AnswerStore:
+    """
+    Read-only list of answers stored as the distinct answers plus one int32 answer id per question.
+
+    Values like "common" or "W" repeat thousands of times, so only the (few) distinct answers
+    are kept as Python strings; the id array is memory-mapped.
+
+    Parameters:
+    values (list): The distinct answers.
+    codes (np.ndarray): Answer id (position in values) of every question.
+    """
+
+    def __init__(self, values, codes):
+        self.values = values
+        self.codes = codes
+
+    @classmethod
+    def from_strings(cls, strings):
+        values, codes = intern_strings(str(string) for string in strings)
+        return cls(values, codes)
+
+    @classmethod
+    def load(cls, path):
+        return cls(list(StringTable(os.path.join(path, "answer_values"))), np.load(os.path.join(path, ANSWER_CODES_FILE), mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.values[code] for code in self.codes[index]]
+        return self.values[self.codes[index]]
+
+    def __iter__(self):
+        for start in range(0, len(self.codes), 65536):
+            for code in self.codes[start:start + 65536]:
+                yield self.values[code]
+
+    def answer_id(self, index):
+        """
+        Id of the answer of a question; two questions with the same answer have the same id.
+        """
+        return int(self.codes[index])
+
+
+def write_question_columns(batches, prefix):
+    """
+    Collects a question file read in (questions, answers) batches without keeping the strings:
+    the questions are written to a string table at prefix, the answers are interned batch by batch.
+
+    Returns:
+    tuple: (StringTable of the questions, AnswerStore of the answers), both in file order.
+    """
+    ids, codes = {}, []
+
+    def questions():
+        for batch_questions, batch_answers in batches:
+            codes.append(np.fromiter(
+                (ids.setdefault(str(answer), len(ids)) for answer in batch_answers), dtype=np.int32, count=len(batch_answers),
+            ))
+            yield from batch_questions
+
+    write_string_table(prefix, questions())
+    return StringTable(prefix), AnswerStore(list(ids), np.concatenate(codes) if codes else np.zeros(0, dtype=np.int32))
+
+
+def remove_string_table(prefix):
+    for path in (prefix + ".dat", prefix + ".idx.npy"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def write_answer_store(path, answers):
+    """
+    Writes answers as a deduplicated string table (answer_values.*) and an int32 id per
+    question (answer_codes.npy).
+
+    Returns:
+    str: SHA-256 hex digest of the written data.
+    """
+    values, codes = intern_strings(answers)
+    digest = hashlib.sha256(write_string_table(os.path.join(path, "answer_values"), values).encode())
+    np.save(os.path.join(path, ANSWER_CODES_FILE), codes)
+    digest.update(codes.tobytes())
+    return digest.hexdigest()
+
+
+def load_answers(path):
+    # Bundles written before the answer store keep one string per question
+    if os.path.exists(os.path.join(path, ANSWER_CODES_FILE)):
+        return AnswerStore.load(path)
+    return StringTable(os.path.join(path, "answers"))
+
+
+def question_key(question):
+    """
+    64-bit key of a question after normalize_question (equivalent phrasings share one key).
+    """
+    digest = hashlib.blake2b(normalize_question(question).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def write_canonical_table(path, questions, deleted):
+    """
+    Writes the keys of all live questions, sorted, and the row each key belongs to
+    (the first live row if a question occurs several times).
+    """
+    live = np.flatnonzero(~deleted)
+    keys = np.fromiter((question_key(questions[row]) for row in live), dtype=np.uint64, count=len(live))
+    order = np.argsort(keys, kind="stable")
+    keys, rows = keys[order], live[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    np.save(os.path.join(path, CANONICAL_KEYS_FILE), keys[first])
+    np.save(os.path.join(path, CANONICAL_ROWS_FILE), rows[first].astype(np.int64))
+
+
+class CanonicalTable:
+    """
+    Finds the bundle row of a question that was trained on, so its stored embedding (and answer)
+    can be used without running the sentence model.
+
+    Parameters:
+    path (str): Directory of the bundle.
+    questions (StringTable): The bundle's questions, used to rule out key collisions.
+    """
+
+    def __init__(self, path, questions):
+        self.keys = np.load(os.path.join(path, CANONICAL_KEYS_FILE), mmap_mode="r")
+        self.rows = np.load(os.path.join(path, CANONICAL_ROWS_FILE), mmap_mode="r")
+        self.questions = questions
+
+    def __len__(self):
+        return len(self.keys)
+
+    def row(self, question):
+        """
+        Returns the row of the question, or None if it is not in the bundle.
+        """
+        key = question_key(question)
+        position = int(np.searchsorted(self.keys, np.uint64(key)))
+        if position == len(self.keys) or int(self.keys[position]) != key:
+            return None
+        row = int(self.rows[position])
+        if normalize_question(self.questions[row]) != normalize_question(question):
+            return None
+        return row
+
+
+def entry_hash(question, answer):
+    """
+    Content hash of one question/answer pair (32 hex characters).
+    """
+    return hashlib.blake2b(f"{question}\0{answer}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _hash_array(array, digest, chunk_rows=65536):
+    for start in range(0, array.shape[0], chunk_rows):
+        digest.update(np.ascontiguousarray(array[start:start + chunk_rows]).tobytes())
+
+
+def save_bundle(path, model_name, embeddings, questions, answers, index_kind="exact", index_options=None, deleted=None,
+                shards=1):
+    """
+    Writes a model bundle directory. The bundle is built in a temporary directory next to
+    the target and moved into place at the end, so readers never see a half-written bundle.
+
+    Parameters:
+    path (str): Target directory of the bundle.
+    model_name (str): Name or path of the sentence model used to create the embeddings.
+    embeddings (np.ndarray): Question embeddings, one row per question.
+    questions (list): The training questions (or a StringTable, which is then read row by row).
+    answers (list): The answer belonging to each question (or an AnswerStore).
+    index_kind (str): Nearest-neighbour backend stored with the bundle (see vector_index.INDEX_TYPES).
+    index_options (dict): Extra options for the index.
+    deleted (np.ndarray): Optional boolean mask of tombstoned rows that the index must skip.
+    shards (int): Number of index shards (see sharded_index); above 1 the rows are stored
+    grouped by shard, so every shard is one contiguous slice of embeddings.npy.
+
+    Returns:
+    dict: The written manifest.
+    """
+    questions = questions if isinstance(questions, StringTable) else list(questions)
+    answers = answers if isinstance(answers, AnswerStore) else AnswerStore.from_strings(answers)
+    if not (len(embeddings) == len(questions) == len(answers)):
+        raise ValueError("embeddings, questions and answers must have the same length")
+    deleted = np.zeros(len(questions), dtype=bool) if deleted is None else np.asarray(deleted, dtype=bool)
+    order = offsets = None
+    if shards > 1:
+        order, offsets = shard_order(questions, shards)
+        answers = AnswerStore(answers.values, np.asarray(answers.codes)[order])
+        deleted = deleted[order]
+
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=os.path.basename(path) + ".tmp-", dir=parent)
+    try:
+        # The questions are written first (in shard order) and then read memory-mapped from there
+        questions_hash = write_string_table(
+            os.path.join(staging, "questions"), questions if order is None else (questions[row] for row in order),
+        )
+        questions = StringTable(os.path.join(staging, "questions"))
+
+        # Normalize chunk by chunk into the file, so memory-mapped input is never loaded completely
+        embeddings = embeddings if isinstance(embeddings, np.ndarray) else np.asarray(embeddings, dtype=np.float32)
+        vectors = np.lib.format.open_memmap(
+            os.path.join(staging, EMBEDDINGS_FILE), mode="w+", dtype=np.float32, shape=embeddings.shape
+        )
+        for start in range(0, len(embeddings), 65536):
+            rows = slice(start, start + 65536) if order is None else order[start:start + 65536]
+            vectors[start:start + 65536] = normalize_rows(embeddings[rows])
+        vectors.flush()
+        if offsets is None:
+            index = build_index(index_kind, vectors, normalized=True, deleted=deleted, **(index_options or {}))
+            index.save(staging)
+            index_info = {"kind": index_kind, "options": index.options()}
+        else:
+            index = None
+            index_info = {
+                "kind": index_kind,
+                "options": index_options or {},
+                "shards": build_shards(staging, vectors, offsets, index_kind, index_options, deleted),
+            }
+
+        hashes = np.array([entry_hash(q, a) for q, a in zip(questions, answers)], dtype="S32")
+        np.save(os.path.join(staging, HASHES_FILE), hashes)
+        np.save(os.path.join(staging, TOMBSTONES_FILE), deleted)
+        write_canonical_table(staging, questions, deleted)
+
+        digest = hashlib.sha256(model_name.encode("utf-8"))
+        _hash_array(vectors, digest)
+        digest.update(deleted.tobytes())
+        digest.update(questions_hash.encode())
+        digest.update(write_answer_store(staging, answers).encode())
+        if offsets is not None:
+            digest.update(json.dumps(index_info["shards"]).encode())
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "model_name": model_name,
+            "dimension": int(vectors.shape[1]),
+            "count": int(vectors.shape[0]),
+            "deleted": int(deleted.sum()),
+            "index": index_info,
+            "build_hash": digest.hexdigest()[:16],
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        }
+        with open(os.path.join(staging, MANIFEST_FILE), "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=4)
+        # Release the memory maps before the directory is moved (Windows refuses to move open files)
+        del index, vectors, questions
+
+        # Swap the new bundle in, then remove the old one
+        previous = None
+        if os.path.exists(path):
+            previous = tempfile.mkdtemp(prefix=os.path.basename(path) + ".old-", dir=parent)
+            os.rmdir(previous)
+            os.replace(path, previous)
+        os.replace(staging, path)
+        if previous:
+            shutil.rmtree(previous, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+
+def update_bundle(path, questions, answers, encode, batch_size=256, compact_threshold=0.2,
+                  index_kind=None, index_options=None, shards=None):
+    """
+    Brings an existing bundle up to date with a new question list without re-encoding everything.
+
+    Every question/answer pair is content-hashed. Unchanged pairs keep their row, the
+    embeddings of known question texts are reused, only new texts are encoded (in batches)
+    and appended, and pairs that disappeared are tombstoned. Once the share of tombstones
+    exceeds compact_threshold the dead rows are dropped.
+
+    Parameters:
+    path (str): Directory of the existing bundle.
+    questions (list): The complete new question list.
+    answers (list): The answer belonging to each question.
+    encode (callable): Turns a list of questions into an embedding array (only called for new texts).
+    batch_size (int): Number of new questions encoded per encode() call.
+    compact_threshold (float): Share of tombstoned rows (0-1) above which the bundle is compacted.
+    index_kind (str): Index type to build (default: the one of the existing bundle).
+    index_options (dict): Index options (default: the ones of the existing bundle).
+    shards (int): Number of index shards (default: as many as the existing bundle has).
+
+    Returns:
+    tuple: (manifest, stats) where stats counts kept, added, encoded and deleted rows.
+    """
+    bundle = ModelBundle(path, shard_processes=False)
+    old_questions = list(bundle.questions)
+    old_answers = list(bundle.answers)
+    old_deleted = bundle.deleted.copy()
+
+    # Live rows per content hash (a pair can occur several times, e.g. reprints)
+    live_rows = {}
+    for row, value in enumerate(bundle.hashes):
+        if not old_deleted[row]:
+            live_rows.setdefault(value.decode(), []).append(row)
+
+    new_rows = []
+    for question, answer in zip(questions, answers):
+        rows = live_rows.get(entry_hash(question, str(answer)))
+        if rows:
+            rows.pop()
+        else:
+            new_rows.append((question, str(answer)))
+    deleted = old_deleted.copy()
+    for rows in live_rows.values():
+        deleted[rows] = True
+
+    # Reuse embeddings of question texts that are already stored, encode the rest
+    known = {question: row for row, question in enumerate(old_questions)}
+    to_encode = list(dict.fromkeys(question for question, _ in new_rows if question not in known))
+    encoded = {}
+    for start in range(0, len(to_encode), batch_size):
+        batch = to_encode[start:start + batch_size]
+        encoded.update(zip(batch, normalize_rows(encode(batch))))
+    added = np.array(
+        [encoded[question] if question in encoded else bundle.embeddings[known[question]] for question, _ in new_rows],
+        dtype=np.float32,
+    ).reshape(len(new_rows), bundle.embeddings.shape[1])
+
+    embeddings = np.concatenate([np.asarray(bundle.embeddings), added])
+    all_questions = old_questions + [question for question, _ in new_rows]
+    all_answers = old_answers + [answer for _, answer in new_rows]
+    deleted = np.concatenate([deleted, np.zeros(len(new_rows), dtype=bool)])
+
+    compacted = len(deleted) > 0 and deleted.mean() > compact_threshold
+    if compacted:
+        keep = np.flatnonzero(~deleted)
+        embeddings = embeddings[keep]
+        all_questions = [all_questions[row] for row in keep]
+        all_answers = [all_answers[row] for row in keep]
+        deleted = np.zeros(len(keep), dtype=bool)
+
+    index_info = bundle.manifest["index"]
+    manifest = save_bundle(
+        path, bundle.model_name, embeddings, all_questions, all_answers,
+        index_kind or index_info["kind"],
+        index_options if index_options is not None else index_info["options"],
+        deleted,
+        shards if shards is not None else max(1, len(index_info.get("shards", []))),
+    )
+    stats = {
+        "kept": len(questions) - len(new_rows),
+        "added": len(new_rows),
+        "encoded": len(to_encode),
+        "deleted": int(deleted.sum()),
+        "compacted": bool(compacted),
+    }
+    return manifest, stats
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format {manifest.get('format_version')} in {path}")
+    return manifest
+
+
+def load_encoder(model_name):
+    """
+    Loads the sentence model referenced by a bundle (imported lazily, torch is heavy).
+    """
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name)
+
+
+class ModelBundle:
+    """
+    A loaded model bundle: memory-mapped embeddings and strings plus the nearest-neighbour index.
+
+    The sentence model is only loaded on first access of .encoder.
+
+    Parameters:
+    path (str): Directory of the bundle.
+    shard_processes (bool): Search a sharded index in one worker process per shard.
+    """
+
+    def __init__(self, path, shard_processes=True):
+        self.path = path
+        self.manifest = read_manifest(path)
+        self.model_name = self.manifest["model_name"]
+        self.version = self.manifest["build_hash"]
+        # mmap_mode="r" lets several worker processes share the same embedding pages
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        self.questions = StringTable(os.path.join(path, "questions"))
+        self.answers = load_answers(path)
+        # Bundles written before incremental training have no hashes and no tombstones
+        tombstones_path = os.path.join(path, TOMBSTONES_FILE)
+        if os.path.exists(tombstones_path):
+            self.deleted = np.load(tombstones_path)
+        else:
+            self.deleted = np.zeros(len(self.embeddings), dtype=bool)
+        # Bundles written before the canonical table have none
+        if os.path.exists(os.path.join(path, CANONICAL_KEYS_FILE)):
+            self.canonical = CanonicalTable(path, self.questions)
+        else:
+            self.canonical = None
+        index_info = self.manifest["index"]
+        if index_info.get("shards"):
+            self.index = ShardedIndex(
+                path, index_info["kind"], index_info["shards"], self.embeddings, self.deleted, shard_processes,
+                build_hash=self.version,
+            )
+        else:
+            self.index = load_index(index_info["kind"], path, self.embeddings, index_info["options"], self.deleted)
+        self._hashes = None
+        self._encoder = None
+
+    @property
+    def hashes(self):
+        if self._hashes is None:
+            hashes_path = os.path.join(self.path, HASHES_FILE)
+            if os.path.exists(hashes_path):
+                self._hashes = np.load(hashes_path, mmap_mode="r")
+            else:
+                self._hashes = np.array([entry_hash(q, a) for q, a in zip(self.questions, self.answers)], dtype="S32")
+        return self._hashes
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            self._encoder = load_encoder(self.model_name)
+        return self._encoder
+
+
+def load_bundle(path=DEFAULT_BUNDLE_PATH, shard_processes=True):
+    return ModelBundle(path, shard_processes)
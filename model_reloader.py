@@ -0,0 +1,213 @@
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+
+from answer_ranking import THRESHOLD
+from model_bundle import MANIFEST_FILE, load_bundle, read_manifest
+
+# Probes of stored questions must stay below the distance above which the app answers "I don't know this yet."
+PROBE_MAX_DISTANCE = THRESHOLD
+
+
+class ActiveModel:
+    """
+    One loaded model version. A request takes the current ActiveModel once and uses it until
+    it is done, so a swap in between never mixes two versions.
+
+    Parameters:
+    encoder: The sentence model (anything with .encode(list of str)).
+    index: The nearest-neighbour index (anything with .kneighbors).
+    answers (list): The answer of every indexed question.
+    questions (list): The indexed questions (for re-ranking), None if they are not known.
+    version (str): Identifies the model version (the bundle's build hash).
+    model_name (str): Name of the sentence model.
+    path (str): Where the model was loaded from.
+    bundle (ModelBundle): The loaded bundle, None for the old pickle file.
+    """
+
+    def __init__(self, encoder, index, answers, questions, version, model_name, path, bundle=None):
+        self.encoder = encoder
+        self.index = index
+        self.answers = answers
+        self.questions = questions
+        self.version = version
+        self.model_name = model_name
+        self.path = path
+        self.bundle = bundle
+        self.loaded_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+
+    def info(self):
+        return {
+            "version": self.version,
+            "model_name": self.model_name,
+            "path": self.path,
+            "questions": len(self.answers),
+            "index": self.bundle.manifest["index"]["kind"] if self.bundle else None,
+            "shards": len(self.bundle.manifest["index"].get("shards", [])) if self.bundle else 0,
+            "created": self.bundle.manifest.get("created") if self.bundle else None,
+            "loaded_at": self.loaded_at,
+        }
+
+
+def probe_rows(bundle, count):
+    """
+    Picks `count` live rows spread evenly over the bundle.
+    """
+    live = np.flatnonzero(~bundle.deleted)
+    if count <= 0 or not len(live):
+        return []
+    return live[np.linspace(0, len(live) - 1, min(count, len(live))).astype(int)]
+
+
+def warm_up(model, batch_sizes=(1, 8, 32)):
+    """
+    Runs batches of stored questions through the encoder and the index, so lazy initialisation
+    (torch thread pools, tokenizer, first allocations for each batch size) happens before the
+    first real request instead of during it.
+
+    Returns:
+    float: Seconds the warm-up took.
+    """
+    start = time.perf_counter()
+    if model is None or not batch_sizes or model.questions is None or not len(model.questions):
+        return 0.0
+    count = len(model.questions)
+    for size in batch_sizes:
+        rows = np.linspace(0, count - 1, min(size, count)).astype(int)
+        embeddings = model.encoder.encode([model.questions[row] for row in rows])
+        model.index.kneighbors(embeddings, n_neighbors=1)
+    return time.perf_counter() - start
+
+
+def load_active_model(path, previous=None, probes=3, encoder_loader=None, shard_processes=True):
+    """
+    Loads a model bundle and warms it up with a few of its own questions as probe queries.
+
+    The sentence model of the previous version is reused if the bundle was built with the same
+    one, so a reload after retraining only has to map the new embeddings and index.
+    encoder_loader (a function taking the model name) replaces the default SentenceTransformer,
+    e.g. onnx_encoder.onnx_loader(). shard_processes=False searches a sharded index in this process.
+
+    Raises:
+    ValueError: If a probe question is not found again (encoder and index do not fit together).
+
+    Returns:
+    ActiveModel: The warmed-up model.
+    """
+    bundle = load_bundle(path, shard_processes)
+    if previous is not None and previous.model_name == bundle.model_name:
+        bundle._encoder = previous.encoder
+    elif encoder_loader is not None:
+        bundle._encoder = encoder_loader(bundle.model_name)
+    encoder = bundle.encoder
+
+    rows = probe_rows(bundle, probes)
+    if len(rows):
+        # Touches the encoder, the index and the answer table once, before the first real request does
+        embeddings = encoder.encode([bundle.questions[row] for row in rows])
+        distances, _ = bundle.index.kneighbors(embeddings, n_neighbors=1)
+        if distances[:, 0].max() > PROBE_MAX_DISTANCE:
+            raise ValueError(
+                f"Probe questions of bundle {bundle.version} are not recognised "
+                f"(distance {distances[:, 0].max():.3f}), keeping the current model"
+            )
+    return ActiveModel(encoder, bundle.index, bundle.answers, bundle.questions, bundle.version, bundle.model_name, path, bundle)
+
+
+class ModelHolder:
+    """
+    Holds the active model and replaces it when a new bundle appears.
+
+    Loading and warming up a new bundle happens on the watcher thread; the swap itself is a
+    single attribute assignment, so requests see either the old or the new model. Requests that
+    started on the old model can still finish after the swap; anything they cache must carry
+    the version of the model it came from (the app passes it to AnswerCache.get/put).
+
+    Parameters:
+    path (str): Directory of the model bundle to watch.
+    current (ActiveModel): The model to start with (None if there is none yet).
+    interval (float): Seconds between two checks of the bundle's manifest.
+    probes (int): Number of probe queries run before a new model is swapped in.
+    warm_up_sizes (tuple): Batch sizes a new model is warmed up with before it is swapped in.
+    encoder_loader (callable): Loads the sentence model by name (None: SentenceTransformer).
+    shard_processes (bool): Search a sharded index in one worker process per shard.
+    """
+
+    def __init__(self, path, current=None, interval=10.0, probes=3, warm_up_sizes=(), encoder_loader=None,
+                 shard_processes=True):
+        self.path = path
+        self.current = current
+        self.interval = interval
+        self.probes = probes
+        self.warm_up_sizes = warm_up_sizes
+        self.encoder_loader = encoder_loader
+        self.shard_processes = shard_processes
+        self.reloads = 0
+        self.last_error = None
+        self.last_check = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def reload(self, force=False):
+        """
+        Loads the bundle if its build hash differs from the active model (or always with force).
+
+        Returns:
+        bool: True if a new model was swapped in.
+        """
+        # Only one reload at a time, a second caller just waits for the first one
+        with self._lock:
+            self.last_check = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+            if not os.path.exists(os.path.join(self.path, MANIFEST_FILE)):
+                # Also the case for a moment while train_model.py moves the new bundle into place
+                return False
+            try:
+                version = read_manifest(self.path)["build_hash"]
+                if not force and self.current is not None and self.current.version == version:
+                    return False
+                model = load_active_model(self.path, self.current, self.probes, self.encoder_loader, self.shard_processes)
+                warm_up(model, self.warm_up_sizes)
+            except Exception as error:
+                self.last_error = f"{type(error).__name__}: {error}"
+                print(f"Model reload failed: {self.last_error}")
+                return False
+            self.current = model
+            self.reloads += 1
+            self.last_error = None
+            print(f"Model {model.version} from '{self.path}' is now active.")
+            return True
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            self.reload()
+
+    def start_watcher(self):
+        """
+        Starts the background thread checking for new bundles (once per process, also after a fork).
+        """
+        if self.interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+        self._thread.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+
+    def status(self):
+        return {
+            "active": self.current.info() if self.current else None,
+            "watching": self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+            "interval": self.interval,
+            "reloads": self.reloads,
+            "last_check": self.last_check,
+            "last_error": self.last_error,
+        }
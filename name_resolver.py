@@ -0,0 +1,210 @@
+import argparse
+import time
+from collections import defaultdict
+
+from answer_cache import normalize_question
+from card_data import load_cards
+
+# Name words that may be left out when typing a card name ("angel mercy" -> "Angel of Mercy")
+SKIPPABLE = frozenset({"a", "an", "and", "at", "from", "in", "of", "on", "the", "to", "with"})
+
+
+def allowed_edits(length):
+    """
+    Number of typos accepted in a word: none for very short words (they would match almost
+    anything), one up to seven characters, two above.
+    """
+    if length < 4:
+        return 0
+    return 1 if length < 8 else 2
+
+
+def deletes(word, distance):
+    """
+    All strings that are left after removing up to `distance` characters from word (word included).
+    """
+    results = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        results |= frontier
+    return results
+
+
+def edit_distance(first, second, limit):
+    """
+    Optimal string alignment distance (insertions, deletions, substitutions and swaps of two
+    neighbouring characters), or limit + 1 as soon as it is certain to exceed limit.
+    """
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous_previous = None
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i] + [0] * len(second)
+        for j, second_char in enumerate(second, 1):
+            cost = first_char != second_char
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (
+                previous_previous is not None and i > 1 and j > 1
+                and first_char == second[j - 2] and first[i - 2] == second_char
+            ):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class NameResolver:
+    """
+    Corrects misspelled card names in a question to the canonical name.
+
+    Typos are found per word with a SymSpell-style deletion dictionary (every card-name word is
+    stored under all strings left after deleting up to two characters, so a typo is found with a
+    handful of dictionary lookups instead of comparing against every word). The names are stored
+    in a word trie, which is walked along consecutive question words using every word's
+    candidates, so only names that fit the question so far are ever looked at.
+
+    Parameters:
+    names (iterable): The canonical card names.
+    """
+
+    def __init__(self, names):
+        self.names = []
+        # Trie over name words: children[node] maps a word to the next node, ends[node] is
+        # (index of the name, leading words left out) for a node where a name ends
+        self.children = [{}]
+        self.ends = [None]
+        vocabulary = set()
+        for name in dict.fromkeys(str(name) for name in names):
+            tokens = tuple(normalize_question(name).split())
+            if not tokens:
+                continue
+            index = len(self.names)
+            self.names.append(name)
+            vocabulary.update(tokens)
+            self._insert(tokens, (index, 0))
+            # Also findable when leading "The"/"A" is left out
+            skipped = 0
+            while skipped < len(tokens) - 1 and tokens[skipped] in SKIPPABLE:
+                skipped += 1
+            if skipped:
+                self._insert(tokens[skipped:], (index, skipped))
+        self.vocabulary = vocabulary
+        self.delete_index = defaultdict(list)
+        for word in vocabulary:
+            for variant in deletes(word, allowed_edits(len(word))):
+                self.delete_index[variant].append(word)
+
+    def _insert(self, tokens, end):
+        node = 0
+        for token in tokens:
+            child = self.children[node].get(token)
+            if child is None:
+                child = self.children[node][token] = len(self.children)
+                self.children.append({})
+                self.ends.append(None)
+            node = child
+        # The first name and the one without left out words win
+        if self.ends[node] is None or end[1] < self.ends[node][1]:
+            self.ends[node] = end
+
+    def __len__(self):
+        return len(self.names)
+
+    def word_candidates(self, word):
+        """
+        Returns {name word: edit distance} for the words a question word may stand for.
+        """
+        candidates = {word: 0} if word in self.vocabulary else {}
+        limit = allowed_edits(len(word))
+        if not limit:
+            return candidates
+        for variant in deletes(word, limit):
+            for known in self.delete_index.get(variant, ()):
+                if known not in candidates and allowed_edits(len(known)):
+                    distance = edit_distance(word, known, limit)
+                    if distance <= limit:
+                        candidates[known] = distance
+        return candidates
+
+    def _walk(self, candidates, start, position, node, typos, left_out, matches):
+        # Follows the trie from node; a skippable name word may be missing from the question
+        if self.ends[node] is not None:
+            index, skipped = self.ends[node]
+            matches.append((index, start, position, typos, left_out + skipped))
+        children = self.children[node]
+        if not children:
+            return
+        if position < len(candidates):
+            for word, distance in candidates[position].items():
+                child = children.get(word)
+                if child is not None:
+                    self._walk(candidates, start, position + 1, child, typos + distance, left_out, matches)
+        if node:
+            for word in SKIPPABLE:
+                child = children.get(word)
+                if child is not None:
+                    self._walk(candidates, start, position, child, typos, left_out + 1, matches)
+
+    def find(self, question):
+        """
+        Finds the card name in a question, also when it is misspelled or missing small words.
+
+        Returns:
+        tuple: (canonical name, first word, end word, edits) on the normalized question words,
+        or None if no card name was found.
+        """
+        tokens = normalize_question(question).split()
+        candidates = [self.word_candidates(token) for token in tokens]
+        matches = []
+        for start in range(len(tokens)):
+            self._walk(candidates, start, start, 0, 0, 0, matches)
+        best, best_key = None, None
+        for index, start, end, typos, left_out in matches:
+            used = end - start
+            # More words have to be typed than left out
+            if left_out and (used < 2 or left_out >= used):
+                continue
+            edits = typos + left_out
+            # The longest name wins, then the one with fewer edits, then the first one
+            key = (-used, edits, start)
+            if best_key is None or key < best_key:
+                best, best_key = (self.names[index], start, end, edits), key
+        return best
+
+    def correct(self, question):
+        """
+        Returns the question with a misspelled card name replaced by the canonical one (the
+        question itself if the name is spelled correctly or no name was found).
+        """
+        match = self.find(question)
+        if match is None or match[3] == 0:
+            return question
+        name, start, end, _ = match
+        tokens = normalize_question(question).split()
+        return " ".join(tokens[:start] + [name] + tokens[end:])
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(load_cards(columns=["name"], path=path)["name"].astype(str).unique())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Correct misspelled card names in questions.")
+    parser.add_argument("questions", nargs="+", help="Questions to correct")
+    parser.add_argument("--cards", default="data/cards.csv", help="Path of cards.csv")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    resolver = NameResolver.from_csv(args.cards)
+    print(f"Indexed {len(resolver)} card names in {time.perf_counter() - start:.2f}s.")
+    for question in args.questions:
+        start = time.perf_counter()
+        corrected = resolver.correct(question)
+        print(f"{question!r} -> {corrected!r} ({(time.perf_counter() - start) * 1000:.2f}ms)")
+
+
+if __name__ == "__main__":
+    main()
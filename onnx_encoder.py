@@ -0,0 +1,223 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from vector_index import normalize_rows
+
+DEFAULT_ONNX_DIR = "onnx_models"
+CONFIG_FILE = "encoder.json"
+MODEL_FILE = "model.onnx"
+QUANTIZED_FILE = "model.int8.onnx"
+# Largest cosine distance between a PyTorch and an ONNX embedding of the same sentence that is
+# accepted; far below the 0.5 answer threshold, so the threshold keeps its meaning
+PARITY_TOLERANCE = 0.02
+
+
+def export_path(directory, model_name):
+    """
+    Directory of the ONNX export of a sentence model ("sentence-transformers/x" -> "sentence-transformers__x").
+    """
+    return os.path.join(directory, model_name.strip("/\\").replace("/", "__").replace("\\", "__"))
+
+
+def export_onnx(model_name, path, quantize=False, opset=14):
+    """
+    Exports the transformer of a sentence model to ONNX, together with its tokenizer and the
+    settings needed to reproduce SentenceTransformer.encode (mean pooling, normalisation).
+
+    Parameters:
+    model_name (str): Name or path of the sentence model.
+    path (str): Directory the export is written to.
+    quantize (bool): Also write a dynamically int8-quantized copy of the model.
+    opset (int): ONNX opset version.
+
+    Returns:
+    SentenceTransformer: The PyTorch model (for the parity check).
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    module_types = [type(module).__name__ for module in model]
+    pooling = next((module for module in model if type(module).__name__ == "Pooling"), None)
+    if pooling is None or pooling.get_pooling_mode_str() != "mean":
+        raise ValueError(f"Only sentence models with mean pooling can be exported, {model_name} uses {module_types}")
+
+    os.makedirs(path, exist_ok=True)
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    sample = tokenizer(["What is the rarity of Angel of Mercy?"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class LastHiddenState(torch.nn.Module):
+        def forward(self, *inputs):
+            return transformer(**dict(zip(input_names, inputs)), return_dict=True).last_hidden_state
+
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(), tuple(sample[name] for name in input_names), os.path.join(path, MODEL_FILE),
+            input_names=input_names, output_names=["last_hidden_state"], dynamic_axes=dynamic_axes, opset_version=opset,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(os.path.join(path, MODEL_FILE), os.path.join(path, QUANTIZED_FILE), weight_type=QuantType.QInt8)
+
+    # tokenizer.json is all the tokenizers package needs, no transformers at serving time
+    tokenizer.save_pretrained(path)
+    config = {
+        "model_name": model_name,
+        "max_seq_length": int(model.max_seq_length),
+        "pad_token": tokenizer.pad_token,
+        "pad_id": int(tokenizer.pad_token_id),
+        "inputs": input_names,
+        "normalize": "Normalize" in module_types,
+        "dimension": int(model.get_sentence_embedding_dimension()),
+        "parity": {},
+    }
+    with open(os.path.join(path, CONFIG_FILE), "w", encoding="utf-8") as file:
+        json.dump(config, file, indent=4)
+    return model
+
+
+class OnnxEncoder:
+    """
+    Sentence encoder running an exported model with ONNX Runtime: tokenizer, transformer and
+    mean pooling, without importing torch. Has the encode method of SentenceTransformer, so
+    it can be used wherever the app uses the sentence model.
+
+    The ONNX Runtime session is created on the first encode in each process: its thread pool
+    would not survive serve.py forking the workers after the app was loaded.
+
+    Parameters:
+    path (str): Directory written by export_onnx.
+    quantized (bool): Use the int8 model (None: use it if it exists and passed the parity check).
+    threads (int): Threads ONNX Runtime uses per call (None: its default, all cores).
+    """
+
+    def __init__(self, path, quantized=None, threads=None):
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(path, CONFIG_FILE), "r", encoding="utf-8") as file:
+            self.config = json.load(file)
+        if quantized is None:
+            quantized = os.path.exists(os.path.join(path, QUANTIZED_FILE)) and self.config["parity"].get(QUANTIZED_FILE, {}).get("passed", False)
+        checked = self.config["parity"].get(QUANTIZED_FILE if quantized else MODEL_FILE)
+        if checked is not None and not checked["passed"]:
+            raise ValueError(f"The {'int8' if quantized else 'full precision'} ONNX model of {self.config['model_name']} failed the parity check")
+        self.quantized = quantized
+        self.model_name = self.config["model_name"]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_id"], pad_token=self.config["pad_token"])
+
+        self.model_path = os.path.join(path, QUANTIZED_FILE if quantized else MODEL_FILE)
+        self.threads = threads
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    import onnxruntime
+
+                    options = onnxruntime.SessionOptions()
+                    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    if self.threads:
+                        options.intra_op_num_threads = self.threads
+                    self._session = onnxruntime.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+                    self._pid = os.getpid()
+        return self._session
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dimension"]
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        """
+        Returns one embedding per sentence (np.ndarray of float32), like SentenceTransformer.encode.
+        """
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        dimension = self.config["dimension"]
+        embeddings = np.zeros((len(sentences), dimension), dtype=np.float32)
+        for start in range(0, len(sentences), batch_size):
+            encodings = self.tokenizer.encode_batch(sentences[start:start + batch_size])
+            inputs = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+                "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+            }
+            hidden = self.session.run(None, {name: inputs[name] for name in self.config["inputs"]})[0]
+            # Mean pooling over the real tokens, padding does not count
+            mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+            embeddings[start:start + len(encodings)] = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.config["normalize"]:
+            embeddings = normalize_rows(embeddings)
+        return embeddings[0] if single else embeddings
+
+
+def parity(reference, embeddings):
+    """
+    Cosine distances between two sets of embeddings of the same sentences.
+
+    Returns:
+    dict: max and mean distance.
+    """
+    distances = 1.0 - np.sum(normalize_rows(np.asarray(reference, dtype=np.float32)) * normalize_rows(np.asarray(embeddings, dtype=np.float32)), axis=1)
+    return {"max_distance": float(distances.max()), "mean_distance": float(distances.mean())}
+
+
+def check_parity(path, reference_model, sentences, tolerance=PARITY_TOLERANCE):
+    """
+    Encodes sentences with the PyTorch model and with every ONNX model of an export, records the
+    distances and the encode times in the export's config and marks which models passed.
+
+    Raises:
+    ValueError: If the full-precision ONNX model does not reproduce the PyTorch embeddings.
+
+    Returns:
+    dict: Parity results per ONNX model file.
+    """
+    start = time.perf_counter()
+    reference = reference_model.encode(sentences)
+    results = {"torch": {"seconds": time.perf_counter() - start}}
+    for quantized, name in ((False, MODEL_FILE), (True, QUANTIZED_FILE)):
+        if not os.path.exists(os.path.join(path, name)):
+            continue
+        encoder = OnnxEncoder(path, quantized=quantized)
+        start = time.perf_counter()
+        embeddings = encoder.encode(sentences)
+        results[name] = {**parity(reference, embeddings), "seconds": time.perf_counter() - start}
+        results[name]["passed"] = results[name]["max_distance"] <= tolerance
+
+    config_path = os.path.join(path, CONFIG_FILE)
+    with open(config_path, "r", encoding="utf-8") as file:
+        config = json.load(file)
+    config["parity"] = {name: result for name, result in results.items() if name != "torch"}
+    with open(config_path, "w", encoding="utf-8") as file:
+        json.dump(config, file, indent=4)
+    if not results[MODEL_FILE]["passed"]:
+        raise ValueError(f"ONNX embeddings differ from PyTorch by up to {results[MODEL_FILE]['max_distance']:.4f} (tolerance {tolerance})")
+    return results
+
+
+def onnx_loader(directory=DEFAULT_ONNX_DIR, quantized=None, threads=None):
+    """
+    Returns a function that loads the ONNX export of a sentence model by name (see
+    model_reloader.load_active_model).
+    """
+    def load(model_name):
+        path = export_path(directory, model_name)
+        if not os.path.exists(os.path.join(path, CONFIG_FILE)):
+            raise FileNotFoundError(f"No ONNX export of {model_name} in '{directory}', run train_model.py --backend onnx")
+        return OnnxEncoder(path, quantized, threads)
+
+    return load
@@ -0,0 +1,404 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from card_bitmasks import COLORS, encode
+from card_data import BASE_PATH, CARDS_CSV, PRICES_CSV, CardIndex, frame_years, iter_price_chunks, load_cards
+
+DEFAULT_AGGREGATES_PATH = os.path.join(BASE_PATH, "data", "cache", "price_aggregates")
+STATE_FILE = "state.json"
+CUBES_FILE = "cubes.json"
+TOTALS_FILE = "card_totals.npy"
+
+# Dimensions of the cubes, every subset of them gets its own pre-aggregated table
+DIMENSIONS = ("color", "rarity", "year")
+
+# Single colors of a card, cards without colors count as colorless
+COLORLESS = "C"
+COLOR_NAMES = {
+    "white": "W", "blue": "U", "black": "B", "red": "R", "green": "G", "colorless": COLORLESS,
+}
+
+# Bytes at the start and before the processed offset that must be unchanged for an incremental refresh
+_CHECK_BYTES = 1 << 16
+
+
+def card_dimensions(cards):
+    """
+    Returns the dimension values of every card row.
+
+    Returns:
+    tuple: (frame with rarity and year per card, frame with one row per card and single color)
+    """
+    dimensions = pd.DataFrame({
+        "rarity": cards["rarity"].astype(object).where(cards["rarity"].notna(), None).to_numpy(),
+        "year": frame_years(cards["frameVersion"]).to_numpy(dtype="float64", na_value=np.nan),
+    })
+    # "W, U" -> two rows, one for W and one for U, straight from the color bits
+    masks = cards["colorsMask"].to_numpy() if "colorsMask" in cards.columns else encode(cards["colors"], COLORS, np.uint8)
+    rows = [np.flatnonzero(masks >> bit & 1) for bit in range(len(COLORS))] + [np.flatnonzero(masks == 0)]
+    card_colors = pd.DataFrame({
+        "card": np.concatenate(rows),
+        "color": np.repeat(np.array([*COLORS, COLORLESS], dtype=object), [len(part) for part in rows]),
+    })
+    return dimensions, card_colors
+
+
+def build_cubes(dimensions, card_colors, totals):
+    """
+    Rolls the per-card price totals up into one table per subset of DIMENSIONS.
+
+    Multi-colored cards count once for every color, so tables with the color dimension come
+    from the exploded card/color rows and tables without it from the plain card rows.
+
+    Returns:
+    dict: Maps a tuple of dimension names to {tuple of values: (sum, count)}.
+    """
+    base = dimensions.assign(sum=totals[:, 0], count=totals[:, 1])
+    base = base[base["count"] > 0]
+    exploded = card_colors.join(base, on="card", how="inner")
+    cubes = {}
+    for size in range(len(DIMENSIONS) + 1):
+        for dims in combinations(DIMENSIONS, size):
+            frame = exploded if "color" in dims else base
+            if not dims:
+                cubes[dims] = {(): (float(frame["sum"].sum()), int(frame["count"].sum()))}
+                continue
+            grouped = frame.groupby(list(dims), dropna=False, sort=True)[["sum", "count"]].sum()
+            keys = grouped.index.to_flat_index() if len(dims) > 1 else ((key,) for key in grouped.index)
+            cubes[dims] = {
+                tuple(_key_value(value) for value in key): (float(total), int(count))
+                for key, total, count in zip(keys, grouped["sum"], grouped["count"])
+            }
+    return cubes
+
+
+def _key_value(value):
+    # Missing values become None and years plain integers, so keys compare equal to query values and JSON
+    if pd.isna(value):
+        return None
+    if isinstance(value, (float, np.floating, np.integer)):
+        return int(value)
+    return value
+
+
+def _block_hash(path, start, size):
+    with open(path, "rb") as file:
+        file.seek(start)
+        return hashlib.sha256(file.read(size)).hexdigest()
+
+
+def _last_line_end(path):
+    """
+    Offset after the last complete line, a row that is still being written is left for the next refresh.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        position = size
+        while position > 0:
+            start = max(0, position - _CHECK_BYTES)
+            file.seek(start)
+            block = file.read(position - start)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+    return 0
+
+
+def _count_lines(path, start, end):
+    count = 0
+    with open(path, "rb") as file:
+        file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = file.read(min(remaining, 1 << 20))
+            count += block.count(b"\n")
+            remaining -= len(block)
+    return count
+
+
+def _prices_checks(path, offset):
+    """
+    Hashes of the first bytes and of the bytes right before `offset`; if both still match, the
+    already processed rows are assumed unchanged and only the appended rows are read.
+    """
+    head = min(offset, _CHECK_BYTES)
+    tail_start = max(0, offset - _CHECK_BYTES)
+    return {
+        "head_hash": _block_hash(path, 0, head),
+        "tail_hash": _block_hash(path, tail_start, offset - tail_start),
+    }
+
+
+def _cards_signature(path):
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def stream_card_totals(card_index, prices_path, start=0, end=None, chunksize=1_000_000):
+    """
+    Sums up price and number of price rows per card for the price rows between two byte offsets.
+
+    Parameters:
+    card_index (CardIndex): The cards, row i of the result belongs to card row i.
+    prices_path (str): Path of cardPrices.csv.
+    start (int): Byte offset to start at (0 = the beginning, including the header).
+    end (int): Byte offset after the last complete line to read (default: end of file).
+    chunksize (int): Number of price rows in memory at a time.
+
+    Returns:
+    tuple: (array of shape (number of cards, 2) with price sum and count, number of price rows read)
+    """
+    end = _last_line_end(prices_path) if end is None else end
+    totals = np.zeros((len(card_index), 2), dtype=np.float64)
+    if end <= start:
+        return totals, 0
+    rows = _count_lines(prices_path, start, end) - (1 if start == 0 else 0)
+    read = 0
+    for chunk in iter_price_chunks(prices_path, ["uuid", "price"], chunksize, start, rows):
+        read += len(chunk)
+        cards = card_index.rows(chunk["uuid"])
+        prices = chunk["price"].to_numpy()
+        # Prices of unknown cards or without a valid price do not count (inner join, like the analysis)
+        valid = (cards >= 0) & ~np.isnan(prices)
+        totals[:, 0] += np.bincount(cards[valid], weights=prices[valid], minlength=len(card_index))
+        totals[:, 1] += np.bincount(cards[valid], minlength=len(card_index))
+    return totals, read
+
+
+class PriceAggregates:
+    """
+    Pre-aggregated price sums and counts over color, rarity and frame year.
+
+    Every combination of dimensions has its own table, so a query is one dictionary lookup.
+
+    Parameters:
+    cubes (dict): As returned by build_cubes.
+    state (dict): Information about the processed data (rows, offsets, creation time).
+    """
+
+    def __init__(self, cubes, state=None):
+        self.cubes = cubes
+        self.state = state or {}
+
+    @staticmethod
+    def normalize_filters(color=None, rarity=None, year=None):
+        """
+        Accepts "red" or "R", any case of a rarity and the year as string or number.
+        """
+        filters = {}
+        if color not in (None, ""):
+            color = str(color).strip()
+            filters["color"] = COLOR_NAMES.get(color.lower(), color.upper())
+        if rarity not in (None, ""):
+            filters["rarity"] = str(rarity).strip().lower()
+        if year not in (None, ""):
+            filters["year"] = int(year)
+        return filters
+
+    def query(self, color=None, rarity=None, year=None):
+        """
+        Returns the average price of all price rows matching the given dimension values.
+
+        Returns:
+        dict: filters, average (None if nothing matches), count and sum.
+        """
+        filters = self.normalize_filters(color, rarity, year)
+        dims = tuple(dimension for dimension in DIMENSIONS if dimension in filters)
+        total, count = self.cubes[dims].get(tuple(filters[dimension] for dimension in dims), (0.0, 0))
+        return {
+            "filters": filters,
+            "average": total / count if count else None,
+            "count": count,
+            "sum": total,
+        }
+
+    def breakdown(self, dimension, **filters):
+        """
+        Average price per value of one dimension, optionally restricted by the other dimensions.
+
+        Returns:
+        pd.Series: Average price indexed by the dimension values, missing values dropped.
+        """
+        filters = self.normalize_filters(**filters)
+        dims = tuple(name for name in DIMENSIONS if name in filters or name == dimension)
+        position = dims.index(dimension)
+        averages = {}
+        for key, (total, count) in self.cubes[dims].items():
+            if key[position] is None or count == 0:
+                continue
+            if all(key[dims.index(name)] == value for name, value in filters.items()):
+                averages[key[position]] = total / count
+        return pd.Series(averages, name="price", dtype=float).rename_axis(dimension).sort_index()
+
+    def to_json(self):
+        return {
+            ",".join(dims): [[*key, total, count] for key, (total, count) in cube.items()]
+            for dims, cube in self.cubes.items()
+        }
+
+    @classmethod
+    def from_json(cls, data, state=None):
+        cubes = {}
+        for name, rows in data.items():
+            dims = tuple(name.split(",")) if name else ()
+            cubes[dims] = {tuple(row[:len(dims)]): (row[len(dims)], row[len(dims) + 1]) for row in rows}
+        return cls(cubes, state)
+
+
+def _write_json(path, data):
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+def load_aggregates(path=DEFAULT_AGGREGATES_PATH):
+    """
+    Loads the stored cubes without touching the CSV files.
+    """
+    with open(os.path.join(path, STATE_FILE), "r", encoding="utf-8") as file:
+        state = json.load(file)
+    with open(os.path.join(path, CUBES_FILE), "r", encoding="utf-8") as file:
+        return PriceAggregates.from_json(json.load(file), state)
+
+
+
+def _state_signature(path):
+    try:
+        stat = os.stat(os.path.join(path, STATE_FILE))
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class AggregatesReloader:
+    """
+    Holds the stored aggregates of a running app and loads them again after a refresh.
+
+    get() compares the size and mtime of the state file with those of the loaded aggregates,
+    one os.stat per call. refresh_aggregates writes the state file last, so a changed signature
+    means the new cubes are complete. If loading fails, the previous aggregates are kept.
+
+    Parameters:
+    path (str): Directory of the stored aggregates.
+    """
+
+    def __init__(self, path=DEFAULT_AGGREGATES_PATH):
+        self.path = path
+        self.current = None
+        self.signature = None
+        self.reloads = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns:
+        PriceAggregates: The latest stored aggregates, None if there are none yet.
+        """
+        signature = _state_signature(self.path)
+        if signature is not None and signature != self.signature:
+            # Only one reload at a time, a second caller waits and then sees the new signature
+            with self._lock:
+                if signature != self.signature:
+                    try:
+                        self.current = load_aggregates(self.path)
+                        self.reloads += 1
+                        self.last_error = None
+                    except (OSError, ValueError) as error:
+                        self.last_error = f"{type(error).__name__}: {error}"
+                        print(f"Reloading the price aggregates failed: {self.last_error}")
+                    self.signature = signature
+        return self.current
+
+
+def refresh_aggregates(path=DEFAULT_AGGREGATES_PATH, cards_path=CARDS_CSV, prices_path=PRICES_CSV,
+                       chunksize=1_000_000, full=False):
+    """
+    Brings the stored cubes up to date with cardPrices.csv.
+
+    Only price rows appended since the last refresh are read, their per-card totals are added to
+    the stored ones and the cubes are rebuilt from those (a few numbers per card). Everything is
+    recomputed when cards.csv changed or the already processed part of cardPrices.csv changed.
+
+    Parameters:
+    path (str): Directory of the stored aggregates.
+    cards_path (str): Path of cards.csv.
+    prices_path (str): Path of cardPrices.csv.
+    chunksize (int): Number of price rows in memory at a time.
+    full (bool): Ignore the stored state and recompute everything.
+
+    Returns:
+    tuple: (PriceAggregates, number of price rows read)
+    """
+    cards = load_cards(columns=["uuid", "colorsMask", "rarity", "frameVersion"], path=cards_path, frame_year=False)
+    # Price rows of a uuid that appears twice belong to its first card row
+    cards = cards.drop_duplicates("uuid").reset_index(drop=True)
+    card_index = CardIndex(cards)
+
+    state = None
+    state_path = os.path.join(path, STATE_FILE)
+    if not full and os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as file:
+            state = json.load(file)
+        offset = state["prices"]["offset"]
+        if (
+            state["cards"] != _cards_signature(cards_path)
+            or os.path.abspath(prices_path) != state["prices"]["path"]
+            or os.path.getsize(prices_path) < offset
+            or _prices_checks(prices_path, offset) != {key: state["prices"][key] for key in ("head_hash", "tail_hash")}
+        ):
+            state = None
+
+    totals_path = os.path.join(path, TOTALS_FILE)
+    start = state["prices"]["offset"] if state else 0
+    end = _last_line_end(prices_path)
+    totals, read = stream_card_totals(card_index, prices_path, start, end, chunksize)
+    if state:
+        totals += np.load(totals_path)
+    rows = (state["prices"]["rows"] if state else 0) + read
+
+    dimensions, card_colors = card_dimensions(cards)
+    aggregates = PriceAggregates(build_cubes(dimensions, card_colors, totals))
+    aggregates.state = {
+        "cards": _cards_signature(cards_path),
+        "prices": {"path": os.path.abspath(prices_path), "offset": end, "rows": rows, **_prices_checks(prices_path, end)},
+        "updated": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+    }
+
+    # The state is written last, an interrupted refresh is simply repeated
+    os.makedirs(path, exist_ok=True)
+    np.save(totals_path + ".tmp.npy", totals)
+    os.replace(totals_path + ".tmp.npy", totals_path)
+    _write_json(os.path.join(path, CUBES_FILE), aggregates.to_json())
+    _write_json(state_path, aggregates.state)
+    return aggregates, read
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-aggregate card prices by color, rarity and frame year.")
+    parser.add_argument("--cards", default=CARDS_CSV, help="Path of cards.csv")
+    parser.add_argument("--prices", default=PRICES_CSV, help="Path of cardPrices.csv")
+    parser.add_argument("--output", default=DEFAULT_AGGREGATES_PATH, help="Directory of the stored aggregates")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="Number of price rows read at a time")
+    parser.add_argument("--full", action="store_true", help="Recompute everything instead of only adding new price rows")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    aggregates, read = refresh_aggregates(args.output, args.cards, args.prices, args.chunk_size, args.full)
+    print(f"Read {read} new price rows ({aggregates.state['prices']['rows']} in total) in {time.perf_counter() - start:.1f}s.")
+    print(f"Average price of all cards: {aggregates.query()['average']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from answer_ranking import THRESHOLD
+from generate_questions import paraphrase
+from model_bundle import DEFAULT_BUNDLE_PATH, load_bundle
+from vector_index import ExactIndex, build_index
+
+
+def evaluate(index, reference, queries, expected_answers, answers):
+    """
+    Compares an index against the exact search for the same queries.
+
+    Returns:
+    dict: Top-1 accuracy (answer equals the expected answer), top-1 agreement with the exact
+    search, agreement of the THRESHOLD distance decision and the average query time.
+    """
+    start = time.perf_counter()
+    distances, indices = index.kneighbors(queries, n_neighbors=1)
+    elapsed = time.perf_counter() - start
+    exact_distances, exact_indices = reference.kneighbors(queries, n_neighbors=1)
+
+    found = [answers[i] for i in indices[:, 0]]
+    exact_found = [answers[i] for i in exact_indices[:, 0]]
+    return {
+        "top1_accuracy": float(np.mean([a == b for a, b in zip(found, expected_answers)])),
+        "top1_agreement": float(np.mean([a == b for a, b in zip(found, exact_found)])),
+        "threshold_agreement": float(np.mean((distances[:, 0] <= THRESHOLD) == (exact_distances[:, 0] <= THRESHOLD))),
+        "max_distance_error": float(np.max(np.abs(distances[:, 0] - exact_distances[:, 0]))),
+        "query_ms": 1000 * elapsed / len(queries),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and accuracy of quantized indexes on the trained questions.")
+    parser.add_argument("--bundle", default=DEFAULT_BUNDLE_PATH, help="Directory of the model bundle")
+    parser.add_argument("--kinds", default="float16,int8,pq", help="Comma separated index types to compare")
+    parser.add_argument("--rerank", default="0,50", help="Comma separated re-ranking depths to try")
+    parser.add_argument("--sample", type=int, default=1000, help="Number of questions used as queries")
+    parser.add_argument("--paraphrase", action="store_true", help="Query with encoded paraphrases instead of the stored questions")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    bundle = load_bundle(args.bundle)
+    embeddings = np.asarray(bundle.embeddings)
+    answers = list(bundle.answers)
+    live = np.flatnonzero(~bundle.deleted)
+    rows = np.random.default_rng(0).choice(live, min(args.sample, len(live)), replace=False)
+
+    if args.paraphrase:
+        # Every paraphrase should still lead to the answer of its original question
+        texts, expected = [], []
+        for row in rows:
+            for text in paraphrase(bundle.questions[row]):
+                texts.append(text)
+                expected.append(answers[row])
+        queries = bundle.encoder.encode(texts)
+    else:
+        queries = embeddings[rows]
+        expected = [answers[row] for row in rows]
+
+    reference = ExactIndex(embeddings, normalized=True, deleted=bundle.deleted)
+    results = [{"kind": "exact", "rerank": 0, "bytes": int(embeddings.nbytes), **evaluate(reference, reference, queries, expected, answers)}]
+    for kind in args.kinds.split(","):
+        for rerank in (int(value) for value in args.rerank.split(",")):
+            index = build_index(kind, embeddings, normalized=True, deleted=bundle.deleted, rerank=rerank)
+            results.append({"kind": kind, "rerank": rerank, "bytes": int(index.code_bytes()),
+                            **evaluate(index, reference, queries, expected, answers)})
+
+    print(f"{len(queries)} queries against {len(live)} questions")
+    print(f"{'index':<8} {'rerank':>6} {'memory':>10} {'saved':>6} {'top-1':>6} {'agree':>6} {'<=' + str(THRESHOLD):>6} {'ms/q':>6}")
+    for result in results:
+        saved = 1 - result["bytes"] / embeddings.nbytes
+        print(
+            f"{result['kind']:<8} {result['rerank']:>6} {result['bytes'] / 2**20:>8.1f}MB {saved:>6.1%} "
+            f"{result['top1_accuracy']:>6.3f} {result['top1_agreement']:>6.3f} "
+            f"{result['threshold_agreement']:>6.3f} {result['query_ms']:>6.2f}"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
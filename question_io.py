@@ -0,0 +1,133 @@
+import json
+import os
+import shutil
+import tempfile
+
+
+def question_format(path):
+    """
+    Returns the file format of a question file based on its extension ("json", "jsonl" or "parquet").
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if extension in (".parquet", ".pq"):
+        return "parquet"
+    return "json"
+
+
+def iter_question_records(path):
+    """
+    Streams question records ({"question": ..., "answer": ..., maybe "name"/"column"}) from a file.
+
+    Parameters:
+    path (str): A questions.json file ({"questions": [...], "answers": [...]}), a JSONL file or a Parquet file.
+    """
+    file_format = question_format(path)
+    if file_format == "jsonl":
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+    elif file_format == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+    else:
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        for question, answer in zip(data["questions"], data["answers"]):
+            yield {"question": question, "answer": answer}
+
+
+def iter_question_batches(path, batch_size=10000):
+    """
+    Streams a question file as (questions, answers) lists of up to batch_size entries each.
+    """
+    questions, answers = [], []
+    for record in iter_question_records(path):
+        questions.append(record["question"])
+        answers.append(str(record["answer"]))
+        if len(questions) >= batch_size:
+            yield questions, answers
+            questions, answers = [], []
+    if questions:
+        yield questions, answers
+
+
+def load_questions(path):
+    """
+    Loads a question file completely.
+
+    Returns:
+    tuple: (questions, answers) as two lists.
+    """
+    questions = []
+    answers = []
+    for record in iter_question_records(path):
+        questions.append(record["question"])
+        answers.append(str(record["answer"]))
+    return questions, answers
+
+
+def _write_json_questions(chunks, file):
+    # The questions are written as they come, the answers wait in a temporary file and are
+    # appended at the end, so only one chunk is in memory (same layout as json.dump(indent=4))
+    count = 0
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as answers:
+        file.write('{\n    "questions": [')
+        for chunk in chunks:
+            for question, answer in zip(chunk["question"].tolist(), chunk["answer"].tolist()):
+                separator = "\n" if count == 0 else ",\n"
+                file.write(separator + "        " + json.dumps(question, ensure_ascii=False))
+                answers.write(separator + "        " + json.dumps(answer, ensure_ascii=False))
+                count += 1
+            file.flush()
+        file.write('\n    ],\n    "answers": [' if count else '],\n    "answers": [')
+        answers.seek(0)
+        shutil.copyfileobj(answers, file)
+        file.write("\n    ]\n}" if count else "]\n}")
+    return count
+
+
+def write_questions(chunks, path, file_format=None):
+    """
+    Writes DataFrame chunks with "question" and "answer" columns (plus optional extra columns) to a file.
+
+    Every format is written chunk by chunk, only one chunk is in memory at a time; the old
+    questions.json layout keeps the answers in a temporary file until all questions are written
+    (and only stores question and answer).
+
+    Returns:
+    int: The number of written questions.
+    """
+    file_format = file_format or question_format(path)
+    count = 0
+    if file_format == "jsonl":
+        with open(path, "w", encoding="utf-8") as file:
+            for chunk in chunks:
+                if len(chunk):
+                    lines = chunk.to_json(orient="records", lines=True, force_ascii=False)
+                    file.write(lines if lines.endswith("\n") else lines + "\n")
+                    file.flush()
+                count += len(chunk)
+    elif file_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+                count += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(path, "w", encoding="utf-8") as file:
+            count = _write_json_questions(chunks, file)
+    return count
@@ -0,0 +1,101 @@
+import argparse
+import os
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve app.py with a production server instead of the Flask dev server.")
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"), help="Address to listen on")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)), help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_WORKERS", 2)), help="Worker processes (gunicorn only)")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("WEB_THREADS", 16)), help="Request threads per worker")
+    parser.add_argument("--backlog", type=int, default=int(os.environ.get("WEB_BACKLOG", 2048)), help="Connections waiting to be accepted")
+    parser.add_argument("--timeout", type=int, default=int(os.environ.get("WEB_TIMEOUT", 60)), help="Seconds before a stuck worker is restarted (gunicorn only)")
+    parser.add_argument("--server", choices=["auto", "gunicorn", "waitress"], default="auto", help="Server to use (auto: gunicorn if available, else waitress)")
+    return parser.parse_args()
+
+
+def load_app():
+    # Loads the model bundle, the card lookup and the caches (see app.py)
+    from app import app
+
+    return app
+
+
+def start_worker(workers):
+    # Threads do not survive a fork, so every worker starts its own model watcher and warms up
+    # the encoder itself (torch's thread pools are created on the first encode in the worker)
+    from app import start_model_watcher, warm_up_model
+
+    limit_torch_threads(workers)
+    warm_up_model()
+    start_model_watcher()
+
+
+def limit_torch_threads(workers):
+    """
+    Gives every worker process an equal share of the cores for torch, otherwise all workers
+    start one thread per core each and slow each other down.
+    """
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+
+
+def serve_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app()
+
+    Server({
+        "bind": f"{args.host}:{args.port}",
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        "backlog": args.backlog,
+        "timeout": args.timeout,
+        # The app (model weights, memory-mapped index, card table) is loaded once before the
+        # workers are forked, so they share its memory copy-on-write
+        "preload_app": True,
+        "post_fork": lambda server, worker: start_worker(args.workers),
+    }).run()
+
+
+def serve_waitress(args):
+    # Fallback for Windows, where gunicorn does not run: one process with a thread pool
+    from waitress import serve
+
+    app = load_app()
+    start_worker(1)
+    serve(app, host=args.host, port=args.port, threads=args.threads, backlog=args.backlog)
+
+
+def main():
+    args = parse_args()
+    server = args.server
+    if server == "auto":
+        try:
+            import gunicorn  # noqa: F401
+
+            server = "gunicorn"
+        except ImportError:
+            server = "waitress"
+    if server == "gunicorn":
+        serve_gunicorn(args)
+    else:
+        serve_waitress(args)
+
+
+if __name__ == "__main__":
+    main()
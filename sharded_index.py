@@ -0,0 +1,302 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import subprocess
+import sys
+import threading
+import weakref
+
+import numpy as np
+
+from answer_cache import normalize_question
+from generate_questions import split_question
+from vector_index import build_index, load_index
+
+
+def shard_directory(shard):
+    return f"shard-{shard:03d}"
+
+
+def shard_of(question, n_shards):
+    """
+    Shard of a question: a hash of its card name, so all questions about one card end up on the
+    same shard (questions that do not follow the default template are hashed as a whole).
+    """
+    parts = split_question(question)
+    digest = hashlib.blake2b(normalize_question(parts[0] if parts else question).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % n_shards
+
+
+def shard_order(questions, n_shards):
+    """
+    Returns the row order that puts the questions of every shard next to each other (shard 0
+    first, the original order within a shard) and the row offsets of the shards.
+
+    Returns:
+    tuple: (order, offsets), offsets has n_shards + 1 entries.
+    """
+    assignments = np.fromiter((shard_of(question, n_shards) for question in questions), dtype=np.int64, count=len(questions))
+    order = np.argsort(assignments, kind="stable")
+    offsets = np.searchsorted(assignments[order], np.arange(n_shards + 1))
+    return order, offsets
+
+
+def build_shards(directory, vectors, offsets, kind, options=None, deleted=None):
+    """
+    Builds one index per shard on its slice of the (already shard-ordered, normalized) vectors
+    and saves each into its own subdirectory.
+
+    Returns:
+    list: Per shard its row range and index options (stored in the bundle's manifest).
+    """
+    shards = []
+    for shard, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:])):
+        start, stop = int(start), int(stop)
+        shard_options = {}
+        if stop > start:
+            index = build_index(
+                kind, vectors[start:stop], normalized=True,
+                deleted=None if deleted is None else deleted[start:stop], **(options or {}),
+            )
+            os.makedirs(os.path.join(directory, shard_directory(shard)))
+            index.save(os.path.join(directory, shard_directory(shard)))
+            shard_options = index.options()
+        shards.append({"start": start, "stop": stop, "options": shard_options})
+    return shards
+
+
+def load_shard(directory, shard, kind, info, vectors, deleted=None):
+    return load_index(
+        kind, os.path.join(directory, shard_directory(shard)), vectors[info["start"]:info["stop"]], info["options"],
+        None if deleted is None else deleted[info["start"]:info["stop"]],
+    )
+
+
+def merge_neighbors(results, offsets, n_neighbors):
+    """
+    Merges the neighbours found per shard into the overall top n_neighbors, ordered by distance
+    and then by global row, the order a single index over all rows returns.
+
+    Parameters:
+    results (list): Per shard (distances, local indices) from kneighbors.
+    offsets (list): First global row of every shard.
+    n_neighbors (int): Number of neighbours to keep per query.
+
+    Returns:
+    tuple: (distances, indices) with global row numbers.
+    """
+    distances = np.concatenate([np.asarray(shard_distances, dtype=np.float32) for shard_distances, _ in results], axis=1)
+    indices = np.concatenate([np.asarray(local, dtype=np.int64) + offset for (_, local), offset in zip(results, offsets)], axis=1)
+    order = np.lexsort((indices, distances), axis=1)[:, :n_neighbors]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+class StaleBundleError(RuntimeError):
+    """
+    The bundle directory no longer holds the bundle the index was loaded from (it was replaced
+    before the shard processes opened their files); load the bundle again.
+    """
+
+
+class ShardedIndex:
+    """
+    Nearest-neighbour index split into shards by card name, with the kneighbors interface of
+    vector_index. A query goes to every shard at once and the per-shard top-k are merged, so
+    the answers are the same as with one index over all rows of the bundle (for the exact and
+    float16 indexes; int8 scales, ivf clusters and pq codebooks are trained per shard).
+
+    With processes=True every shard runs in its own worker process (started on the first query
+    in each process, so serve.py's forked workers get their own); the shard maps its slice of
+    embeddings.npy, and only query embeddings and results go through the pipes. Otherwise the
+    shards are searched one after the other in this process. A worker opens the bundle's files
+    by path, so it checks that they still belong to build_hash; if the bundle has been replaced
+    in the meantime the query raises StaleBundleError instead of mapping the new bundle's rows
+    onto the old answers.
+
+    Parameters:
+    directory (str): Directory of the bundle.
+    kind (str): Index type of the shards.
+    shards (list): Row range and options per shard (from the manifest).
+    vectors (np.ndarray): All normalized embeddings of the bundle, in shard order.
+    deleted (np.ndarray): Boolean mask of tombstoned rows.
+    processes (bool): Search the shards in worker processes.
+    threads (int): Numpy threads per shard process (default: cores / shards).
+    build_hash (str): Build hash of the bundle in the manifest (default: not checked).
+    """
+
+    kind = "sharded"
+
+    def __init__(self, directory, kind, shards, vectors, deleted=None, processes=True, threads=None, build_hash=None):
+        self.directory = os.path.abspath(directory)
+        self.build_hash = build_hash
+        self.shard_kind = kind
+        self.shards = [(shard, info) for shard, info in enumerate(shards) if info["stop"] > info["start"]]
+        self.offsets = [info["start"] for _, info in self.shards]
+        self.vectors = vectors
+        self.deleted = deleted
+        self.processes = processes
+        self.threads = threads or max(1, (os.cpu_count() or 1) // max(1, len(self.shards)))
+        self._indexes = None
+        self._workers = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def options(self):
+        return {"shards": len(self.shards)}
+
+    @property
+    def indexes(self):
+        if self._indexes is None:
+            self._indexes = [
+                load_shard(self.directory, shard, self.shard_kind, info, self.vectors, self.deleted) for shard, info in self.shards
+            ]
+        return self._indexes
+
+    def _start_workers(self):
+        environment = dict(os.environ)
+        for variable in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            environment[variable] = str(self.threads)
+        workers = []
+        for shard, info in self.shards:
+            spec = {"directory": self.directory, "shard": shard, "kind": self.shard_kind, "info": info, "build_hash": self.build_hash}
+            workers.append(subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--serve", json.dumps(spec)],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=environment,
+            ))
+        self._workers = workers
+        self._pid = os.getpid()
+        # Stops the workers when the index is dropped (e.g. after a model reload)
+        weakref.finalize(self, _stop_workers, workers, self._pid)
+        # Every worker reports once it has opened its files: None, or (stale, message)
+        try:
+            ready = [pickle.load(worker.stdout) for worker in workers]
+        except (EOFError, OSError) as error:
+            self.close()
+            raise RuntimeError(f"A shard worker process exited while loading ({type(error).__name__})") from None
+        problems = [problem for problem in ready if problem is not None]
+        if problems:
+            self.close()
+            stale = [message for is_stale, message in problems if is_stale]
+            if stale:
+                raise StaleBundleError(stale[0])
+            raise RuntimeError(f"A shard worker could not load its shard: {problems[0][1]}")
+
+    def kneighbors(self, X, n_neighbors=1, return_distance=True):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        if not self.processes:
+            results = [index.kneighbors(X, n_neighbors=n_neighbors) for index in self.indexes]
+        else:
+            # One query at a time per process; the shards work on it in parallel
+            with self._lock:
+                if self._workers is None or self._pid != os.getpid():
+                    self._start_workers()
+                try:
+                    # Scatter: every shard gets the query before the first answer is read
+                    for worker in self._workers:
+                        pickle.dump((X, n_neighbors), worker.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+                        worker.stdin.flush()
+                    # Gather
+                    results = [pickle.load(worker.stdout) for worker in self._workers]
+                except (EOFError, OSError) as error:
+                    # A worker died; the others are stopped too and the next query starts new ones
+                    self.close()
+                    raise RuntimeError(f"A shard worker process exited ({type(error).__name__})") from None
+            for (shard, _), result in zip(self.shards, results):
+                if isinstance(result, str):
+                    raise RuntimeError(f"Shard {shard} failed: {result}")
+        distances, indices = merge_neighbors(results, self.offsets, n_neighbors)
+        if not return_distance:
+            return indices
+        return distances, indices
+
+    def close(self):
+        if self._workers is not None and self._pid == os.getpid():
+            _stop_workers(self._workers, self._pid)
+        self._workers = None
+
+
+def _stop_workers(workers, pid):
+    # A forked child must not stop the workers of its parent
+    if os.getpid() != pid:
+        return
+    for worker in workers:
+        if worker.poll() is None:
+            try:
+                worker.stdin.close()
+                worker.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                worker.kill()
+
+
+def serve_shard(spec):
+    """
+    Worker process of one shard: opens the shard, reports None (or (stale, message) if it cannot
+    serve the bundle with spec["build_hash"]) and then reads (queries, n_neighbors) from stdin and
+    writes the shard's (distances, local indices) to stdout until stdin is closed.
+    """
+    from model_bundle import EMBEDDINGS_FILE, TOMBSTONES_FILE, read_manifest
+
+    directory = spec["directory"]
+    expected = spec.get("build_hash")
+    requests, responses = sys.stdin.buffer, sys.stdout.buffer
+
+    def report(problem):
+        pickle.dump(problem, responses, protocol=pickle.HIGHEST_PROTOCOL)
+        responses.flush()
+
+    def build_hash():
+        try:
+            return read_manifest(directory)["build_hash"]
+        except (OSError, ValueError):
+            return None
+
+    # The manifest is read before and after the files are opened: if both match the expected
+    # build, every opened file belongs to it (a new bundle replaces the whole directory at once)
+    found = build_hash()
+    try:
+        if expected is not None and found != expected:
+            raise StaleBundleError(f"Bundle in {directory} is {found}, the index was loaded from {expected}")
+        vectors = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+        tombstones_path = os.path.join(directory, TOMBSTONES_FILE)
+        deleted = np.load(tombstones_path) if os.path.exists(tombstones_path) else None
+        index = load_shard(directory, spec["shard"], spec["kind"], spec["info"], vectors, deleted)
+        if expected is not None and build_hash() != expected:
+            raise StaleBundleError(f"Bundle in {directory} was replaced while shard {spec['shard']} was loading")
+    except StaleBundleError as error:
+        report((True, str(error)))
+        return
+    except Exception as error:
+        # Files of a bundle that is being replaced can be missing or of another size
+        report((expected is not None and build_hash() != expected, f"{type(error).__name__}: {error}"))
+        return
+    report(None)
+
+    while True:
+        try:
+            queries, n_neighbors = pickle.load(requests)
+        except EOFError:
+            return
+        try:
+            result = index.kneighbors(queries, n_neighbors=n_neighbors)
+        except Exception as error:
+            result = f"{type(error).__name__}: {error}"
+        pickle.dump(result, responses, protocol=pickle.HIGHEST_PROTOCOL)
+        responses.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker process of one index shard (started by ShardedIndex).")
+    parser.add_argument("--serve", required=True, help="Shard to serve as JSON (directory, shard, kind, info, build_hash)")
+    args = parser.parse_args()
+    serve_shard(json.loads(args.serve))
+
+
+if __name__ == "__main__":
+    main()
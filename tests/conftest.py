@@ -0,0 +1,48 @@
+import json
+import os
+import sys
+import zlib
+
+import numpy as np
+import pytest
+
+# The modules live in the repository root, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def fake_encode(questions):
+    # Deterministic stand-in for the sentence model: one random vector per question text
+    return np.array(
+        [np.random.default_rng(zlib.crc32(question.encode("utf-8"))).normal(size=16) for question in questions],
+        dtype=np.float32,
+    )
+
+
+class FakeSentenceModel:
+    def __init__(self, name):
+        self.name = name
+
+    def encode(self, questions, batch_size=32):
+        return fake_encode(list(questions))
+
+
+@pytest.fixture
+def run_train_model(monkeypatch, tmp_path):
+    """
+    Runs train_model.py's main() on a JSONL question file with a fake sentence model.
+    """
+    import train_model
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(train_model, "load_encoder", FakeSentenceModel)
+    monkeypatch.setattr("model_bundle.load_encoder", FakeSentenceModel)
+
+    def run(questions, answers, *arguments):
+        path = tmp_path / "train_questions.jsonl"
+        with open(path, "w", encoding="utf-8") as file:
+            for question, answer in zip(questions, answers):
+                file.write(json.dumps({"question": question, "answer": answer}) + "\n")
+        monkeypatch.setattr(sys, "argv", ["train_model.py", "--model", "fake", "--questions", str(path), *arguments])
+        train_model.main()
+
+    return run
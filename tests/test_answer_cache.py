@@ -0,0 +1,68 @@
+import numpy as np
+
+from answer_cache import AnswerCache, EmbeddingCache, normalize_question
+
+
+def test_normalize_question():
+    assert normalize_question("  What is the manaCost of Ancestor's   Chosen? ") == "what is the manacost of ancestors chosen"
+    assert normalize_question("ＡＢＣ") == "abc"
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("answer_cache.time.monotonic", lambda: now[0])
+    cache = AnswerCache(max_size=2, ttl=10)
+    cache.put("a", ("A", 0.1))
+    cache.put("b", ("B", 0.2))
+    assert cache.get("a") == ("A", 0.1)
+    cache.put("c", ("C", 0.3))
+    # "b" was the least recently used entry
+    assert cache.get("b") is None and cache.get("a") == ("A", 0.1)
+    now[0] += 11
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["expirations"] == 1
+
+
+def test_model_change_clears_the_cache():
+    cache = AnswerCache()
+    cache.validate("v1")
+    cache.put("a", ("A", 0.1), "v1")
+    cache.validate("v2")
+    assert cache.get("a", "v2") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_request_on_the_old_model_does_not_fill_the_new_cache():
+    cache = AnswerCache()
+    # A request starts on model v1 ...
+    cache.validate("v1")
+    # ... the model is swapped and a request on v2 clears the cache ...
+    cache.validate("v2")
+    # ... then the first request finishes and stores its answer
+    cache.put("a", ("old answer", 0.1), "v1")
+    assert cache.get("a", "v2") is None
+    assert cache.stats()["stale_puts"] == 1
+
+
+def test_request_on_the_new_model_ignores_entries_of_the_old_one():
+    cache = AnswerCache()
+    cache.validate("v2")
+    # A slow request on v1 validates after v2 and stores its answer
+    cache.validate("v1")
+    cache.put("a", ("old answer", 0.1), "v1")
+    assert cache.get("a", "v2") is None
+    cache.validate("v2")
+    assert cache.get("a", "v2") is None
+
+
+def test_embedding_cache_round_trip(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    vectors = np.arange(6, dtype=np.float32).reshape(2, 3)
+    EmbeddingCache(path, "model-a").put_many(["first", "second"], vectors)
+    cache = EmbeddingCache(path, "model-a")
+    found = cache.get_many(["second", "third"])
+    assert list(found) == ["second"]
+    np.testing.assert_array_equal(found["second"], vectors[1])
+    # Embeddings of another sentence model are not shared
+    assert EmbeddingCache(path, "model-b").get_many(["first"]) == {}
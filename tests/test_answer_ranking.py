@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from answer_ranking import THRESHOLD, LexicalReranker, confidence, rank_candidates
+from vector_index import ExactIndex
+
+QUESTIONS = [
+    "What is the rarity of Angel of Serenity?",
+    "What is the rarity of Angel of Mercy?",
+    "What is the rarity of Angel of Serenity?",
+    "What is the rarity of Lightning Bolt?",
+]
+ANSWERS = ["mythic", "uncommon", "mythic", "common"]
+
+
+def at_distances(distances):
+    # Unit vectors at the given cosine distances from the query [1, 0]
+    angles = np.arccos(1 - np.asarray(distances))
+    return np.stack([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32)
+
+
+QUERY = np.array([[1, 0]], dtype=np.float32)
+INDEX = ExactIndex(at_distances([0.10, 0.15, 0.12, 0.60]))
+
+
+def test_confidence_is_one_half_at_the_threshold():
+    scores = confidence([0.0, THRESHOLD, 1.0])
+    assert scores[1] == pytest.approx(0.5)
+    assert scores[0] > 0.99 and scores[2] < 0.01
+
+
+def test_name_overlap():
+    reranker = LexicalReranker(QUESTIONS)
+    tokens = {"rarity", "of", "angel", "mercy"}
+    assert reranker.name_overlap(tokens, 1) == 1.0
+    assert reranker.name_overlap(tokens, 0) == pytest.approx(2 / 3)
+
+
+def test_without_reranking_candidates_follow_the_distance():
+    ranked, nearest = rank_candidates(QUERY, ["angel of mercy rarity"], INDEX, ANSWERS, QUESTIONS, k=3, return_nearest=True)
+    # The second "mythic" row is dropped, every answer is returned once
+    assert [candidate["answer"] for candidate in ranked[0]] == ["mythic", "uncommon", "common"]
+    assert [candidate["score"] for candidate in ranked[0]] == pytest.approx(confidence([0.10, 0.15, 0.60]))
+    assert all(candidate["lexical"] is None for candidate in ranked[0])
+    assert nearest[0] == pytest.approx(0.10, abs=1e-6)
+
+
+def test_reranked_scores_follow_the_new_order():
+    ranked, nearest = rank_candidates(
+        QUERY, ["What is the rarity of Angel of Mercy?"], INDEX, ANSWERS, QUESTIONS, k=3, depth=4, weight=0.2,
+        return_nearest=True,
+    )
+    candidates = ranked[0]
+    assert [candidate["answer"] for candidate in candidates] == ["uncommon", "mythic", "common"]
+    scores = [candidate["score"] for candidate in candidates]
+    assert scores == sorted(scores, reverse=True)
+    # The score is the confidence of the combined value, not of the candidate's own distance
+    assert scores[0] == pytest.approx(confidence(1 - (0.8 * 0.85 + 0.2 * 1.0)))
+    assert candidates[0]["distance"] == pytest.approx(0.15, abs=1e-6)
+    # The nearest distance is the one of the closest question, whatever comes first after re-ranking
+    assert nearest[0] == pytest.approx(0.10, abs=1e-6)
+
+
+class FixedNeighbours:
+    def __init__(self, distances, rows):
+        self.distances, self.rows = np.array([distances]), np.array([rows])
+
+    def kneighbors(self, embeddings, n_neighbors):
+        return self.distances, self.rows
+
+
+def test_deleted_neighbours_are_skipped():
+    # Tombstoned rows come back with an infinite distance
+    ranked, nearest = rank_candidates(QUERY, ["q"], FixedNeighbours([np.inf, 0.2], [0, 3]), ANSWERS, k=2, return_nearest=True)
+    assert [candidate["row"] for candidate in ranked[0]] == [3]
+    assert nearest.tolist() == [0.2]
+    ranked, nearest = rank_candidates(QUERY, ["q"], FixedNeighbours([np.inf], [0]), ANSWERS, return_nearest=True)
+    assert ranked == [[]] and nearest.tolist() == [np.inf]
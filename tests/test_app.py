@@ -0,0 +1,137 @@
+import importlib
+import sys
+
+import numpy as np
+import pytest
+
+from model_reloader import ActiveModel
+from vector_index import ExactIndex
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    # Import the app without a model, card data or caches from the working directory
+    directory = tmp_path_factory.mktemp("app")
+    patch = pytest.MonkeyPatch()
+    patch.chdir(directory)
+    for name, value in {
+        "MODEL_BUNDLE_PATH": str(directory / "question_model"),
+        "MODEL_RELOAD_INTERVAL": "0",
+        "CARD_LOOKUP": "0",
+        "NAME_RESOLVER": "0",
+        "PRICE_AGGREGATES_PATH": str(directory / "price_aggregates"),
+        "EMBEDDING_CACHE_PATH": "",
+    }.items():
+        patch.setenv(name, value)
+    sys.modules.pop("app", None)
+    module = importlib.import_module("app")
+    yield module
+    patch.undo()
+    sys.modules.pop("app", None)
+
+
+def test_batch_answers_every_question_in_order(app_module):
+    client = app_module.app.test_client()
+    response = client.post("/ask/batch", json={"questions": ["first?", "second?"]})
+    assert response.status_code == 200
+    # Without a model every question still gets its own answer
+    assert response.get_json() == {"answers": ["Model not loaded", "Model not loaded"]}
+
+
+def test_batch_rejects_bodies_that_are_not_objects(app_module):
+    client = app_module.app.test_client()
+    assert client.post("/ask/batch", json=["What is the rarity of Abundance?"]).status_code == 400
+    assert client.post("/ask/batch", json="What is the rarity of Abundance?").status_code == 400
+    assert "error" in client.post("/ask/batch", json={"questions": []}).get_json()
+    assert "error" in client.post("/ask/batch", json={"questions": ["ok", ""]}).get_json()
+
+
+class FakeEncoder:
+    def __init__(self, on_encode=None):
+        self.on_encode = on_encode
+
+    def encode(self, questions):
+        if self.on_encode is not None:
+            self.on_encode()
+        return np.ones((len(questions), 4), dtype=np.float32)
+
+
+def make_model(app_module, version, answer, on_encode=None):
+    index = ExactIndex(np.ones((1, 4), dtype=np.float32))
+    return ActiveModel(FakeEncoder(on_encode), index, [answer], ["What is the rarity of Test Card?"], version, "fake", "memory")
+
+
+def test_request_running_during_a_reload_does_not_cache_its_old_answer(app_module, monkeypatch):
+    new_model = make_model(app_module, "v2", "new answer")
+
+    def swap():
+        # The bundle is reloaded while the first request is encoding; a request on the new model runs meanwhile
+        app_module.model_holder.current = new_model
+        assert app_module.rank_questions(["other question"])[0]["answer"] == "new answer"
+
+    monkeypatch.setattr(app_module.model_holder, "current", make_model(app_module, "v1", "old answer", swap))
+    app_module.answer_cache.clear()
+    assert app_module.rank_questions(["What is the rarity of Test Card?"])[0]["answer"] == "old answer"
+    # The next request runs on the new model and must not get the old model's answer from the cache
+    assert app_module.rank_questions(["What is the rarity of Test Card?"])[0]["answer"] == "new answer"
+
+
+class QueryEncoder:
+    def encode(self, questions):
+        return np.tile(np.array([1, 0], dtype=np.float32), (len(questions), 1))
+
+
+@pytest.fixture
+def reranking_model(app_module, monkeypatch):
+    # The closest stored question names another card than the one asked about
+    questions = ["What is the rarity of Angel of Serenity?", "What is the rarity of Angel of Mercy?", "What is the rarity of Lightning Bolt?"]
+    angles = np.arccos(1 - np.array([0.10, 0.15, 0.60]))
+    index = ExactIndex(np.stack([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32))
+    model = ActiveModel(QueryEncoder(), index, ["mythic", "uncommon", "common"], questions, "rerank", "fake", "memory")
+    monkeypatch.setattr(app_module.model_holder, "current", model)
+    monkeypatch.setattr(app_module, "RERANK_DEPTH", 10)
+    app_module.answer_cache.clear()
+    return model
+
+
+def test_reranking_is_off_by_default(app_module):
+    assert app_module.RERANK_DEPTH == 0
+
+
+def test_reranked_scores_match_the_order(app_module, reranking_model):
+    result = app_module.rank_questions(["What is the rarity of Angel of Mercy?"], k=3)[0]
+    assert [candidate["answer"] for candidate in result["candidates"]] == ["uncommon", "mythic", "common"]
+    scores = [candidate["score"] for candidate in result["candidates"]]
+    assert scores == sorted(scores, reverse=True)
+    assert result["score"] == scores[0]
+    # The cached answer keeps the score of the re-ranked candidate
+    app_module.rank_questions(["What is the rarity of Angel of Mercy?"])
+    cached = app_module.rank_questions(["What is the rarity of Angel of Mercy?"])[0]
+    assert cached["candidates"][0]["source"] == "cache"
+    assert cached["score"] == scores[0]
+
+
+def test_threshold_applies_to_the_nearest_question(app_module, reranking_model):
+    # The re-ranked answer is 0.15 away, but the nearest question (0.10) is within the threshold
+    result = app_module.rank_questions(["What is the rarity of Angel of Mercy?"], threshold=0.12)[0]
+    assert result["answer"] == "uncommon"
+    # Also for the cached answer
+    assert app_module.rank_questions(["What is the rarity of Angel of Mercy?"], threshold=0.12)[0]["answer"] == "uncommon"
+    assert app_module.rank_questions(["What is the rarity of Angel of Mercy?"], threshold=0.05)[0]["answer"] == "I don't know this yet."
+
+
+def test_defaults_only_for_missing_options(app_module):
+    assert app_module.parse_ranking_options({}) == (app_module.DEFAULT_K, app_module.THRESHOLD, None)
+    assert app_module.parse_ranking_options({"k": "3", "threshold": "0.25"}) == (3, 0.25, None)
+    assert app_module.parse_ranking_options({"threshold": 0}) == (app_module.DEFAULT_K, 0.0, None)
+
+
+@pytest.mark.parametrize("values", [
+    {"k": 0}, {"k": -1}, {"k": 10_000}, {"k": "two"}, {"k": True}, {"k": ""},
+    {"threshold": -0.1}, {"threshold": 3}, {"threshold": "nan"}, {"threshold": "high"},
+])
+def test_invalid_options(app_module, values):
+    k, threshold, error = app_module.parse_ranking_options(values)
+    assert k is None and threshold is None and error
+    client = app_module.app.test_client()
+    assert client.post("/ask/batch", json={"questions": ["a"], **values}).status_code == 400
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from bulk_answer import iter_records, resume_offset
+
+
+def write_lines(path, offsets, tail=""):
+    with open(path, "w", encoding="utf-8") as file:
+        for offset in offsets:
+            file.write(json.dumps({"question": "x" * 50000, "_offset": offset}) + "\n")
+        file.write(tail)
+
+
+def test_resume_after_complete_lines(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    write_lines(path, [0, 1, 2])
+    assert resume_offset(path) == 3
+
+
+def test_resume_cuts_off_a_half_written_line(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    write_lines(path, [4, 5], tail='{"question": "half')
+    size = path.stat().st_size
+    assert resume_offset(path) == 6
+    assert path.stat().st_size == size - len('{"question": "half')
+    assert path.read_text(encoding="utf-8").endswith("\n")
+
+
+def test_resume_without_a_complete_line(tmp_path):
+    assert resume_offset(tmp_path / "missing.jsonl") == 0
+    path = tmp_path / "answers.jsonl"
+    write_lines(path, [], tail='{"quest')
+    assert resume_offset(path) == 0
+    assert path.stat().st_size == 0
+
+
+def test_records_carry_their_offset(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    path.write_text('"first"\n{"question": "second", "offset": 7}\n\n"third"\n', encoding="utf-8")
+    records = list(iter_records(str(path), start=1))
+    assert records == [{"question": "second", "offset": 7, "_offset": 1}, {"question": "third", "_offset": 2}]
+
+
+def test_records_must_not_have_an_offset_field(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    path.write_text('{"question": "first", "_offset": 3}\n', encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_records(str(path)))
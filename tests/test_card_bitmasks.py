@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from card_bitmasks import (
+    COLORS, FINISHES, TYPES, bit_count, color_bits, contains_all, contains_any, decode, encode, exactly, sum_by_bit,
+)
+
+
+def test_round_trip():
+    values = pd.Series(["W, U", None, "G", "W, U, B, R, G", "", "R"])
+    masks = encode(values, COLORS, np.uint8)
+    assert masks.tolist() == [0b11, 0, 0b10000, 0b11111, 0, 0b1000]
+    assert decode(masks, COLORS).tolist() == ["W, U", None, "G", "W, U, B, R, G", None, "R"]
+
+
+def test_round_trip_keeps_vocabulary_order_and_unknown_values():
+    values = pd.Series(["Creature, Artifact", "Land", "Summon"], dtype="category")
+    assert decode(encode(values, TYPES), TYPES).tolist() == ["Artifact, Creature", "Land", "other"]
+    assert decode(encode(pd.Series(["foil, nonfoil"]), FINISHES), FINISHES).tolist() == ["nonfoil, foil"]
+
+
+def test_filters():
+    masks = encode(pd.Series(["R", "R, G", "U", None]), COLORS, np.uint8)
+    assert contains_any(masks, color_bits("red")).tolist() == [True, True, False, False]
+    assert contains_all(masks, color_bits("RG")).tolist() == [False, True, False, False]
+    assert exactly(masks, color_bits("U")).tolist() == [False, False, True, False]
+    assert exactly(masks, color_bits("colorless")).tolist() == [False, False, False, True]
+    assert bit_count(masks).tolist() == [1, 2, 1, 0]
+
+
+def test_sum_by_bit_matches_explode():
+    colors = pd.Series(["R", "R, G", "U", None])
+    prices = pd.Series([1.0, 2.0, 4.0, 8.0])
+    exploded = pd.DataFrame({"color": colors.str.split(", "), "price": prices}).explode("color")
+    expected = exploded.groupby("color")["price"].sum().reindex(list(COLORS), fill_value=0.0)
+    result = sum_by_bit(encode(colors, COLORS, np.uint8), prices.to_numpy(), COLORS)
+    assert result.to_dict() == expected.to_dict()
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from card_data import CardIndex, iter_merged_prices, iter_price_chunks, merge_price_chunks
+
+CARDS = pd.DataFrame({
+    "uuid": ["a", "b", "c"],
+    "name": ["Angel", "Bolt", "Guild"],
+    "rarity": ["rare", "common", "uncommon"],
+    "power": [3.0, np.nan, 2.0],
+})
+
+PRICES = pd.DataFrame({
+    "uuid": ["b", "x", "a", "a", "c", "y", "b"],
+    "price": [0.5, 1.0, 2.0, np.nan, 4.0, 5.0, 6.0],
+})
+
+
+def chunks(frame, size):
+    return (frame.iloc[start:start + size] for start in range(0, len(frame), size))
+
+
+@pytest.mark.parametrize("how", ["inner", "left"])
+@pytest.mark.parametrize("size", [1, 3, 100])
+def test_chunked_merge_matches_pandas(how, size):
+    expected = PRICES.merge(CARDS, on="uuid", how=how)
+    merged = pd.concat(merge_price_chunks(CARDS, chunks(PRICES, size), how), ignore_index=True)
+    pd.testing.assert_frame_equal(merged, expected, check_dtype=False)
+
+
+def test_card_index_is_reused_and_needs_unique_uuids():
+    index = CardIndex(CARDS)
+    assert index.rows(pd.Series(["c", "z", "a"])).tolist() == [2, -1, 0]
+    merged = pd.concat(merge_price_chunks(index, chunks(PRICES, 2)), ignore_index=True)
+    assert merged["name"].tolist() == ["Bolt", "Angel", "Angel", "Guild", "Bolt"]
+    with pytest.raises(ValueError, match="not unique"):
+        CardIndex(pd.concat([CARDS, CARDS.iloc[:1]]))
+    with pytest.raises(ValueError, match="Unknown join type"):
+        list(merge_price_chunks(CARDS, [], how="outer"))
+
+
+def test_merged_price_file_matches_pandas(tmp_path):
+    path = tmp_path / "cardPrices.csv"
+    PRICES.assign(date="2024-01-01").to_csv(path, index=False)
+    expected = pd.read_csv(path).merge(CARDS, on="uuid")
+    merged = pd.concat(iter_merged_prices(CARDS, path=str(path), columns=["uuid", "price"], chunksize=2), ignore_index=True)
+    pd.testing.assert_frame_equal(merged, expected.drop(columns="date"), check_dtype=False)
+    # Starting at the byte offset of a later line gives the remaining rows
+    with open(path, "rb") as file:
+        offset = len(file.readline()) + len(file.readline())
+    rest = pd.concat(iter_price_chunks(str(path), ["uuid", "price"], 2, offset), ignore_index=True)
+    assert rest["uuid"].tolist() == PRICES["uuid"].tolist()[1:]
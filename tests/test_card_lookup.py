@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from card_bitmasks import add_bitmask_columns
+from card_lookup import CardLookup, PhraseMatcher, split_camel_case
+
+CARDS = pd.DataFrame({
+    "name": ["Angel of Mercy", "Ancestor's Chosen", "Angel of Mercy", "Mana Leak"],
+    "manaCost": ["{4}{W}", "{5}{W}{W}", "{9}", "{1}{U}"],
+    "rarity": ["uncommon", "uncommon", "rare", "common"],
+    "power": [3.0, 4.0, 3.0, np.nan],
+    "colors": ["W", "W", "W", "U"],
+})
+
+
+@pytest.fixture(scope="module")
+def lookup():
+    return CardLookup(add_bitmask_columns(CARDS.copy()))
+
+
+def test_phrase_matcher_finds_overlapping_phrases():
+    matcher = PhraseMatcher({("mana",): "mana", ("mana", "cost"): "manaCost", ("cost",): "cost"})
+    assert sorted(matcher.find_all("what mana cost".split())) == [(1, 2, "mana"), (1, 3, "manaCost"), (2, 3, "cost")]
+    assert matcher.find_longest("what mana cost".split()) == (1, 3, "manaCost")
+    assert matcher.find_longest("nothing here".split()) is None
+
+
+def test_split_camel_case():
+    assert split_camel_case("manaCost") == "mana Cost"
+    assert split_camel_case("colorIdentity") == "color Identity"
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("What is the manaCost of Angel of Mercy?", "{4}{W}"),
+    ("whats the mana cost of angel of mercy", "{4}{W}"),
+    ("rarity of Ancestor's Chosen", "uncommon"),
+    ("ancestors chosen how rare", "uncommon"),
+    ("Mana Leak cost", "{1}{U}"),
+    ("What is the power of Angel of Mercy?", "3.0"),
+])
+def test_answers(lookup, question, expected):
+    assert lookup.answer(question) == expected
+
+
+def test_unknown_questions(lookup):
+    # Missing value, unknown card, no attribute, bitmask columns are not offered
+    assert lookup.parse("power of Mana Leak") == ("Mana Leak", "power")
+    assert lookup.answer("power of Mana Leak") is None
+    assert lookup.answer("rarity of Lightning Bolt") is None
+    assert lookup.answer("tell me about Angel of Mercy") is None
+    assert "colorsMask" not in lookup.columns
+
+
+def test_attribute_inside_the_card_name_is_not_used(lookup):
+    # "Mana" belongs to the card name "Mana Leak", so there is no attribute left
+    assert lookup.parse("Mana Leak") is None
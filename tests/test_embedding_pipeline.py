@@ -0,0 +1,73 @@
+import json
+
+import numpy as np
+import pytest
+
+import embedding_pipeline
+from conftest import FakeSentenceModel, fake_encode
+from embedding_pipeline import encode_corpus
+from model_bundle import load_bundle, save_bundle
+
+
+@pytest.fixture
+def questions_file(tmp_path, monkeypatch):
+    monkeypatch.setattr("model_bundle.load_encoder", FakeSentenceModel)
+    questions = [f"What is the {'rarity' * (i % 4 + 1)} of Card {i}?" for i in range(95)]
+    path = tmp_path / "questions.jsonl"
+    with open(path, "w", encoding="utf-8") as file:
+        for i, question in enumerate(questions):
+            file.write(json.dumps({"question": question, "answer": f"a{i % 6}"}) + "\n")
+    return path, questions
+
+
+def test_rows_stay_in_file_order(tmp_path, questions_file):
+    path, questions = questions_file
+    embeddings = encode_corpus(str(path), str(tmp_path / "embeddings.npy"), "fake", chunk_size=10, window_chunks=3)
+    np.testing.assert_array_equal(np.asarray(embeddings), fake_encode(questions))
+
+
+def test_interrupted_run_is_resumed(tmp_path, questions_file, monkeypatch):
+    path, questions = questions_file
+    output = str(tmp_path / "embeddings.npy")
+    encode_chunk = embedding_pipeline._encode_chunk
+
+    def failing(chunk_id, *arguments):
+        if chunk_id == 4:
+            raise RuntimeError("crash")
+        return encode_chunk(chunk_id, *arguments)
+
+    monkeypatch.setattr(embedding_pipeline, "_encode_chunk", failing)
+    with pytest.raises(RuntimeError):
+        encode_corpus(str(path), output, "fake", chunk_size=10)
+    encoded = []
+    monkeypatch.setattr(embedding_pipeline, "_encode_chunk", lambda chunk_id, *arguments: encoded.append(chunk_id) or encode_chunk(chunk_id, *arguments))
+    embeddings = encode_corpus(str(path), output, "fake", chunk_size=10)
+    assert encoded == list(range(4, 10))
+    np.testing.assert_array_equal(np.asarray(embeddings), fake_encode(questions))
+
+
+def test_changed_question_file_is_not_resumed(tmp_path, questions_file):
+    path, _ = questions_file
+    output = str(tmp_path / "embeddings.npy")
+    encode_corpus(str(path), output, "fake", chunk_size=10)
+    # Same number of questions, other content
+    text = path.read_text(encoding="utf-8").replace("Card 1?", "Card one?")
+    path.write_text(text, encoding="utf-8")
+    with pytest.raises(ValueError):
+        encode_corpus(str(path), output, "fake", chunk_size=10)
+
+
+def test_worker_build_streams_the_question_file(tmp_path, questions_file, run_train_model, monkeypatch):
+    path, questions = questions_file
+    answers = [f"a{i % 6}" for i in range(len(questions))]
+
+    def load_questions(path):
+        raise AssertionError("the --workers build must not load the whole question file")
+
+    monkeypatch.setattr("train_model.load_questions", load_questions)
+    run_train_model(questions, answers, "--output", "bundle", "--workers", "1", "--chunk-size", "10", "--shards", "2")
+    expected = save_bundle(tmp_path / "expected", "fake", fake_encode(questions), questions, answers, shards=2)
+    bundle = load_bundle(tmp_path / "bundle", shard_processes=False)
+    assert bundle.version == expected["build_hash"]
+    # Only the bundle is left, the temporary question table and embeddings are removed
+    assert sorted(entry.name for entry in tmp_path.iterdir() if entry.name.startswith("bundle")) == ["bundle"]
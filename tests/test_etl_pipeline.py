@@ -0,0 +1,167 @@
+import importlib
+import sys
+import textwrap
+
+import pytest
+
+from etl_pipeline import Pipeline, code_key, format_report
+
+HELPER = """
+OFFSET = {offset}
+
+
+def shift(value):
+    return value + OFFSET
+"""
+
+STAGES = """
+import stage_helper
+
+FACTOR = {factor}
+
+
+def scale(value):
+    return value * FACTOR
+
+
+def unrelated():
+    return {unrelated}
+
+
+def read_numbers(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return [int(line) for line in file]
+
+
+def total(numbers, extra=0):
+    return sum(scale(number) for number in numbers) + extra
+
+
+def shifted(numbers):
+    return [stage_helper.shift(number) for number in numbers]
+
+
+def write_plot(numbers, path):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(str(numbers))
+    return len(numbers)
+"""
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """
+    A project directory with a stage module and a helper module it imports; write() rewrites
+    them and imports the new code.
+    """
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    (tmp_path / "numbers.txt").write_text("1\n2\n3\n", encoding="utf-8")
+
+    def write(factor=2, offset=10, unrelated=0):
+        (tmp_path / "stage_helper.py").write_text(textwrap.dedent(HELPER.format(offset=offset)), encoding="utf-8")
+        (tmp_path / "stage_module.py").write_text(textwrap.dedent(STAGES.format(factor=factor, unrelated=unrelated)), encoding="utf-8")
+        importlib.invalidate_caches()
+        for name in ("stage_helper", "stage_module"):
+            sys.modules.pop(name, None)
+        return importlib.import_module("stage_module")
+
+    yield tmp_path, write
+    for name in ("stage_helper", "stage_module"):
+        sys.modules.pop(name, None)
+
+
+def make_pipeline(directory, module, extra=0):
+    pipeline = Pipeline(str(directory / "cache"), workers=2)
+    pipeline.add("numbers", module.read_numbers, sources=[str(directory / "numbers.txt")], path=str(directory / "numbers.txt"))
+    pipeline.add("total", module.total, inputs=["numbers"], extra=extra)
+    pipeline.add("shifted", module.shifted, inputs=["numbers"])
+    pipeline.add("plot", module.write_plot, inputs=["numbers"], outputs=[str(directory / "plots" / "numbers.txt")], path=str(directory / "plots" / "numbers.txt"))
+    return pipeline
+
+
+def statuses(report):
+    return {row["stage"]: row["status"] for row in report}
+
+
+def test_second_run_comes_from_the_cache(project):
+    directory, write = project
+    module = write()
+    results, report = make_pipeline(directory, module).run()
+    assert results == {"numbers": [1, 2, 3], "total": 12, "shifted": [11, 12, 13], "plot": 3}
+    assert set(statuses(report).values()) == {"ran"}
+
+    results, report = make_pipeline(directory, module).run()
+    assert results["total"] == 12 and results["shifted"] == [11, 12, 13]
+    assert set(statuses(report).values()) == {"cached"}
+    assert "0 of 4 stages ran" in format_report(report)
+
+
+def test_only_affected_stages_run_again(project):
+    directory, write = project
+    module = write()
+    make_pipeline(directory, module).run()
+
+    # Another param: only that stage
+    _, report = make_pipeline(directory, module, extra=1).run()
+    assert statuses(report) == {"numbers": "cached", "total": "ran", "shifted": "cached", "plot": "cached"}
+    # Another source file: the stage reading it and everything after it
+    (directory / "numbers.txt").write_text("1\n2\n3\n4\n", encoding="utf-8")
+    results, report = make_pipeline(directory, module, extra=1).run()
+    assert set(statuses(report).values()) == {"ran"}
+    assert results["total"] == 21
+    # A missing output file
+    (directory / "plots" / "numbers.txt").unlink()
+    _, report = make_pipeline(directory, module, extra=1).run()
+    assert statuses(report) == {"numbers": "cached", "total": "cached", "shifted": "cached", "plot": "ran"}
+
+
+def test_forced_and_single_targets(project):
+    directory, write = project
+    module = write()
+    make_pipeline(directory, module).run()
+    results, report = make_pipeline(directory, module).run(force=["total"])
+    assert statuses(report) == {"numbers": "cached", "total": "ran", "shifted": "cached", "plot": "cached"}
+    # Only the targets are returned, their cached inputs are not even read
+    results, report = make_pipeline(directory, module).run(["shifted"], force=["shifted"])
+    assert results == {"shifted": [11, 12, 13]}
+    assert statuses(report) == {"numbers": "cached", "shifted": "ran"}
+    with pytest.raises(ValueError, match="Unknown stages"):
+        make_pipeline(directory, module).run(["missing"])
+
+
+def test_code_key_follows_the_code_a_stage_runs(project):
+    _, write = project
+    module = write()
+    keys = {name: code_key(getattr(module, name)) for name in ("total", "shifted", "read_numbers")}
+
+    # A constant read by a called function of the same module
+    module = write(factor=3)
+    assert code_key(module.total) != keys["total"]
+    assert code_key(module.read_numbers) == keys["read_numbers"]
+    # A function of the same module that is not called
+    module = write(unrelated=1)
+    assert code_key(module.total) == keys["total"]
+    # Any change of an imported project module
+    module = write(offset=20)
+    assert code_key(module.shifted) != keys["shifted"]
+    assert code_key(module.total) == keys["total"]
+
+
+def test_changed_code_runs_the_stage_again(project):
+    directory, write = project
+    make_pipeline(directory, write()).run()
+    results, report = make_pipeline(directory, write(offset=20)).run()
+    assert results["shifted"] == [21, 22, 23]
+    assert statuses(report) == {"numbers": "cached", "total": "cached", "shifted": "ran", "plot": "cached"}
+
+
+def test_stages_need_known_inputs(project):
+    directory, write = project
+    pipeline = Pipeline(str(directory / "cache"))
+    module = write()
+    with pytest.raises(ValueError, match="unknown stages"):
+        pipeline.add("total", module.total, inputs=["numbers"])
+    pipeline.add("numbers", module.read_numbers, path=str(directory / "numbers.txt"))
+    with pytest.raises(ValueError, match="already exists"):
+        pipeline.add("numbers", module.read_numbers)
@@ -0,0 +1,63 @@
+import json
+
+import pandas as pd
+
+from generate_questions import DEFAULT_TEMPLATE, generate_question_frame, iter_question_chunks, paraphrase, split_question
+from question_io import iter_question_records, write_questions
+
+CARDS = pd.DataFrame({
+    "name": ["Angel of Mercy", "Ancestor's Chosen", "Abundance"],
+    "colors": ["W", None, "G"],
+    "manaCost": ["{4}{W}", "{5}{W}{W}", None],
+    "rarity": ["uncommon", "uncommon", "rare"],
+})
+
+
+def test_question_frame_matches_a_row_loop():
+    expected = [
+        (DEFAULT_TEMPLATE.format(column=column, name=row["name"]), str(row[column]))
+        for _, row in CARDS.iterrows()
+        for column in CARDS.columns
+        if pd.notna(row[column])
+    ]
+    frame = generate_question_frame(CARDS)
+    assert list(zip(frame["question"], frame["answer"])) == expected
+
+
+def test_templates_keep_the_phrasings_of_one_value_together():
+    frame = generate_question_frame(CARDS, ["rarity"], [DEFAULT_TEMPLATE, "{name} {column}"])
+    assert frame["question"].tolist()[:2] == ["What is the rarity of Angel of Mercy?", "Angel of Mercy rarity"]
+
+
+def test_split_and_paraphrase():
+    assert split_question("What is the manaCost of Angel of Mercy?") == ("Angel of Mercy", "manaCost")
+    assert split_question("angel of mercy manacost") is None
+    assert "manacost of Angel of Mercy" in paraphrase("What is the manaCost of Angel of Mercy?")
+
+
+def test_chunks_from_the_card_file_with_limit(tmp_path):
+    path = tmp_path / "cards.csv"
+    CARDS.assign(uuid=["a", "b", "c"]).to_csv(path, index=False)
+    chunks = list(iter_question_chunks(str(path), ["rarity", "colors"], chunksize=2, limit=4))
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+    assert pd.concat(chunks)["column"].tolist() == ["rarity", "colors", "rarity", "rarity"]
+
+
+def test_output_is_written_while_the_input_is_read(tmp_path):
+    for name in ("questions.jsonl", "questions.json"):
+        path = tmp_path / name
+        seen = []
+
+        def chunks():
+            for position in range(3):
+                if position:
+                    # Everything of the previous chunks is already in the file
+                    seen.append(f"question {position - 1}" in path.read_text(encoding="utf-8"))
+                yield pd.DataFrame({"question": [f"question {position}"], "answer": [str(position)]})
+
+        assert write_questions(chunks(), str(path)) == 3
+        assert seen == [True, True]
+        records = list(iter_question_records(str(path)))
+        assert records == [{"question": f"question {i}", "answer": str(i)} for i in range(3)]
+    # The old layout is still what json.dump writes
+    assert json.loads((tmp_path / "questions.json").read_text(encoding="utf-8"))["answers"] == ["0", "1", "2"]
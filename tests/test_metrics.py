@@ -0,0 +1,69 @@
+import os
+import time
+
+from metrics import Registry, SlowCallProfiler
+
+
+def test_counter_and_gauge_render_in_prometheus_format():
+    registry = Registry()
+    answers = registry.counter("answers_total", "Answers by source", ("source",))
+    answers.inc(source="model")
+    answers.inc(2, source="cache")
+    answers.inc(source="model")
+    registry.gauge("cache_entries", "Entries", lambda: {"answers": 3, "embeddings": 1.5}, label="cache")
+    registry.gauge("missing", "Not known yet", lambda: None)
+    assert registry.render() == (
+        "# HELP answers_total Answers by source\n"
+        "# TYPE answers_total counter\n"
+        'answers_total{source="cache"} 2\n'
+        'answers_total{source="model"} 2\n'
+        "# HELP cache_entries Entries\n"
+        "# TYPE cache_entries gauge\n"
+        'cache_entries{cache="answers"} 3\n'
+        'cache_entries{cache="embeddings"} 1.5\n'
+        "# HELP missing Not known yet\n"
+        "# TYPE missing gauge\n"
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    sizes = registry.histogram("batch_size", "Batch sizes", buckets=(1, 4))
+    for value in (1, 2, 4, 9):
+        sizes.observe(value)
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'batch_size_bucket{le="1.0"} 1',
+        'batch_size_bucket{le="4.0"} 3',
+        'batch_size_bucket{le="+Inf"} 4',
+        "batch_size_sum 16.0",
+        "batch_size_count 4",
+    ]
+
+
+def test_registering_twice_keeps_the_first_metric():
+    registry = Registry()
+    first = registry.counter("requests_total", "Requests")
+    first.inc()
+    assert registry.counter("requests_total", "Requests") is first
+    assert "requests_total 1" in registry.render()
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("errors_total", "Errors", ("message",)).inc(message='a "b"\\\n')
+    assert 'errors_total{message="a \\"b\\"\\\\\\n"} 1' in registry.render()
+
+
+def test_slow_calls_are_written_and_old_profiles_removed(tmp_path):
+    profiler = SlowCallProfiler(threshold=0.0, sample_rate=1.0, directory=str(tmp_path), keep=2)
+    for _ in range(3):
+        assert profiler.call(lambda value: value * 2, 21) == 42
+        time.sleep(0.001)
+    assert profiler.written == 3
+    assert len(os.listdir(tmp_path)) == 2
+    # Fast calls and calls outside the sample are not written
+    fast = SlowCallProfiler(threshold=60.0, sample_rate=1.0, directory=str(tmp_path / "fast"))
+    unsampled = SlowCallProfiler(threshold=0.0, sample_rate=0.0, directory=str(tmp_path / "unsampled"))
+    assert fast.call(sum, [1, 2]) == unsampled.call(sum, [1, 2]) == 3
+    assert fast.written == unsampled.written == 0
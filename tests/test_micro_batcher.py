@@ -0,0 +1,81 @@
+import queue
+import threading
+
+import pytest
+
+from micro_batcher import MicroBatcher
+
+
+def submit_all(batcher, items):
+    results = [None] * len(items)
+    errors = [None] * len(items)
+
+    def submit(position):
+        try:
+            results[position] = batcher.submit(items[position], timeout=5)
+        except Exception as error:
+            errors[position] = error
+
+    threads = [threading.Thread(target=submit, args=(position,)) for position in range(len(items))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_items_are_batched_and_answered_in_order():
+    batches = []
+
+    def handler(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(handler, max_batch_size=8, max_wait=0.2)
+    results, errors = submit_all(batcher, list(range(20)))
+    assert errors == [None] * 20
+    assert results == [item * 2 for item in range(20)]
+    assert sum(len(batch) for batch in batches) == 20
+    assert max(len(batch) for batch in batches) <= 8
+    assert len(batches) < 20
+
+
+def test_handler_errors_reach_every_caller():
+    def handler(items):
+        raise ValueError("broken")
+
+    results, errors = submit_all(MicroBatcher(handler, max_wait=0.05), ["a", "b", "c"])
+    assert all(isinstance(error, ValueError) for error in errors)
+
+
+def test_too_few_results_fail_instead_of_hanging():
+    def handler(items):
+        return items[:-1]
+
+    batcher = MicroBatcher(handler, max_batch_size=4, max_wait=0.2)
+    results, errors = submit_all(batcher, ["a", "b", "c"])
+    assert all(isinstance(error, RuntimeError) for error in errors)
+
+
+def test_full_queue_is_rejected():
+    started, release = threading.Event(), threading.Event()
+
+    def handler(items):
+        started.set()
+        release.wait(5)
+        return items
+
+    batcher = MicroBatcher(handler, max_batch_size=1, max_wait=0, max_queue_size=1)
+    running = threading.Thread(target=batcher.submit, args=("running",))
+    running.start()
+    # The worker is busy with the first item, the second one fills the queue
+    assert started.wait(5)
+    waiting = threading.Thread(target=batcher.submit, args=("waiting",))
+    waiting.start()
+    while not batcher.queue_size():
+        pass
+    with pytest.raises(queue.Full):
+        batcher.submit("rejected")
+    release.set()
+    running.join()
+    waiting.join()
@@ -0,0 +1,66 @@
+from collections import Counter
+
+import pytest
+
+from conftest import fake_encode as encode
+from model_bundle import load_bundle, read_manifest, save_bundle, update_bundle
+
+
+def live_pairs(bundle):
+    return Counter(
+        (question, answer)
+        for question, answer, deleted in zip(bundle.questions, bundle.answers, bundle.deleted)
+        if not deleted
+    )
+
+
+def top_answers(bundle, questions):
+    indices = bundle.index.kneighbors(encode(questions), n_neighbors=1, return_distance=False)
+    return [bundle.answers[row] for row in indices[:, 0]]
+
+
+@pytest.mark.parametrize("compact_threshold", [1.0, 0.0])
+@pytest.mark.parametrize("shards", [1, 3])
+def test_update_matches_full_rebuild(tmp_path, compact_threshold, shards):
+    old_questions = [f"What is the rarity of Card {i}?" for i in range(60)]
+    old_answers = [f"rarity {i}" for i in range(60)]
+    save_bundle(tmp_path / "updated", "test-model", encode(old_questions), old_questions, old_answers, shards=shards)
+
+    # Drop some pairs, change an answer and add new questions
+    questions = old_questions[10:] + [f"What is the power of Card {i}?" for i in range(20)]
+    answers = old_answers[10:] + [str(i) for i in range(20)]
+    answers[0] = "changed"
+    manifest, stats = update_bundle(
+        tmp_path / "updated", questions, answers, encode, batch_size=7, compact_threshold=compact_threshold,
+    )
+    save_bundle(tmp_path / "rebuilt", "test-model", encode(questions), questions, answers, shards=shards)
+
+    updated = load_bundle(tmp_path / "updated", shard_processes=False)
+    rebuilt = load_bundle(tmp_path / "rebuilt", shard_processes=False)
+    assert live_pairs(updated) == live_pairs(rebuilt)
+    assert top_answers(updated, questions) == top_answers(rebuilt, questions) == answers
+    # Only the new question texts were encoded, the changed answer reuses its stored embedding
+    assert stats["added"] == 21 and stats["encoded"] == 20
+    assert stats["compacted"] == (compact_threshold == 0.0)
+    assert manifest["count"] == (len(questions) if stats["compacted"] else 81)
+
+
+@pytest.mark.parametrize("kind, options", [("ivf", {"n_lists": 4, "n_probe": 2}), ("int8", {"rerank": 5})])
+def test_incremental_training_keeps_the_index(tmp_path, run_train_model, kind, options):
+    questions = [f"What is the rarity of Card {i}?" for i in range(40)]
+    answers = [f"rarity {i}" for i in range(40)]
+    save_bundle(tmp_path / "bundle", "fake", encode(questions), questions, answers, kind, options)
+    run_train_model(questions + ["What is the power of Card 1?"], answers + ["2"], "--output", "bundle", "--incremental")
+
+    index = read_manifest(tmp_path / "bundle")["index"]
+    assert index["kind"] == kind
+    assert all(index["options"][name] == value for name, value in options.items())
+    assert load_bundle(tmp_path / "bundle", shard_processes=False).index.kind == kind
+
+
+def test_incremental_training_changes_the_index_when_asked(tmp_path, run_train_model):
+    questions = [f"What is the rarity of Card {i}?" for i in range(40)]
+    answers = [f"rarity {i}" for i in range(40)]
+    save_bundle(tmp_path / "bundle", "fake", encode(questions), questions, answers, "ivf")
+    run_train_model(questions, answers, "--output", "bundle", "--incremental", "--index", "float16")
+    assert read_manifest(tmp_path / "bundle")["index"]["kind"] == "float16"
@@ -0,0 +1,73 @@
+import pytest
+
+from name_resolver import NameResolver, allowed_edits, deletes, edit_distance
+
+NAMES = ["Angel of Mercy", "Angel of Serenity", "Ancestor's Chosen", "The Wandering Emperor", "Mana Leak", "Ox"]
+
+
+@pytest.fixture(scope="module")
+def resolver():
+    return NameResolver(NAMES)
+
+
+@pytest.mark.parametrize("first, second, distance", [
+    ("mercy", "mercy", 0), ("mercy", "merci", 1), ("angel", "angle", 1), ("angel", "agnle", 2),
+    ("chosen", "chsen", 1), ("serenity", "srenety", 2), ("leak", "lake", 2),
+])
+def test_edit_distance(first, second, distance):
+    assert edit_distance(first, second, 3) == distance
+    assert edit_distance(second, first, 3) == distance
+
+
+def test_edit_distance_stops_at_the_limit():
+    assert edit_distance("mercy", "serenity", 1) == 2
+    assert edit_distance("a", "abcdef", 2) == 3
+
+
+def test_deletes():
+    assert deletes("abc", 1) == {"abc", "bc", "ac", "ab"}
+    assert allowed_edits(3) == 0 and allowed_edits(5) == 1 and allowed_edits(9) == 2
+
+
+def test_word_candidates_match_a_full_comparison(resolver):
+    # The deletion dictionary finds exactly the words a comparison against every word would find
+    for word in ["merci", "angle", "chsen", "srenety", "leek", "emperer", "ox", "ancestors", "mana"]:
+        limit = allowed_edits(len(word))
+        expected = {
+            known: edit_distance(word, known, limit) for known in resolver.vocabulary
+            if known == word or (limit and allowed_edits(len(known)) and edit_distance(word, known, limit) <= limit)
+        }
+        assert resolver.word_candidates(word) == expected
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("What is the rarity of Angle of Mercy?", "what is the rarity of Angel of Mercy"),
+    ("manacost of angel mercy", "manacost of Angel of Mercy"),
+    ("ancestor chosen rarity", "Ancestor's Chosen rarity"),
+    ("rarity of wandering emperor", "rarity of The Wandering Emperor"),
+    ("power of angel of serentiy", "power of Angel of Serenity"),
+])
+def test_misspelled_names_are_corrected(resolver, question, expected):
+    assert resolver.correct(question) == expected
+
+
+@pytest.mark.parametrize("question", [
+    "What is the rarity of Angel of Mercy?",
+    "What is the rarity of Mana Leak?",
+    "What is the weather like?",
+    # Short words are never corrected, they would match almost anything
+    "rarity of ux",
+])
+def test_questions_without_a_typo_are_kept(resolver, question):
+    assert resolver.correct(question) == question
+
+
+def test_longest_name_wins(resolver):
+    assert resolver.find("rarity of angel of mercy")[0] == "Angel of Mercy"
+    assert resolver.find("what about angel") is None
+    assert len(resolver) == len(NAMES)
+
+
+def test_a_single_word_is_not_enough_for_a_left_out_word(resolver):
+    # "emperor" alone is no card name, only with "wandering" may the leading "The" be left out
+    assert resolver.find("rarity of emperor") is None
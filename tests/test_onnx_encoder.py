@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from onnx_encoder import CONFIG_FILE, MODEL_FILE, QUANTIZED_FILE, check_parity, export_path, onnx_loader, parity
+
+VOCABULARY = {"[PAD]": 0, "[UNK]": 1, "angel": 2, "of": 3, "mercy": 4}
+# Token embeddings of the tiny model, the transformer just looks them up
+TABLE = np.array([[9, 9, 9], [0, 0, 1], [1, 0, 0], [0, 1, 0], [1, 1, 0]], dtype=np.float32)
+
+
+def normalized(rows):
+    rows = np.asarray(rows, dtype=np.float32)
+    return rows / np.linalg.norm(rows, axis=-1, keepdims=True)
+
+
+@pytest.fixture
+def export(tmp_path):
+    """
+    Writes an export in the layout of export_onnx: a tokenizer, a model returning one vector per
+    token and the encoder config.
+    """
+    tokenizers = pytest.importorskip("tokenizers")
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import Whitespace
+
+    tokenizer = tokenizers.Tokenizer(WordLevel(VOCABULARY, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    tokenizer.save(str(tmp_path / "tokenizer.json"))
+    config = {
+        "model_name": "tiny", "max_seq_length": 8, "pad_token": "[PAD]", "pad_id": 0,
+        "inputs": ["input_ids"], "normalize": True, "dimension": 3, "parity": {},
+    }
+    (tmp_path / CONFIG_FILE).write_text(json.dumps(config), encoding="utf-8")
+    return tmp_path
+
+
+def write_model(path):
+    onnx = pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    from onnx import TensorProto, helper, numpy_helper
+
+    graph = helper.make_graph(
+        [helper.make_node("Gather", ["table", "input_ids"], ["last_hidden_state"], axis=0)],
+        "tiny",
+        [helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["batch", "sequence"])],
+        [helper.make_tensor_value_info("last_hidden_state", TensorProto.FLOAT, ["batch", "sequence", 3])],
+        [numpy_helper.from_array(TABLE, name="table")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 14)])
+    model.ir_version = 8
+    onnx.save(model, str(path / MODEL_FILE))
+
+
+def set_parity(path, results):
+    config = json.loads((path / CONFIG_FILE).read_text(encoding="utf-8"))
+    config["parity"] = results
+    (path / CONFIG_FILE).write_text(json.dumps(config), encoding="utf-8")
+
+
+def test_export_path():
+    assert export_path("onnx_models", "sentence-transformers/all-MiniLM-L6-v2/") == os.path.join("onnx_models", "sentence-transformers__all-MiniLM-L6-v2")
+
+
+def test_parity():
+    result = parity([[1, 0], [0, 1]], [[2, 0], [1, 1]])
+    assert result["max_distance"] == pytest.approx(1 - np.sqrt(0.5))
+    assert result["mean_distance"] == pytest.approx((1 - np.sqrt(0.5)) / 2)
+
+
+def test_loader_needs_an_export(tmp_path):
+    with pytest.raises(FileNotFoundError, match="--backend onnx"):
+        onnx_loader(str(tmp_path))("sentence-transformers/missing")
+
+
+def test_int8_model_is_only_used_after_passing_the_parity_check(export):
+    from onnx_encoder import OnnxEncoder
+
+    (export / QUANTIZED_FILE).write_bytes(b"")
+    assert not OnnxEncoder(str(export)).quantized
+    set_parity(export, {QUANTIZED_FILE: {"passed": True}})
+    assert OnnxEncoder(str(export)).quantized
+    set_parity(export, {QUANTIZED_FILE: {"passed": False}})
+    assert not OnnxEncoder(str(export)).quantized
+    with pytest.raises(ValueError, match="parity check"):
+        OnnxEncoder(str(export), quantized=True)
+
+
+def test_mean_pooling_ignores_padding(export):
+    from onnx_encoder import OnnxEncoder
+
+    write_model(export)
+    encoder = OnnxEncoder(str(export))
+    embeddings = encoder.encode(["angel of mercy", "angel", "unknown word"], batch_size=2)
+    assert embeddings.shape == (3, 3) and embeddings.dtype == np.float32
+    np.testing.assert_allclose(embeddings, normalized([[2 / 3, 2 / 3, 0], [1, 0, 0], [0, 0, 1]]), atol=1e-6)
+    # The padded "angel" of the batch is the same as "angel" on its own
+    np.testing.assert_allclose(encoder.encode("angel"), embeddings[1], atol=1e-6)
+
+
+def test_check_parity_records_the_results(export):
+    write_model(export)
+    shutil.copy(export / MODEL_FILE, export / QUANTIZED_FILE)
+    sentences = ["angel of mercy", "mercy"]
+
+    class Reference:
+        def __init__(self, embeddings):
+            self.embeddings = embeddings
+
+        def encode(self, sentences):
+            return self.embeddings
+
+    results = check_parity(str(export), Reference(normalized([[2, 2, 0], [1, 1, 0]])), sentences)
+    assert results[MODEL_FILE]["passed"] and results[QUANTIZED_FILE]["passed"]
+    assert json.loads((export / CONFIG_FILE).read_text(encoding="utf-8"))["parity"][MODEL_FILE]["max_distance"] < 1e-6
+    with pytest.raises(ValueError, match="differ from PyTorch"):
+        check_parity(str(export), Reference(normalized([[0, 0, 1], [0, 0, 1]])), sentences)
@@ -0,0 +1,108 @@
+import os
+
+import pandas as pd
+import pytest
+
+from price_aggregates import AggregatesReloader, load_aggregates, refresh_aggregates
+
+CARDS = pd.DataFrame({
+    "uuid": ["a", "b", "c", "d"],
+    "name": ["Angel", "Bolt", "Guild", "Relic"],
+    "colors": ["W", "R", "W, U", None],
+    "rarity": ["rare", "common", "rare", "mythic"],
+    "frameVersion": ["2003", "1993", "2015", "future"],
+})
+
+PRICES = pd.DataFrame({
+    "cardFinish": "normal",
+    "currency": "USD",
+    "date": "2024-01-01",
+    "gameAvailability": "paper",
+    "price": [1.0, 3.0, 0.5, 10.0, 4.0, None, 7.0],
+    "priceProvider": "tcgplayer",
+    "providerListing": "retail",
+    "uuid": ["a", "a", "b", "c", "d", "b", "unknown"],
+})
+
+
+def write_prices(path, prices, header=True):
+    prices.to_csv(path, index=False, header=header, mode="w" if header else "a", lineterminator="\n")
+
+
+@pytest.fixture
+def files(tmp_path):
+    cards_path, prices_path = tmp_path / "cards.csv", tmp_path / "cardPrices.csv"
+    CARDS.to_csv(cards_path, index=False)
+    write_prices(prices_path, PRICES)
+    return str(cards_path), str(prices_path), str(tmp_path / "aggregates")
+
+
+def expected_average(prices, **filters):
+    # Reference: the merge the analysis did, multi-colored cards count once for every color
+    merged = prices.dropna(subset=["price"]).merge(CARDS, on="uuid")
+    merged["year"] = pd.to_numeric(merged["frameVersion"], errors="coerce")
+    if "color" in filters:
+        merged = merged.assign(color=merged["colors"].fillna("C").str.split(", ")).explode("color")
+    for column, value in filters.items():
+        merged = merged[merged[column] == value]
+    return merged["price"].mean()
+
+
+def test_averages_match_the_merged_prices(files):
+    cards_path, prices_path, path = files
+    aggregates, read = refresh_aggregates(path, cards_path, prices_path)
+    assert read == len(PRICES)
+    assert aggregates.query()["average"] == pytest.approx(expected_average(PRICES))
+    assert aggregates.query(color="white")["average"] == pytest.approx(expected_average(PRICES, color="W"))
+    assert aggregates.query(color="C")["average"] == pytest.approx(4.0)
+    assert aggregates.query(rarity="Rare", year="2003")["average"] == pytest.approx(2.0)
+    assert aggregates.query(color="G") == {"filters": {"color": "G"}, "average": None, "count": 0, "sum": 0.0}
+    assert aggregates.breakdown("year").to_dict() == {1993: 0.5, 2003: 2.0, 2015: 10.0}
+    assert aggregates.breakdown("color", rarity="rare").to_dict() == {"U": 10.0, "W": pytest.approx(14 / 3)}
+
+
+def test_appended_prices_are_added_incrementally(files):
+    cards_path, prices_path, path = files
+    refresh_aggregates(path, cards_path, prices_path)
+    appended = PRICES.iloc[:3].assign(price=[2.0, 6.0, 1.5])
+    write_prices(prices_path, appended, header=False)
+
+    aggregates, read = refresh_aggregates(path, cards_path, prices_path)
+    assert read == len(appended)
+    everything = pd.concat([PRICES, appended])
+    assert aggregates.query()["average"] == pytest.approx(expected_average(everything))
+    assert aggregates.state["prices"]["rows"] == len(everything)
+    # Same result as recomputing everything, and as the stored state
+    full, _ = refresh_aggregates(path, cards_path, prices_path, full=True)
+    assert full.cubes == aggregates.cubes
+    assert load_aggregates(path).cubes == aggregates.cubes
+
+
+def test_changed_prices_are_recomputed(files):
+    cards_path, prices_path, path = files
+    refresh_aggregates(path, cards_path, prices_path)
+    changed = PRICES.assign(price=PRICES["price"] * 2)
+    write_prices(prices_path, changed)
+
+    aggregates, read = refresh_aggregates(path, cards_path, prices_path)
+    assert read == len(changed)
+    assert aggregates.query()["average"] == pytest.approx(expected_average(changed))
+
+
+def test_reloader_picks_up_a_refresh(files):
+    cards_path, prices_path, path = files
+    reloader = AggregatesReloader(path)
+    assert reloader.get() is None
+
+    refresh_aggregates(path, cards_path, prices_path)
+    first = reloader.get()
+    assert first.query()["average"] == pytest.approx(expected_average(PRICES))
+    # Unchanged state file: the loaded aggregates are kept
+    assert reloader.get() is first
+
+    write_prices(prices_path, PRICES.iloc[:1].assign(price=[100.0]), header=False)
+    refresh_aggregates(path, cards_path, prices_path)
+    # The new state file may have the same size, a coarse file system clock may give it the same mtime
+    os.utime(os.path.join(path, "state.json"), ns=(0, 0))
+    assert reloader.get().query()["count"] == first.query()["count"] + 1
+    assert reloader.reloads == 2
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from conftest import fake_encode as encode
+from model_bundle import load_bundle, read_manifest, save_bundle
+from sharded_index import StaleBundleError, merge_neighbors
+from vector_index import build_index
+
+
+def make_entries(count, seed):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.normal(size=(count, 8)).astype(np.float32)
+    questions = [f"What is the rarity of Card {i}?" for i in range(count)]
+    answers = [f"answer {seed}-{i}" for i in range(count)]
+    return embeddings, questions, answers
+
+
+def test_shard_processes_match_in_process_search(tmp_path):
+    embeddings, questions, answers = make_entries(200, seed=0)
+    save_bundle(tmp_path / "bundle", "test-model", embeddings, questions, answers, shards=3)
+    queries = np.random.default_rng(1).normal(size=(5, 8)).astype(np.float32)
+
+    in_process = load_bundle(tmp_path / "bundle", shard_processes=False)
+    with_processes = load_bundle(tmp_path / "bundle", shard_processes=True)
+    try:
+        expected = in_process.index.kneighbors(queries, n_neighbors=4)
+        found = with_processes.index.kneighbors(queries, n_neighbors=4)
+    finally:
+        with_processes.index.close()
+    np.testing.assert_allclose(found[0], expected[0], rtol=1e-5)
+    np.testing.assert_array_equal(found[1], expected[1])
+
+
+def test_bundle_replaced_before_first_query_raises(tmp_path):
+    path = tmp_path / "bundle"
+    save_bundle(path, "test-model", *make_entries(200, seed=0), shards=3)
+    bundle = load_bundle(path, shard_processes=True)
+    # A new bundle is moved into place after the load but before the workers start
+    save_bundle(path, "test-model", *make_entries(150, seed=2), shards=3)
+    try:
+        with pytest.raises(StaleBundleError):
+            bundle.index.kneighbors(np.ones((1, 8), dtype=np.float32), n_neighbors=3)
+    finally:
+        bundle.index.close()
+    # The new bundle itself can be searched
+    reloaded = load_bundle(path, shard_processes=True)
+    try:
+        distances, indices = reloaded.index.kneighbors(np.ones((1, 8), dtype=np.float32), n_neighbors=3)
+    finally:
+        reloaded.index.close()
+    assert indices.shape == (1, 3) and indices.max() < 150
+
+
+def test_merge_neighbors_matches_one_index():
+    rng = np.random.default_rng(3)
+    vectors = rng.normal(size=(90, 8)).astype(np.float32)
+    # Duplicated rows give equal distances, the lower global row comes first as in one index
+    vectors[50] = vectors[10]
+    vectors[80] = vectors[10]
+    queries = np.vstack([vectors[10], rng.normal(size=(4, 8))]).astype(np.float32)
+    offsets = [0, 30, 70]
+    results = [
+        build_index("exact", vectors[start:stop]).kneighbors(queries, n_neighbors=6)
+        for start, stop in zip(offsets, offsets[1:] + [90])
+    ]
+    distances, indices = merge_neighbors(results, offsets, 6)
+    expected_distances, expected_indices = build_index("exact", vectors).kneighbors(queries, n_neighbors=6)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-6)
+    assert indices[0, :3].tolist() == [10, 50, 80]
+
+
+def test_shard_processes_match_in_process_search(tmp_path):
+    embeddings, questions, answers = make_entries(200, seed=0)
+    save_bundle(tmp_path / "bundle", "test-model", embeddings, questions, answers, shards=3)
+    queries = np.random.default_rng(1).normal(size=(5, 8)).astype(np.float32)
+
+    in_process = load_bundle(tmp_path / "bundle", shard_processes=False)
+    with_processes = load_bundle(tmp_path / "bundle", shard_processes=True)
+    try:
+        expected = in_process.index.kneighbors(queries, n_neighbors=4)
+        found = with_processes.index.kneighbors(queries, n_neighbors=4)
+    finally:
+        with_processes.index.close()
+    np.testing.assert_allclose(found[0], expected[0], rtol=1e-5)
+    np.testing.assert_array_equal(found[1], expected[1])
+
+
+def test_bundle_replaced_before_first_query_raises(tmp_path):
+    path = tmp_path / "bundle"
+    save_bundle(path, "test-model", *make_entries(200, seed=0), shards=3)
+    bundle = load_bundle(path, shard_processes=True)
+    # A new bundle is moved into place after the load but before the workers start
+    save_bundle(path, "test-model", *make_entries(150, seed=2), shards=3)
+    try:
+        with pytest.raises(StaleBundleError):
+            bundle.index.kneighbors(np.ones((1, 8), dtype=np.float32), n_neighbors=3)
+    finally:
+        bundle.index.close()
+    # The new bundle itself can be searched
+    reloaded = load_bundle(path, shard_processes=True)
+    try:
+        distances, indices = reloaded.index.kneighbors(np.ones((1, 8), dtype=np.float32), n_neighbors=3)
+    finally:
+        reloaded.index.close()
+    assert indices.shape == (1, 3) and indices.max() < 150
+
+
+def test_incremental_training_keeps_the_shards(tmp_path, run_train_model):
+    questions = [f"What is the rarity of Card {i}?" for i in range(60)]
+    answers = [f"rarity {i}" for i in range(60)]
+    save_bundle(tmp_path / "bundle", "fake", encode(questions), questions, answers, shards=3)
+    # Without --shards the bundle keeps its 3 shards
+    run_train_model(questions + ["What is the power of Card 1?"], answers + ["2"], "--output", "bundle", "--incremental")
+    assert len(read_manifest(tmp_path / "bundle")["index"]["shards"]) == 3
+    bundle = load_bundle(tmp_path / "bundle", shard_processes=False)
+    _, indices = bundle.index.kneighbors(encode(["What is the power of Card 1?"]), n_neighbors=1)
+    assert bundle.answers[indices[0, 0]] == "2"
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from sklearn.neighbors import NearestNeighbors
+
+from vector_index import ExactIndex, build_index, load_index, recall_at_k, sample_queries
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(500, 16)).astype(np.float32), rng.normal(size=(20, 16)).astype(np.float32)
+
+
+def sklearn_neighbors(embeddings, queries, k):
+    model = NearestNeighbors(n_neighbors=k, metric="cosine", algorithm="brute").fit(embeddings)
+    return model.kneighbors(queries)
+
+
+def test_exact_matches_sklearn(data):
+    embeddings, queries = data
+    expected_distances, expected_indices = sklearn_neighbors(embeddings, queries, 5)
+    distances, indices = build_index("exact", embeddings).kneighbors(queries, n_neighbors=5)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+
+
+def test_float16_is_close_to_sklearn(data):
+    # Rounding to float16 may swap near ties further down, the best match and the distances stay
+    embeddings, queries = data
+    expected_distances, expected_indices = sklearn_neighbors(embeddings, queries, 5)
+    distances, indices = build_index("float16", embeddings).kneighbors(queries, n_neighbors=5)
+    np.testing.assert_array_equal(indices[:, 0], expected_indices[:, 0])
+    np.testing.assert_allclose(distances, expected_distances, atol=2e-3)
+
+
+def test_ties_go_to_the_lower_row():
+    embeddings = np.array([[1, 0], [0, 1], [1, 0], [1, 0]], dtype=np.float32)
+    indices = ExactIndex(embeddings).kneighbors(np.array([[1, 0]], dtype=np.float32), n_neighbors=2, return_distance=False)
+    assert indices.tolist() == [[0, 2]]
+
+
+def test_sampled_queries_are_random_and_not_the_stored_rows(data):
+    embeddings, _ = data
+    index = ExactIndex(embeddings)
+    queries = sample_queries(index.vectors, 50, seed=1)
+    assert queries.shape == (50, 16)
+    np.testing.assert_allclose(np.linalg.norm(queries, axis=1), 1, atol=1e-5)
+    distances, _ = index.kneighbors(queries, n_neighbors=1)
+    assert (distances[:, 0] > 1e-4).all()
+    assert recall_at_k(index, index, queries, k=3) == 1.0
+    # Deleted rows are never sampled
+    deleted = np.ones(len(embeddings), dtype=bool)
+    deleted[:10] = False
+    assert len(sample_queries(index.vectors, 50, deleted)) == 10
+
+
+def test_deleted_rows_are_skipped(data):
+    embeddings, queries = data
+    deleted = np.zeros(len(embeddings), dtype=bool)
+    deleted[::3] = True
+    live = np.flatnonzero(~deleted)
+    expected_distances, expected_indices = sklearn_neighbors(embeddings[live], queries, 5)
+    distances, indices = build_index("exact", embeddings, deleted=deleted).kneighbors(queries, n_neighbors=5)
+    np.testing.assert_array_equal(indices, live[expected_indices])
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+
+
+@pytest.mark.parametrize("kind", ["exact", "ivf", "float16", "int8", "pq"])
+def test_save_and_load_give_the_same_neighbours(tmp_path, data, kind):
+    embeddings, queries = data
+    index = build_index(kind, embeddings)
+    index.save(str(tmp_path))
+    loaded = load_index(kind, str(tmp_path), index.vectors, index.options())
+    for expected, found in zip(index.kneighbors(queries, n_neighbors=3), loaded.kneighbors(queries, n_neighbors=3)):
+        np.testing.assert_array_equal(found, expected)
@@ -1,51 +1,181 @@
+import argparse
+import os
 import pickle
-import json
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.neighbors import KNeighborsClassifier
+from question_io import iter_question_batches, load_questions
+from embedding_pipeline import encode_corpus, remove_checkpoint
+from model_bundle import (
+    DEFAULT_BUNDLE_PATH, MANIFEST_FILE, load_bundle, load_encoder, read_manifest, remove_string_table, save_bundle, update_bundle,
+    write_question_columns,
+)
+from vector_index import INDEX_TYPES, ExactIndex, recall_at_k, sample_queries
+from answer_ranking import THRESHOLD, rank_candidates
+from onnx_encoder import DEFAULT_ONNX_DIR, check_parity, export_onnx, export_path
 
-# Load a pre-trained language model that understands sentence meaning
-sentence_model = SentenceTransformer("all-MiniLM-L6-v2")
 
-# Load the questions and answers from the JSON file
-with open("questions.json", "r", encoding="utf-8") as file:
-    data = json.load(file)
-    questions = data["questions"]
-    answers = data["answers"]
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the question answering model.")
+    parser.add_argument("--index", choices=sorted(INDEX_TYPES), default=None, help="Nearest-neighbour backend to build (default: exact, with --incremental the one of the existing bundle)")
+    parser.add_argument("--n-lists", type=int, default=None, help="Number of clusters for the ivf index")
+    parser.add_argument("--n-probe", type=int, default=8, help="Number of clusters scanned per query for the ivf index")
+    parser.add_argument("--rerank", type=int, default=0, help="Candidates re-ranked with exact vectors for the float16/int8/pq indexes")
+    parser.add_argument("--pq-subspaces", type=int, default=None, help="Number of subspaces (bytes per vector) for the pq index")
+    parser.add_argument("--shards", type=int, default=None, help="Split the index into this many shards by card name, searched in parallel by the app (default: 1, with --incremental as many as the existing bundle has)")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="Name or path of the sentence model")
+    parser.add_argument("--output", default=DEFAULT_BUNDLE_PATH, help="Directory of the model bundle to write")
+    parser.add_argument("--questions", default="questions.json", help="Question file (.json, .jsonl or .parquet)")
+    parser.add_argument("--incremental", action="store_true", help="Only encode new or changed questions and merge them into the existing bundle")
+    parser.add_argument("--batch-size", type=int, default=256, help="Number of new questions encoded at once in incremental mode")
+    parser.add_argument("--compact-threshold", type=float, default=0.2, help="Share of deleted rows after which the bundle is compacted")
+    parser.add_argument("--workers", type=int, default=0, help="Encode in chunks with this many worker processes (resumable after a crash)")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Number of questions per chunk when using --workers")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Torch threads per worker (default: cores / workers)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint of an interrupted --workers run")
+    parser.add_argument("--pickle", action="store_true", help="Also write the old question_model.pkl")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch", help="Encoder the app will use; onnx exports the sentence model for ONNX Runtime")
+    parser.add_argument("--quantize", action="store_true", help="Also export a dynamically int8-quantized ONNX model")
+    parser.add_argument("--onnx-dir", default=DEFAULT_ONNX_DIR, help="Directory of the ONNX exports")
+    parser.add_argument("--parity-samples", type=int, default=500, help="Questions used to compare ONNX and PyTorch embeddings")
+    return parser.parse_args()
 
-print(f"Loaded {len(questions)} questions and answers.")
 
-# Convert questions into sentence embeddings
-question_embeddings = sentence_model.encode(questions)
+def index_options_from_args(args):
+    # Every index type takes its own options; without --index an incremental run keeps the bundle's
+    if args.index is None:
+        return None
+    if args.index == "ivf":
+        return {"n_lists": args.n_lists, "n_probe": args.n_probe}
+    if args.index == "pq":
+        return {"n_subspaces": args.pq_subspaces, "rerank": args.rerank}
+    if args.index in ("float16", "int8"):
+        return {"rerank": args.rerank}
+    return {}
 
-# Train a KNN classifier on the embeddings
-clf = KNeighborsClassifier(n_neighbors=3, metric="cosine")
-clf.fit(question_embeddings, answers)
-
-# Save the trained model
-with open("question_model.pkl", "wb") as model_file:
-    pickle.dump((sentence_model, clf), model_file)
-
-print("Model has been trained and saved as 'question_model.pkl'.")
 
 # Function to predict answers
-def predict_answer(question):
+def predict_answer(sentence_model, clf, answers, question, questions=None, k=3):
     # Convert the input question to an embedding
     question_embedding = sentence_model.encode([question])
-    
-    # Get the closest match
-    distances, indices = clf.kneighbors(question_embedding, n_neighbors=3)
-    
-    # If the best match is too far, return a fallback response
-    if distances[0][0] > 0.5:  # Adjust threshold as needed
+
+    # Get the k closest matches (re-ranked by the card name if the questions are given)
+    ranked, nearest = rank_candidates(question_embedding, [question], clf, answers, questions, k=k, depth=10 if questions is not None else 0, return_nearest=True)
+    candidates = ranked[0]
+
+    # If even the closest match is too far, return a fallback response
+    if not candidates or nearest[0] > THRESHOLD:
         # Try to improvise by checking the next best matches
         improvise_answer = "I'm not entirely sure, but here's something related:"
-        related_answers = [answers[i] for i in indices[0]]
+        related_answers = [f"{candidate['answer']} ({candidate['score']:.2f})" for candidate in candidates]
         improvise_answer += " " + ", ".join(related_answers)
         return improvise_answer
-    
-    return answers[indices[0][0]]
 
-# Example usage
-user_question = "angel of mercy cost mana"
-print(f"Predicted answer: {predict_answer(user_question)}")
+    return candidates[0]["answer"]
+
+
+def main():
+    args = parse_args()
+
+    index_options = index_options_from_args(args)
+    manifest_path = os.path.join(args.output, MANIFEST_FILE)
+    incremental = args.incremental and os.path.exists(manifest_path) and read_manifest(args.output)["model_name"] == args.model
+    if args.incremental and not incremental:
+        print("No bundle for this sentence model yet, doing a full build.")
+
+    # Load the questions and answers from the question file (a --workers build streams it instead)
+    if incremental or not args.workers:
+        questions, answers = load_questions(args.questions)
+        print(f"Loaded {len(questions)} questions and answers.")
+
+    sentence_model = None
+
+    def encode(batch):
+        # The sentence model is only loaded once something actually has to be encoded
+        nonlocal sentence_model
+        if sentence_model is None:
+            sentence_model = load_encoder(args.model)
+        return sentence_model.encode(batch)
+
+    if incremental:
+        # Only encode new or changed questions and merge them into the existing bundle;
+        # index type, options and shards stay as they are unless they were given explicitly
+        manifest, stats = update_bundle(
+            args.output, questions, answers, encode, args.batch_size, args.compact_threshold, args.index, index_options, args.shards
+        )
+        print(
+            f"Kept {stats['kept']}, added {stats['added']} ({stats['encoded']} encoded), "
+            f"{stats['deleted']} tombstoned{', compacted' if stats['compacted'] else ''}."
+        )
+    elif args.workers:
+        # Stream the questions in chunks through worker processes into a memory-mapped file (resumable)
+        embeddings_path = args.output.rstrip("/\\") + ".embeddings.npy"
+        question_embeddings = encode_corpus(
+            args.questions, embeddings_path, args.model, args.chunk_size, args.workers, args.torch_threads,
+            resume=not args.restart,
+        )
+        # The questions are read again in chunks into a memory-mapped table next to the embeddings,
+        # the answers of the same chunks are interned, so no list of all strings is built
+        questions_prefix = args.output.rstrip("/\\") + ".questions"
+        questions, answers = write_question_columns(iter_question_batches(args.questions, args.chunk_size), questions_prefix)
+        print(f"Read {len(questions)} questions and answers.")
+        manifest = save_bundle(
+            args.output, args.model, question_embeddings, questions, answers, args.index or "exact", index_options, shards=args.shards or 1,
+        )
+        del question_embeddings, questions, answers
+        remove_string_table(questions_prefix)
+        remove_checkpoint(embeddings_path)
+    else:
+        # Convert questions into sentence embeddings
+        question_embeddings = encode(questions)
+
+        # Build the nearest-neighbour index and save everything as a model bundle
+        manifest = save_bundle(
+            args.output, args.model, question_embeddings, questions, answers, args.index or "exact", index_options, shards=args.shards or 1,
+        )
+
+    bundle = load_bundle(args.output, shard_processes=False)
+    clf = bundle.index
+    if sentence_model is None:
+        sentence_model = load_encoder(args.model)
+
+    print(f"Model bundle {manifest['build_hash']} has been saved to '{args.output}'.")
+
+    # Report how many of the exact neighbours an approximate (or sharded) index finds
+    if manifest["index"]["kind"] != "exact" or manifest["index"].get("shards"):
+        reference = ExactIndex(bundle.embeddings, normalized=True, deleted=bundle.deleted)
+        # Randomly chosen questions moved a little, a stored vector alone would always find itself
+        sample = sample_queries(bundle.embeddings, 1000, bundle.deleted)
+        print(
+            f"Recall@1: {recall_at_k(clf, reference, sample, k=1):.3f}, Recall@3: {recall_at_k(clf, reference, sample, k=3):.3f} "
+            f"({len(sample)} perturbed random questions)"
+        )
+
+    # Export the sentence model for ONNX Runtime and make sure it gives the same embeddings
+    if args.backend == "onnx":
+        onnx_path = export_path(args.onnx_dir, args.model)
+        export_onnx(args.model, onnx_path, quantize=args.quantize)
+        rows = np.linspace(0, len(bundle.questions) - 1, min(args.parity_samples, len(bundle.questions))).astype(int)
+        results = check_parity(onnx_path, sentence_model, [bundle.questions[row] for row in rows])
+        for name, result in results.items():
+            if name == "torch":
+                continue
+            print(
+                f"{name}: max distance to PyTorch {result['max_distance']:.4f}, mean {result['mean_distance']:.4f}, "
+                f"{result['seconds']:.2f}s vs {results['torch']['seconds']:.2f}s with PyTorch"
+                f"{'' if result['passed'] else ' (too far off, not used)'}"
+            )
+        print(f"ONNX encoder has been saved to '{onnx_path}', start the app with ENCODER_BACKEND=onnx.")
+
+    # Save the old single-file model if requested
+    if args.pickle:
+        with open("question_model.pkl", "wb") as model_file:
+            pickle.dump((sentence_model, clf), model_file)
+
+        print("Model has been trained and saved as 'question_model.pkl'.")
+
+    # Example usage
+    user_question = "angel of mercy cost mana"
+    print(f"Predicted answer: {predict_answer(sentence_model, clf, bundle.answers, user_question, bundle.questions)}")
+
+
+if __name__ == "__main__":
+    main()
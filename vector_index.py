@@ -0,0 +1,461 @@
+import os
+
+import numpy as np
+
+
+def normalize_rows(vectors):
+    """
+    Scales every row to unit length so that a dot product equals the cosine similarity.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def top_k(similarities, k):
+    """
+    Returns the indices and values of the k largest entries of every row, best first.
+
+    Ties are broken by the lower index, so different backends return the same order.
+    """
+    k = min(k, similarities.shape[1])
+    if k < similarities.shape[1]:
+        candidates = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        # argpartition picks any of several equal values at the k-th place, take the lowest indices instead
+        kth = np.take_along_axis(similarities, candidates, axis=1).min(axis=1)
+        tied = (similarities >= kth[:, None]).sum(axis=1) > k
+        for row in np.flatnonzero(tied):
+            greater = np.flatnonzero(similarities[row] > kth[row])
+            equal = np.flatnonzero(similarities[row] == kth[row])
+            candidates[row] = np.concatenate([greater, equal[:k - len(greater)]])
+    else:
+        candidates = np.broadcast_to(np.arange(similarities.shape[1]), similarities.shape)
+    values = np.take_along_axis(similarities, candidates, axis=1)
+    order = np.lexsort((candidates, -values), axis=1)
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+class ExactIndex:
+    """
+    Exact cosine nearest-neighbour search: one matrix multiplication plus argpartition.
+
+    Offers the same kneighbors() interface as sklearn's KNeighborsClassifier(metric="cosine"),
+    distances are cosine distances (1 - cosine similarity).
+
+    Parameters:
+    embeddings (np.ndarray): The stored question embeddings, one row per question.
+    normalized (bool): Set to True if the rows already have unit length (they are then used without copying).
+    deleted (np.ndarray): Optional boolean mask of rows that must never be returned (tombstones).
+    """
+
+    kind = "exact"
+
+    def __init__(self, embeddings, normalized=False, deleted=None):
+        self.vectors = embeddings if normalized else normalize_rows(embeddings)
+        self.deleted_rows = np.flatnonzero(deleted) if deleted is not None else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def options(self):
+        return {}
+
+    def save(self, directory):
+        # The vectors themselves are stored by the caller (model_bundle writes embeddings.npy)
+        pass
+
+    @classmethod
+    def load(cls, directory, vectors, options, deleted=None):
+        return cls(vectors, normalized=True, deleted=deleted)
+
+    def kneighbors(self, X, n_neighbors=1, return_distance=True):
+        queries = normalize_rows(X)
+        similarities = queries @ self.vectors.T
+        if self.deleted_rows.size:
+            similarities[:, self.deleted_rows] = -np.inf
+        indices, similarities = top_k(similarities, n_neighbors)
+        if not return_distance:
+            return indices
+        return 1.0 - similarities, indices
+
+
+class IVFIndex:
+    """
+    Approximate cosine search with an inverted file: the vectors are clustered with
+    spherical k-means and a query only scans the n_probe closest clusters.
+
+    Parameters:
+    embeddings (np.ndarray): The stored question embeddings, one row per question.
+    n_lists (int): Number of clusters (default: about the square root of the number of rows).
+    n_probe (int): Number of clusters scanned per query.
+    iterations (int): Number of k-means iterations.
+    seed (int): Seed for the k-means initialisation.
+    deleted (np.ndarray): Optional boolean mask of rows that are left out of the lists (tombstones).
+    """
+
+    kind = "ivf"
+
+    def __init__(self, embeddings, n_lists=None, n_probe=8, iterations=10, seed=0, normalized=False, deleted=None):
+        self.vectors = embeddings if normalized else normalize_rows(embeddings)
+        n_rows = self.vectors.shape[0]
+        self.n_lists = max(1, min(n_lists or int(np.sqrt(n_rows)), n_rows))
+        self.n_probe = n_probe
+        self.centroids = self._train(iterations, seed)
+        assignments = self._assign(self.vectors)
+        self.order = np.argsort(assignments, kind="stable")
+        if deleted is not None:
+            self.order = self.order[~np.asarray(deleted)[self.order]]
+        self.offsets = np.searchsorted(assignments[self.order], np.arange(self.n_lists + 1))
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def options(self):
+        return {"n_lists": self.n_lists, "n_probe": self.n_probe}
+
+    def save(self, directory):
+        np.save(os.path.join(directory, "ivf_centroids.npy"), self.centroids)
+        np.save(os.path.join(directory, "ivf_order.npy"), self.order)
+        np.save(os.path.join(directory, "ivf_offsets.npy"), self.offsets)
+
+    @classmethod
+    def load(cls, directory, vectors, options, deleted=None):
+        # Deleted rows were already left out of the stored lists
+        index = cls.__new__(cls)
+        index.vectors = vectors
+        index.n_lists = options["n_lists"]
+        index.n_probe = options["n_probe"]
+        index.centroids = np.load(os.path.join(directory, "ivf_centroids.npy"))
+        index.order = np.load(os.path.join(directory, "ivf_order.npy"), mmap_mode="r")
+        index.offsets = np.load(os.path.join(directory, "ivf_offsets.npy"))
+        return index
+
+    def _train(self, iterations, seed):
+        rng = np.random.default_rng(seed)
+        # Train on a sample, k-means on millions of rows is not needed for good centroids
+        sample_size = min(self.vectors.shape[0], max(256 * self.n_lists, 10000))
+        sample = self.vectors[np.sort(rng.choice(self.vectors.shape[0], sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, self.n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = np.bincount(assignments, minlength=self.n_lists) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def _assign(self, vectors, batch_size=65536):
+        return np.concatenate([
+            np.argmax(vectors[start:start + batch_size] @ self.centroids.T, axis=1)
+            for start in range(0, vectors.shape[0], batch_size)
+        ])
+
+    def kneighbors(self, X, n_neighbors=1, return_distance=True):
+        queries = normalize_rows(X)
+        n_probe = min(self.n_probe, self.n_lists)
+        probes, _ = top_k(queries @ self.centroids.T, n_probe)
+        distances = np.full((queries.shape[0], n_neighbors), np.inf, dtype=np.float32)
+        indices = np.zeros((queries.shape[0], n_neighbors), dtype=np.int64)
+        for row, (query, lists) in enumerate(zip(queries, probes)):
+            candidates = np.sort(np.concatenate([self.order[self.offsets[l]:self.offsets[l + 1]] for l in lists]))
+            if candidates.size == 0:
+                continue
+            best, similarities = top_k((self.vectors[candidates] @ query)[None, :], n_neighbors)
+            found = best.shape[1]
+            indices[row, :found] = candidates[best[0]]
+            distances[row, :found] = 1.0 - similarities[0]
+        if not return_distance:
+            return indices
+        return distances, indices
+
+
+class QuantizedIndex:
+    """
+    Base class for indexes that scan compressed codes instead of float32 vectors.
+
+    Scores are computed block by block directly from the codes. With rerank > 0 the best
+    `rerank` candidates are scored again with the exact vectors, which are only read for
+    those rows (the bundle's embeddings.npy is memory-mapped, so the rest never gets loaded).
+
+    Parameters:
+    embeddings (np.ndarray): The stored question embeddings, one row per question.
+    rerank (int): Number of candidates re-ranked with the exact vectors (0 = no re-ranking).
+    normalized (bool): Set to True if the rows already have unit length.
+    deleted (np.ndarray): Optional boolean mask of rows that must never be returned (tombstones).
+    """
+
+    kind = None
+    block_size = 65536
+
+    def __init__(self, embeddings, rerank=0, normalized=False, deleted=None):
+        self.vectors = embeddings if normalized else normalize_rows(embeddings)
+        self.rerank = rerank
+        self.deleted = np.asarray(deleted, dtype=bool) if deleted is not None else None
+        self._encode(self.vectors)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def code_bytes(self):
+        """
+        Memory used by the compressed codes (and their codebooks).
+        """
+        raise NotImplementedError
+
+    def options(self):
+        return {"rerank": self.rerank}
+
+    def _encode(self, vectors):
+        raise NotImplementedError
+
+    def _scores(self, queries, start, stop):
+        raise NotImplementedError
+
+    def save(self, directory):
+        for name, array in self._arrays().items():
+            np.save(os.path.join(directory, f"{self.kind}_{name}.npy"), array)
+
+    @classmethod
+    def load(cls, directory, vectors, options, deleted=None):
+        index = cls.__new__(cls)
+        index.vectors = vectors
+        index.deleted = np.asarray(deleted, dtype=bool) if deleted is not None else None
+        for name, value in options.items():
+            setattr(index, name, value)
+        for name in index._array_names:
+            setattr(index, name, np.load(os.path.join(directory, f"{cls.kind}_{name}.npy"), mmap_mode="r"))
+        return index
+
+    def _arrays(self):
+        return {name: getattr(self, name) for name in self._array_names}
+
+    def kneighbors(self, X, n_neighbors=1, return_distance=True):
+        queries = normalize_rows(X)
+        wanted = max(n_neighbors, self.rerank)
+        best_indices = np.zeros((queries.shape[0], 0), dtype=np.int64)
+        best_scores = np.zeros((queries.shape[0], 0), dtype=np.float32)
+        for start in range(0, len(self), self.block_size):
+            stop = min(start + self.block_size, len(self))
+            scores = self._scores(queries, start, stop)
+            if self.deleted is not None:
+                scores[:, self.deleted[start:stop]] = -np.inf
+            indices, scores = top_k(scores, wanted)
+            # Merge the block's best rows with the best rows so far
+            merged_indices = np.concatenate([best_indices, indices + start], axis=1)
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            order, best_scores = top_k(merged_scores, wanted)
+            best_indices = np.take_along_axis(merged_indices, order, axis=1)
+
+        if self.rerank:
+            # Candidates in row order, so ties are broken by the lower row like in ExactIndex
+            order = np.argsort(best_indices, axis=1)
+            best_indices = np.take_along_axis(best_indices, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            rows = np.unique(best_indices)
+            exact = np.asarray(self.vectors[rows], dtype=np.float32)
+            positions = np.searchsorted(rows, best_indices)
+            scores = np.einsum("qd,qkd->qk", queries, exact[positions])
+            scores[~np.isfinite(best_scores)] = -np.inf
+            order, best_scores = top_k(scores, n_neighbors)
+            best_indices = np.take_along_axis(best_indices, order, axis=1)
+        else:
+            best_indices, best_scores = best_indices[:, :n_neighbors], best_scores[:, :n_neighbors]
+
+        if not return_distance:
+            return best_indices
+        return 1.0 - best_scores, best_indices
+
+
+class Float16Index(QuantizedIndex):
+    """
+    Stores the vectors as float16 (half the memory of float32).
+    """
+
+    kind = "float16"
+    _array_names = ("codes",)
+
+    def _encode(self, vectors):
+        self.codes = np.asarray(vectors, dtype=np.float16)
+
+    def code_bytes(self):
+        return self.codes.nbytes
+
+    def _scores(self, queries, start, stop):
+        return queries @ np.asarray(self.codes[start:stop], dtype=np.float32).T
+
+
+class Int8Index(QuantizedIndex):
+    """
+    Scalar quantization: every dimension is scaled into -127..127 and stored as int8 (a quarter of float32).
+    """
+
+    kind = "int8"
+    _array_names = ("codes", "scale")
+
+    def _encode(self, vectors):
+        self.scale = np.maximum(np.abs(vectors).max(axis=0), 1e-12).astype(np.float32) / 127.0
+        self.codes = np.empty(vectors.shape, dtype=np.int8)
+        for start in range(0, vectors.shape[0], self.block_size):
+            block = np.asarray(vectors[start:start + self.block_size]) / self.scale
+            self.codes[start:start + self.block_size] = np.clip(np.rint(block), -127, 127)
+
+    def code_bytes(self):
+        return self.codes.nbytes + self.scale.nbytes
+
+    def _scores(self, queries, start, stop):
+        return (queries * self.scale) @ np.asarray(self.codes[start:stop], dtype=np.float32).T
+
+
+class PQIndex(QuantizedIndex):
+    """
+    Product quantization: the vector is cut into n_subspaces pieces and every piece is
+    replaced by the id of its nearest of 256 centroids, so a vector takes n_subspaces bytes.
+    Queries are scored with per-query lookup tables (asymmetric distance computation).
+
+    Parameters:
+    n_subspaces (int): Number of pieces (must divide the dimension, default: dimension / 8).
+    iterations (int): Number of k-means iterations per subspace.
+    seed (int): Seed for the k-means initialisation.
+    """
+
+    kind = "pq"
+    _array_names = ("codes", "centroids")
+
+    def __init__(self, embeddings, n_subspaces=None, rerank=0, iterations=10, seed=0, normalized=False, deleted=None):
+        dimension = np.shape(embeddings)[1]
+        self.n_subspaces = n_subspaces or max(1, dimension // 8)
+        if dimension % self.n_subspaces:
+            raise ValueError(f"n_subspaces ({self.n_subspaces}) must divide the dimension ({dimension})")
+        self.iterations = iterations
+        self.seed = seed
+        super().__init__(embeddings, rerank, normalized, deleted)
+
+    def options(self):
+        return {"rerank": self.rerank, "n_subspaces": self.n_subspaces}
+
+    def _split(self, vectors):
+        return np.asarray(vectors, dtype=np.float32).reshape(len(vectors), self.n_subspaces, -1)
+
+    def _encode(self, vectors):
+        rng = np.random.default_rng(self.seed)
+        n_rows = vectors.shape[0]
+        n_centroids = min(256, n_rows)
+        # About 64 training points per centroid are plenty for the codebooks
+        sample = self._split(vectors[np.sort(rng.choice(n_rows, min(n_rows, 64 * 256), replace=False))])
+        self.centroids = np.empty((self.n_subspaces, n_centroids, sample.shape[2]), dtype=np.float32)
+        for subspace in range(self.n_subspaces):
+            points = sample[:, subspace]
+            centroids = points[rng.choice(len(points), n_centroids, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignments = self._nearest(points, centroids)
+                counts = np.bincount(assignments, minlength=n_centroids)
+                sums = np.stack([
+                    np.bincount(assignments, weights=points[:, d], minlength=n_centroids)
+                    for d in range(points.shape[1])
+                ], axis=1)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            self.centroids[subspace] = centroids
+        self.codes = np.empty((n_rows, self.n_subspaces), dtype=np.uint8)
+        for start in range(0, n_rows, self.block_size):
+            block = self._split(vectors[start:start + self.block_size])
+            for subspace in range(self.n_subspaces):
+                self.codes[start:start + len(block), subspace] = self._nearest(block[:, subspace], self.centroids[subspace])
+
+    @staticmethod
+    def _nearest(points, centroids):
+        # argmin of the squared euclidean distance, ||p||^2 is the same for every centroid
+        return np.argmin((centroids ** 2).sum(axis=1) - 2 * points @ centroids.T, axis=1)
+
+    def code_bytes(self):
+        return self.codes.nbytes + self.centroids.nbytes
+
+    def _scores(self, queries, start, stop):
+        # tables[q, m, c]: inner product of query piece m with centroid c of subspace m
+        tables = np.einsum("qmd,mcd->qmc", self._split(queries), self.centroids)
+        codes = np.asarray(self.codes[start:stop], dtype=np.intp)
+        scores = np.zeros((queries.shape[0], stop - start), dtype=np.float32)
+        for subspace in range(self.n_subspaces):
+            scores += tables[:, subspace, codes[:, subspace]]
+        return scores
+
+
+INDEX_TYPES = {
+    "exact": ExactIndex,
+    "ivf": IVFIndex,
+    "float16": Float16Index,
+    "int8": Int8Index,
+    "pq": PQIndex,
+}
+
+
+def build_index(kind, embeddings, **options):
+    """
+    Builds a nearest-neighbour index of the given kind.
+
+    Parameters:
+    kind (str): One of INDEX_TYPES ("exact", "ivf", "float16", "int8", "pq").
+    embeddings (np.ndarray): The stored question embeddings.
+    **options: Extra arguments for the index class (e.g. n_lists, n_probe, rerank).
+
+    Returns:
+    An index object with a kneighbors(X, n_neighbors) method.
+    """
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{kind}', choose from: {', '.join(INDEX_TYPES)}")
+    return INDEX_TYPES[kind](embeddings, **options)
+
+
+def load_index(kind, directory, vectors, options, deleted=None):
+    """
+    Loads an index that was saved with index.save(directory) on top of already normalized vectors.
+    """
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{kind}', choose from: {', '.join(INDEX_TYPES)}")
+    return INDEX_TYPES[kind].load(directory, vectors, options, deleted)
+
+
+def recall_at_k(index, reference, queries, k=1):
+    """
+    Measures which fraction of the exact top-k neighbours an (approximate) index finds.
+
+    Parameters:
+    index: The index to evaluate.
+    reference: An exact index over the same embeddings.
+    queries (np.ndarray): Query embeddings.
+    k (int): Number of neighbours compared per query.
+
+    Returns:
+    float: The recall between 0 and 1.
+    """
+    _, found = index.kneighbors(queries, n_neighbors=k)
+    _, expected = reference.kneighbors(queries, n_neighbors=k)
+    hits = sum(len(set(a) & set(b)) for a, b in zip(found, expected))
+    return hits / expected.size
+
+
+def sample_queries(embeddings, count=1000, deleted=None, noise=0.2, seed=0):
+    """
+    Random query vectors for measuring recall: randomly chosen stored rows moved by Gaussian
+    noise (of about `noise` length), so a query is not just the stored vector, which is its own
+    exact nearest neighbour and makes every index look perfect.
+
+    Parameters:
+    embeddings (np.ndarray): The stored (normalized) embeddings.
+    count (int): Number of queries (at most the number of live rows).
+    deleted (np.ndarray): Optional boolean mask of tombstoned rows that are not sampled.
+    noise (float): Expected length of the noise added to the unit-length rows.
+    seed (int): Seed of the random sample.
+
+    Returns:
+    np.ndarray: The normalized queries, one per row.
+    """
+    rng = np.random.default_rng(seed)
+    live = np.arange(len(embeddings)) if deleted is None else np.flatnonzero(~np.asarray(deleted, dtype=bool))
+    rows = np.sort(rng.choice(live, min(count, len(live)), replace=False))
+    vectors = normalize_rows(embeddings[rows])
+    vectors += rng.normal(scale=noise / np.sqrt(vectors.shape[1]), size=vectors.shape).astype(np.float32)
+    return normalize_rows(vectors)